@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024 Salvador E. Tropea
+# Copyright (c) 2024 Instituto Nacional de Tecnología Industrial
+# License: GPL-3.0
+# Project: KiBot (formerly KiPlot)
+"""
+Reproducible performance benchmarks for KiBot.
+
+- generate: creates a synthetic KiCad 6 project (board and hierarchical schematic) of the requested size.
+  The same seed and sizes always produce the same files.
+- run: runs the scenarios (each one is a KiBot configuration exercising a heavy path) using a generated
+  project and stores the times in a JSON file, with a statistical summary for each scenario.
+- compare: compares two JSON results, the regressions are reported and the exit code is 1 if any.
+
+Usage:
+  bench.py generate [--components N] [--nets N] [--layers N] [--sheets N] [--seed N] DIR
+  bench.py run [--repeat N] [--warmup N] [--scenario NAME]... [-o RESULT] DIR
+  bench.py compare [--threshold PERCENT] BASELINE CURRENT
+  bench.py list
+
+Example:
+  bench.py generate --components 2000 --layers 4 --sheets 8 /tmp/bench
+  bench.py run -o baseline.json /tmp/bench
+  (change the code)
+  bench.py run -o current.json /tmp/bench
+  bench.py compare baseline.json current.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+KIBOT = os.path.join(ROOT, 'src', 'kibot')
+PROJECT = 'bench'
+RESULTS_VERSION = 1
+# Values used for the components, the BoM groups them
+R_VALUES = ['10', '22', '47', '100', '220', '470', '1k', '2k2', '4k7', '10k', '22k', '47k', '100k']
+C_VALUES = ['10p', '22p', '100p', '1n', '10n', '100n', '1u', '10u']
+SMD_FP = ('{lib}_SMD:{kind}_0805_2012Metric', 1.025, 'smd roundrect', '(size 1.15 1.4)',
+          '"{side}.Cu" "{side}.Paste" "{side}.Mask"', ' (roundrect_rratio 0.25)')
+THT_FP = ('{lib}_THT:{kind}_Axial_DIN0207_L6.3mm_D2.5mm_P10.16mm_Horizontal', 5.08, 'thru_hole circle',
+          '(size 1.6 1.6) (drill 0.8)', '"*.Cu" "*.Mask"', '')
+LIB_SYMBOL = '''    (symbol "Device:{kind}" (pin_numbers hide) (pin_names (offset 0)) (in_bom yes) (on_board yes)
+      (property "Reference" "{kind}" (id 0) (at 2.032 0 90)
+        (effects (font (size 1.27 1.27)))
+      )
+      (property "Value" "{kind}" (id 1) (at 0 0 90)
+        (effects (font (size 1.27 1.27)))
+      )
+      (property "Footprint" "" (id 2) (at -1.778 0 90)
+        (effects (font (size 1.27 1.27)) hide)
+      )
+      (property "Datasheet" "~" (id 3) (at 0 0 0)
+        (effects (font (size 1.27 1.27)) hide)
+      )
+      (symbol "{kind}_0_1"
+        (rectangle (start -1.016 -2.54) (end 1.016 2.54)
+          (stroke (width 0.254) (type default) (color 0 0 0 0))
+          (fill (type none))
+        )
+      )
+      (symbol "{kind}_1_1"
+        (pin passive line (at 0 3.81 270) (length 1.27)
+          (name "~" (effects (font (size 1.27 1.27))))
+          (number "1" (effects (font (size 1.27 1.27))))
+        )
+        (pin passive line (at 0 -3.81 90) (length 1.27)
+          (name "~" (effects (font (size 1.27 1.27))))
+          (number "2" (effects (font (size 1.27 1.27))))
+        )
+      )
+    )
+'''
+# name: (description, KiBot targets, configuration)
+SCENARIOS = {
+    'sch_parse': ('Schematic parse (BoM without grouping)', ['bom'], '''
+outputs:
+  - name: bom
+    type: bom
+    options:
+      format: CSV
+      group_fields: []
+      columns: [References, Value]
+'''),
+    'bom_group': ('BoM grouping', ['bom'], '''
+outputs:
+  - name: bom
+    type: bom
+    options:
+      format: CSV
+      group_fields: ['Part', 'Value', 'Footprint']
+'''),
+    'layers': ('Layer plotting (Gerbers)', ['gerbers'], '''
+outputs:
+  - name: gerbers
+    type: gerber
+    layers: [copper, F.Mask, B.Mask, F.SilkS, B.SilkS, F.Paste, B.Paste, Edge.Cuts]
+'''),
+    'pcb_print': ('PCB print (PDF)', ['print'], '''
+outputs:
+  - name: print
+    type: pcb_print
+    options:
+      format: PDF
+      pages:
+        - layers: [F.Cu, F.Mask, F.SilkS, Edge.Cuts]
+        - layers: [B.Cu, B.Mask, B.SilkS, Edge.Cuts]
+          mirror: true
+'''),
+    'position': ('Position (CSV)', ['position'], '''
+outputs:
+  - name: position
+    type: position
+    options:
+      format: CSV
+      only_smd: false
+'''),
+    'report': ('Design report', ['report'], '''
+outputs:
+  - name: report
+    type: report
+'''),
+    'variant': ('Variant application (BoM and PCB)', ['bom', 'pcb'], '''
+variants:
+  - name: production
+    type: kibom
+    variant: production
+
+outputs:
+  - name: bom
+    type: bom
+    options:
+      format: CSV
+      variant: production
+
+  - name: pcb
+    type: pcb_variant
+    options:
+      variant: production
+'''),
+}
+
+
+# ##############################################################################################################
+#  Synthetic project
+# ##############################################################################################################
+
+
+class Generator(object):
+    def __init__(self, components, nets, layers, sheets, seed):
+        self.components = components
+        self.nets = nets
+        self.layers = layers
+        self.sheets = sheets
+        self.seed = seed
+        self.rnd = random.Random(seed)
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
+
+    def create_parts(self):
+        """ The components, distributed between the sheets """
+        self.sheet_uuids = [self.uuid() for _ in range(self.sheets)]
+        self.parts = []
+        for n in range(self.components):
+            kind = 'C' if n % 3 == 2 else 'R'
+            value = self.rnd.choice(C_VALUES if kind == 'C' else R_VALUES)
+            # 10% THT, 25% on the bottom
+            fp = THT_FP if n % 10 == 9 else SMD_FP
+            config = '-production' if n % 11 == 5 else ''
+            sheet = n % self.sheets if self.sheets else None
+            nets = (n % self.nets+1, (n*7+3) % self.nets+1)
+            self.parts.append((kind, '{}{}'.format(kind, n+1), value, fp, n % 4 == 3, config, sheet, self.uuid(), nets))
+
+    def footprint(self, kind, fp):
+        return fp[0].format(lib='Resistor' if kind == 'R' else 'Capacitor', kind=kind)
+
+    def net_name(self, net):
+        return 'N{}'.format(net)
+
+    # ##########################################################################################################
+    #  Schematic
+    # ##########################################################################################################
+
+    def sch_header(self, f, paper='A3'):
+        f.write('(kicad_sch (version 20211123) (generator eeschema)\n\n')
+        f.write('  (uuid {})\n\n'.format(self.uuid()))
+        f.write('  (paper "{}")\n\n'.format(paper))
+        f.write('  (lib_symbols\n')
+        for kind in ('C', 'R'):
+            f.write(LIB_SYMBOL.format(kind=kind))
+        f.write('  )\n\n')
+
+    def sch_symbols(self, f, parts):
+        for c, (kind, ref, value, fp, _, config, _, uid, nets) in enumerate(parts):
+            x = 25.4 + (c % 30)*12.7
+            y = 25.4 + (c // 30)*12.7
+            f.write('  (symbol (lib_id "Device:{}") (at {:.2f} {:.2f} 0) (unit 1)\n'.format(kind, x, y))
+            f.write('    (in_bom yes) (on_board yes)\n')
+            f.write('    (uuid {})\n'.format(uid))
+            fields = [('Reference', ref), ('Value', value), ('Footprint', self.footprint(kind, fp)), ('Datasheet', '~'),
+                      ('Config', config)]
+            for id, (name, val) in enumerate(fields):
+                f.write('    (property "{}" "{}" (id {}) (at {:.2f} {:.2f} 0)\n'.format(name, val, id, x+1.778, y))
+                f.write('      (effects (font (size 1.27 1.27)){})\n'.format(' hide' if id > 1 else ''))
+                f.write('    )\n')
+            f.write('    (pin "1" (uuid {}))\n'.format(self.uuid()))
+            f.write('    (pin "2" (uuid {}))\n'.format(self.uuid()))
+            f.write('  )\n\n')
+            f.write('  (label "{}" (at {:.2f} {:.2f} 0)\n'.format(self.net_name(nets[0]), x, y-3.81))
+            f.write('    (effects (font (size 1.27 1.27)) (justify left bottom))\n')
+            f.write('    (uuid {})\n'.format(self.uuid()))
+            f.write('  )\n\n')
+
+    def write_schematic(self, dir):
+        root = os.path.join(dir, PROJECT+'.kicad_sch')
+        with open(root, 'wt') as f:
+            self.sch_header(f)
+            self.sch_symbols(f, [p for p in self.parts if p[6] is None])
+            for n, uid in enumerate(self.sheet_uuids):
+                x = 25.4 + (n % 8)*38.1
+                y = 200 + (n // 8)*25.4
+                f.write('  (sheet (at {:.2f} {:.2f}) (size 25.4 12.7) (fields_autoplaced)\n'.format(x, y))
+                f.write('    (stroke (width 0) (type solid) (color 0 0 0 0))\n')
+                f.write('    (fill (color 0 0 0 0.0000))\n')
+                f.write('    (uuid {})\n'.format(uid))
+                f.write('    (property "Sheet name" "Sheet {}" (id 0) (at {:.2f} {:.2f} 0)\n'.format(n+1, x, y-0.7))
+                f.write('      (effects (font (size 1.27 1.27)) (justify left bottom))\n')
+                f.write('    )\n')
+                f.write('    (property "Sheet file" "sub_{}.kicad_sch" (id 1) (at {:.2f} {:.2f} 0)\n'.format(n+1, x, y+13.4))
+                f.write('      (effects (font (size 1.27 1.27)) (justify left top))\n')
+                f.write('    )\n')
+                f.write('  )\n\n')
+            f.write('  (sheet_instances\n')
+            f.write('    (path "/" (page "1"))\n')
+            for n, uid in enumerate(self.sheet_uuids):
+                f.write('    (path "/{}" (page "{}"))\n'.format(uid, n+2))
+            f.write('  )\n\n')
+            f.write('  (symbol_instances\n')
+            for (kind, ref, value, fp, _, _, sheet, uid, _) in self.parts:
+                f.write('    (path "{}"\n'.format(self.path(sheet, uid)))
+                f.write('      (reference "{}") (unit 1) (value "{}") (footprint "{}")\n'.
+                        format(ref, value, self.footprint(kind, fp)))
+                f.write('    )\n')
+            f.write('  )\n')
+            f.write(')\n')
+        for n in range(self.sheets):
+            with open(os.path.join(dir, 'sub_{}.kicad_sch'.format(n+1)), 'wt') as f:
+                self.sch_header(f)
+                self.sch_symbols(f, [p for p in self.parts if p[6] == n])
+                f.write(')\n')
+
+    def path(self, sheet, uid):
+        return '/'+uid if sheet is None else '/{}/{}'.format(self.sheet_uuids[sheet], uid)
+
+    # ##########################################################################################################
+    #  PCB
+    # ##########################################################################################################
+
+    def write_layers(self, f):
+        f.write('  (layers\n')
+        f.write('    (0 "F.Cu" signal)\n')
+        for n in range(1, self.layers-1):
+            f.write('    ({} "In{}.Cu" signal)\n'.format(n, n))
+        f.write('    (31 "B.Cu" signal)\n')
+        for id, name in ((32, 'B.Adhes'), (33, 'F.Adhes'), (34, 'B.Paste'), (35, 'F.Paste'), (36, 'B.SilkS'),
+                         (37, 'F.SilkS'), (38, 'B.Mask'), (39, 'F.Mask'), (40, 'Dwgs.User'), (41, 'Cmts.User'),
+                         (42, 'Eco1.User'), (43, 'Eco2.User'), (44, 'Edge.Cuts'), (45, 'Margin'), (46, 'B.CrtYd'),
+                         (47, 'F.CrtYd'), (48, 'B.Fab'), (49, 'F.Fab')):
+            f.write('    ({} "{}" user)\n'.format(id, name))
+        f.write('  )\n\n')
+
+    def write_footprint(self, f, part, x, y):
+        kind, ref, value, fp, bottom, _, sheet, uid, nets = part
+        _, pad_x, pad_type, pad_size, pad_layers, extra = fp
+        side = 'B' if bottom else 'F'
+        f.write('  (footprint "{}" (layer "{}.Cu")\n'.format(self.footprint(kind, fp), side))
+        f.write('    (tedit 5F68FEEE) (tstamp {})\n'.format(self.uuid()))
+        f.write('    (at {:.2f} {:.2f}{})\n'.format(x, y, ' 180' if bottom else ''))
+        f.write('    (path "{}")\n'.format(self.path(sheet, uid)))
+        f.write('    (attr {})\n'.format('through_hole' if fp is THT_FP else 'smd'))
+        for tp, text, dy, layer in (('reference', ref, -1.65, 'SilkS'), ('value', value, 1.65, 'Fab')):
+            f.write('    (fp_text {} "{}" (at 0 {}) (layer "{}.{}")\n'.format(tp, text, dy, side, layer))
+            f.write('      (effects (font (size 1 1) (thickness 0.15)){})\n'.format(' (justify mirror)' if bottom else ''))
+            f.write('      (tstamp {})\n'.format(self.uuid()))
+            f.write('    )\n')
+        f.write('    (fp_rect (start -1.85 -0.95) (end {:.2f} 0.95) (layer "{}.CrtYd") (width 0.05) (fill none)'
+                ' (tstamp {}))\n'.format(pad_x*2-1.85 if fp is THT_FP else 1.85, side, self.uuid()))
+        for n, net in enumerate(nets):
+            at = (-pad_x if n == 0 else pad_x) if fp is SMD_FP else n*pad_x*2
+            f.write('    (pad "{}" {} (at {} 0{}) {} (layers {}){} (net {} "{}") (tstamp {}))\n'.
+                    format(n+1, pad_type, at, ' 180' if bottom else '', pad_size, pad_layers.format(side=side), extra, net,
+                           self.net_name(net), self.uuid()))
+        f.write('  )\n\n')
+
+    def write_pcb(self, dir):
+        cols = max(int(len(self.parts)**0.5), 1)
+        rows = (len(self.parts)+cols-1)//cols
+        step_x = 12.7
+        step_y = 6.35
+        org_x = org_y = 20
+        with open(os.path.join(dir, PROJECT+'.kicad_pcb'), 'wt') as f:
+            f.write('(kicad_pcb (version 20211014) (generator pcbnew)\n\n')
+            f.write('  (general\n    (thickness 1.6)\n  )\n\n')
+            f.write('  (paper "A0")\n')
+            self.write_layers(f)
+            f.write('  (setup\n    (pad_to_mask_clearance 0)\n  )\n\n')
+            f.write('  (net 0 "")\n')
+            for net in range(1, self.nets+1):
+                f.write('  (net {} "{}")\n'.format(net, self.net_name(net)))
+            f.write('\n')
+            for n, part in enumerate(self.parts):
+                self.write_footprint(f, part, org_x+step_x*(n % cols+1), org_y+step_y*(n // cols+1))
+            # A track for each component, going to a via, using all the copper layers
+            copper = ['F.Cu']+['In{}.Cu'.format(n) for n in range(1, self.layers-1)]+['B.Cu']
+            for n, part in enumerate(self.parts):
+                x = org_x+step_x*(n % cols+1)
+                y = org_y+step_y*(n // cols+1)
+                net = part[8][1]
+                fp = part[3]
+                start_x = x+(fp[1] if fp is SMD_FP else fp[1]*2)*(-1 if part[4] and fp is SMD_FP else 1)
+                layer = copper[n % len(copper)] if fp is THT_FP else ('B.Cu' if part[4] else 'F.Cu')
+                f.write('  (segment (start {:.3f} {:.3f}) (end {:.3f} {:.3f}) (width {}) (layer "{}") (net {}) (tstamp {}))\n'.
+                        format(start_x, y, start_x, y+2.54, (0.25, 0.4, 0.6)[n % 3], layer, net, self.uuid()))
+                f.write('  (via (at {:.3f} {:.3f}) (size 0.8) (drill 0.4) (layers "F.Cu" "B.Cu") (net {}) (tstamp {}))\n'.
+                        format(start_x, y+2.54, net, self.uuid()))
+            w = step_x*(cols+1)
+            h = step_y*(rows+1)
+            for (x1, y1, x2, y2) in ((0, 0, w, 0), (w, 0, w, h), (w, h, 0, h), (0, h, 0, 0)):
+                f.write('  (gr_line (start {} {}) (end {} {}) (layer "Edge.Cuts") (width 0.1) (tstamp {}))\n'.
+                        format(org_x+x1, org_y+y1, org_x+x2, org_y+y2, self.uuid()))
+            f.write(')\n')
+
+    def generate(self, dir):
+        os.makedirs(dir, exist_ok=True)
+        self.create_parts()
+        self.write_schematic(dir)
+        self.write_pcb(dir)
+        info = {'components': self.components, 'nets': self.nets, 'layers': self.layers, 'sheets': self.sheets,
+                'seed': self.seed}
+        with open(os.path.join(dir, PROJECT+'.json'), 'wt') as f:
+            json.dump(info, f, indent=2)
+        return info
+
+
+# ##############################################################################################################
+#  Run the scenarios
+# ##############################################################################################################
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def kibot_version():
+    sys.path.insert(0, ROOT)
+    try:
+        from kibot import __version__
+        return __version__
+    except Exception:
+        return None
+
+
+def summary(values):
+    return {'min': min(values), 'max': max(values), 'mean': statistics.mean(values), 'median': statistics.median(values),
+            'stdev': statistics.stdev(values) if len(values) > 1 else 0.0}
+
+
+def run_kibot(dir, cfg, targets, out_dir):
+    """ Runs KiBot, returns the elapsed time and the peak memory (KiB) """
+    cmd = [sys.executable, KIBOT, '-b', os.path.join(dir, PROJECT+'.kicad_pcb'), '-e', os.path.join(dir, PROJECT+'.kicad_sch'),
+           '-c', cfg, '-d', out_dir]+targets
+    start = time.perf_counter()
+    with open(os.path.join(out_dir, 'kibot.log'), 'wt') as log:
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives us the resources used by this process, not all the children
+        _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter()-start
+    # os.waitstatus_to_exitcode needs Python 3.9
+    code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    # Already reaped, let Popen know it
+    proc.returncode = code
+    if code:
+        with open(log.name, 'rt') as f:
+            tail = ''.join(f.readlines()[-20:])
+        raise RuntimeError('KiBot returned {} for `{}`:\n{}'.format(code, ' '.join(cmd), tail))
+    return elapsed, usage.ru_maxrss
+
+
+def run_scenario(name, dir, repeat, warmup):
+    _, targets, cfg = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as tmp:
+        cfg_file = os.path.join(tmp, name+'.kibot.yaml')
+        with open(cfg_file, 'wt') as f:
+            f.write('kibot:\n  version: 1\n'+cfg)
+        times = []
+        memory = []
+        for n in range(warmup+repeat):
+            out_dir = os.path.join(tmp, 'out{}'.format(n))
+            os.makedirs(out_dir)
+            elapsed, rss = run_kibot(dir, cfg_file, targets, out_dir)
+            if n >= warmup:
+                times.append(elapsed)
+                memory.append(rss)
+    return {'times': times, 'time': summary(times), 'max_rss_kib': max(memory)}
+
+
+def cmd_run(args):
+    with open(os.path.join(args.dir, PROJECT+'.json'), 'rt') as f:
+        sizes = json.load(f)
+    names = args.scenario or list(SCENARIOS.keys())
+    for name in names:
+        if name not in SCENARIOS:
+            print('Unknown scenario `{}`'.format(name), file=sys.stderr)
+            return 2
+    res = {'version': RESULTS_VERSION,
+           'meta': {'kibot': kibot_version(), 'git': git_revision(), 'python': platform.python_version(),
+                    'host': platform.node(), 'platform': platform.platform(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'repeat': args.repeat, 'warmup': args.warmup},
+           'project': sizes,
+           'scenarios': {}}
+    for name in names:
+        print('{:>10}: '.format(name), end='', flush=True)
+        try:
+            r = run_scenario(name, args.dir, args.repeat, args.warmup)
+        except RuntimeError as e:
+            print('FAILED')
+            print(e, file=sys.stderr)
+            return 1
+        res['scenarios'][name] = r
+        t = r['time']
+        print('median {:7.3f} s  min {:7.3f} s  stdev {:6.3f} s  {:8.1f} MiB'.
+              format(t['median'], t['min'], t['stdev'], r['max_rss_kib']/1024))
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(res, f, indent=2)
+    return 0
+
+
+# ##############################################################################################################
+#  Compare
+# ##############################################################################################################
+
+
+def cmd_compare(args):
+    with open(args.baseline, 'rt') as f:
+        base = json.load(f)
+    with open(args.current, 'rt') as f:
+        cur = json.load(f)
+    if base['project'] != cur['project']:
+        print('Warning: the results are for different projects ({} vs {})'.format(base['project'], cur['project']),
+              file=sys.stderr)
+    regressions = 0
+    print('{:>10}  {:>9}  {:>9}  {:>8}'.format('scenario', 'baseline', 'current', 'change'))
+    for name, b in base['scenarios'].items():
+        c = cur['scenarios'].get(name)
+        if c is None:
+            print('{:>10}  {:9.3f}  {:>9}'.format(name, b['time']['median'], 'missing'))
+            continue
+        b_med = b['time']['median']
+        c_med = c['time']['median']
+        change = (c_med-b_med)/b_med*100
+        # Slower than the threshold and more than the noise of both measurements
+        noise = 2*max(b['time']['stdev'], c['time']['stdev'])
+        regression = change > args.threshold and c_med-b_med > noise
+        regressions += regression
+        print('{:>10}  {:9.3f}  {:9.3f}  {:+7.1f}%{}'.format(name, b_med, c_med, change, '  REGRESSION' if regression else ''))
+    if regressions:
+        print('{} regression/s'.format(regressions))
+    return 1 if regressions else 0
+
+
+def cmd_generate(args):
+    if args.layers < 2 or args.layers % 2 or args.layers > 32:
+        print('The number of layers must be even, between 2 and 32', file=sys.stderr)
+        return 2
+    if args.components < 1 or args.nets < 1 or args.sheets < 0:
+        print('Wrong size', file=sys.stderr)
+        return 2
+    info = Generator(args.components, args.nets, args.layers, args.sheets, args.seed).generate(args.dir)
+    print('Generated {} components, {} nets, {} layers, {} sheets at {}'.
+          format(info['components'], info['nets'], info['layers'], info['sheets'], args.dir))
+    return 0
+
+
+def cmd_list(args):
+    for name, (desc, _, _) in SCENARIOS.items():
+        print('{:>10}: {}'.format(name, desc))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KiBot performance benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+    gen = sub.add_parser('generate', help='Create a synthetic project')
+    gen.add_argument('--components', type=int, default=500)
+    gen.add_argument('--nets', type=int, default=200)
+    gen.add_argument('--layers', type=int, default=4)
+    gen.add_argument('--sheets', type=int, default=4)
+    gen.add_argument('--seed', type=int, default=1)
+    gen.add_argument('dir')
+    gen.set_defaults(func=cmd_generate)
+    run = sub.add_parser('run', help='Run the scenarios')
+    run.add_argument('--repeat', type=int, default=5)
+    run.add_argument('--warmup', type=int, default=1)
+    run.add_argument('--scenario', action='append', help='Run only this scenario (can be repeated)')
+    run.add_argument('-o', '--output', help='JSON file for the results')
+    run.add_argument('dir', help='Directory created by `generate`')
+    run.set_defaults(func=cmd_run)
+    cmp = sub.add_parser('compare', help='Compare two results')
+    cmp.add_argument('--threshold', type=float, default=10, help='Slow down to consider a regression [%%]')
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+    cmp.set_defaults(func=cmd_compare)
+    lst = sub.add_parser('list', help='List the scenarios')
+    lst.set_defaults(func=cmd_list)
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024 Salvador E. Tropea
+# Copyright (c) 2024 Instituto Nacional de Tecnología Industrial
+# License: GPL-3.0
+# Project: KiBot (formerly KiPlot)
+"""
+Benchmark for the XLSX BoM writer: regular vs streaming (constant memory) mode.
+
+Uses a synthetic BoM, reports the time and the peak of Python memory used for each mode and checks
+that both workbooks contain the same cells, using the same formats, the same rows heights and columns.
+
+Usage: xlsx_bom.py [ROWS] [COLUMNS]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from xml.etree import ElementTree as ET
+from zipfile import ZipFile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from kibot.bom.xlsx_writer import write_xlsx  # noqa: E402
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+class Group(object):
+    def __init__(self, n, cols):
+        self.fields = {c.lower(): '{}_{}'.format(c, n) if n % 7 else '' for c in cols}
+        self.fields['datasheet'] = 'https://example.com/{}.pdf'.format(n)
+        self.fields['description'] = 'A long description for the component number {} '.format(n)*(1 + n % 3)
+        self.components = [SimpleNamespace(ref='R{}'.format(n))]
+        self.fitted = n % 10 != 0
+
+    def is_fitted(self):
+        return self.fitted
+
+    def get_row(self, cols):
+        return [self.fields.get(c.lower(), '') for c in cols]
+
+    def get_field(self, name):
+        return self.fields.get(name, '')
+
+
+def create_cfg(streaming, cols):
+    xlsx = SimpleNamespace(datasheet_as_link='Datasheet', digikey_link=None, mouser_link=None, lcsc_link=None,
+                           highlight_empty=True, max_col_width=60, style='modern-blue', col_colors=True, row_colors=[],
+                           logo=None, logo_scale=2, title='Benchmark', extra_info=['Extra info'], hide_pcb_info=True,
+                           hide_stats_info=True, generate_dnf=True, kicost=False, streaming=streaming)
+    return SimpleNamespace(xlsx=xlsx, n_total=2, n_fitted=1, ignore_dnf=True, aggregate=[None],
+                           _column_comments=['']*len(cols), _column_levels=[0]*len(cols))
+
+
+def read_workbook(fname):
+    """ Cells (value and format), rows heights and columns for each sheet """
+    res = {}
+    with ZipFile(fname) as z:
+        strs = []
+        if 'xl/sharedStrings.xml' in z.namelist():
+            strs = [''.join(t.text or '' for t in si.iter(NS+'t'))
+                    for si in ET.fromstring(z.read('xl/sharedStrings.xml')).iter(NS+'si')]
+        for name in sorted(n for n in z.namelist() if n.startswith('xl/worksheets/sheet')):
+            root = ET.fromstring(z.read(name))
+            cells = {}
+            for r in root.iter(NS+'row'):
+                cells[r.attrib['r']] = r.attrib.get('ht')
+                for c in r.iter(NS+'c'):
+                    kind = c.attrib.get('t')
+                    if kind == 's':
+                        value = strs[int(c.find(NS+'v').text)]
+                    elif kind == 'inlineStr':
+                        value = ''.join(t.text or '' for t in c.iter(NS+'t'))
+                    else:
+                        v = c.find(NS+'v')
+                        value = v.text if v is not None else None
+                    cells[c.attrib['r']] = (value, c.attrib.get('s'))
+            cols = [dict(c.attrib) for c in root.iter(NS+'col')]
+            res[name] = (cells, cols)
+    return res
+
+
+def run(streaming, groups, cols, fname):
+    cfg = create_cfg(streaming, cols)
+    tracemalloc.start()
+    start = time.perf_counter()
+    write_xlsx(fname, groups, cols, cols, cfg)
+    elapsed = time.perf_counter()-start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_cols = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    cols = ['Row', 'Description', 'Part', 'Value', 'References', 'Footprint', 'Datasheet']
+    cols += ['Field{}'.format(n) for n in range(n_cols-len(cols))]
+    groups = [Group(n, cols) for n in range(rows)]
+    with tempfile.TemporaryDirectory() as tmp:
+        names = {}
+        print('{} rows, {} columns'.format(rows, len(cols)))
+        for mode, streaming in (('regular', False), ('streaming', True)):
+            names[mode] = os.path.join(tmp, mode+'.xlsx')
+            elapsed, peak = run(streaming, groups, cols, names[mode])
+            size = os.path.getsize(names[mode])/1024
+            print('{:>10}: {:7.2f} s {:9.1f} MiB peak {:9.1f} KiB file'.format(mode, elapsed, peak/1024/1024, size))
+        same = read_workbook(names['regular']) == read_workbook(names['streaming'])
+        print('Equivalent workbooks: '+('yes' if same else 'NO'))
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
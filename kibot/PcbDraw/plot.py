@@ -803,11 +803,15 @@ class PlotComponents(PlotInterface):
     remapping: Callable[[str, str, str], Tuple[str, str]] = lambda ref, lib, name: (lib, name)
     resistor_values: Dict[str, ResistorValue] = field(default_factory=dict)
     no_warn_back: bool = False
+    components_in_defs: bool = False # Put the components in <defs>, so any placed component can be removed
 
     def render(self, plotter: PcbPlotter) -> None:
         self._plotter = plotter
         self._prefix = plotter.unique_prefix()
         self._used_components: Dict[str, PlacedComponentInfo] = {}
+        # Elements added for each reference
+        self.placed: Dict[str, List[etree.Element]] = {}
+        self.highlights: Dict[str, List[etree.Element]] = {}
         plotter.walk_components(invert_side=False, callback=self._append_component)
         plotter.walk_components(invert_side=True, callback=self._append_back_component)
 
@@ -843,10 +847,15 @@ class PlotComponents(PlotInterface):
                 return
             component_element, component_info = ret
             self._used_components[unique_name] = component_info
+            if self.components_in_defs:
+                self._plotter._defs.append(component_element)
+                component_element = etree.Element("use",
+                    attrib={"{http://www.w3.org/1999/xlink}href": "#" + component_info.id})
 
         self._plotter.append_component_element(etree.Comment(f"{lib}:{name}:{ref}"))
         group = etree.Element("g")
         group.append(component_element)
+        self.placed.setdefault(ref, []).append(group)
         ci = component_info
         group.attrib["transform"] = \
             f"translate({self._plotter.ki2svg(position[0])} {self._plotter.ki2svg(position[1])}) " + \
@@ -911,6 +920,7 @@ class PlotComponents(PlotInterface):
             f"rotate({-math.degrees(position[2])}) " + \
             f"translate({-(info.origin[0] - info.svg_offset[0]) * info.scale[0]}, {-(info.origin[1] - info.svg_offset[1]) * info.scale[1]})"
         self._plotter.append_highlight_element(h)
+        self.highlights.setdefault(ref, []).append(h)
 
     def _apply_resistor_code(self, root: etree.Element, id_prefix: str, ref: str, value: str) -> None:
         if root.find(f".//*[@id='{id_prefix}res_band1']") is None:
@@ -18,6 +18,7 @@ Usage:
   kibot [-v...] [-c PLOT_CONFIG] [--banner N] [-E DEF] ... [--only-names]
         [--sub-pcbs] --list-variants
   kibot [-v...] [-b BOARD] [-d OUT_DIR] [-p | -P] [--banner N] --example
+  kibot [-v...] [-L LOGFILE] [-A] [--socket PATH] --daemon
   kibot [-v...] [--start PATH] [-d OUT_DIR] [--dry] [--banner N]
          [-t, --type TYPE]... --quick-start
   kibot [-v...] [--rst] [-d OUT_DIR] --help-filters
@@ -46,6 +47,9 @@ Options:
   -C, --cli-order                  Generate outputs using the indicated order
   --config-outs                    Configure all outputs before listing them
   -d OUT_DIR, --out-dir OUT_DIR    The output directory [default: .]
+  --daemon                         Stay running and execute the jobs sent by
+                                   `kibot-client`, keeping the boards and
+                                   schematics loaded
   -D, --dont-stop                  Try to continue if an output fails
   --defs-from-env                  Use the environment vars as preprocessor
                                    values
@@ -75,6 +79,9 @@ Options:
   -P, --copy-and-expand            As -p but expand the list of layers
   -q, --quiet                      Remove information logs
   -s PRE, --skip-pre PRE           Skip preflights, comma separated or `all`
+  --socket PATH                    Unix socket used by --daemon, default is
+                                   $KIBOT_DAEMON_SOCKET or
+                                   ~/.cache/kibot/daemon.sock
   --sub-pcbs                       When listing variants also include sub-PCBs
   -v, --verbose                    Show debugging information
   -V, --version                    Show program's version number and exit
@@ -502,6 +509,11 @@ def main():
         initialization(args)
     logger.debug('End of initialization')
 
+    if args.daemon:
+        from .daemon import run_server
+        run_server(args.socket)
+        sys.exit(0)
+
     if args.banner is not None:
         try:
             id = int(args.banner)
@@ -71,6 +71,35 @@ def render_export(render_path):
     render.use_file_extension = True
     render.filepath = render_path
     bpy.ops.render.render(write_still=True)
+    if auto_crop:
+        crop_image(render_path)
+
+
+def crop_image(name):
+    """ Removes the empty space around the image, like ImageMagick's -trim does.
+        The background is the color of the first pixel. """
+    import numpy as np
+    print(f'- Cropping {name}')
+    img = bpy.data.images.load(name)
+    w, h = img.size
+    ch = img.channels
+    px = np.empty(w*h*ch, dtype=np.float32)
+    img.pixels.foreach_get(px)
+    px = px.reshape((h, w, ch))
+    used = np.any(np.abs(px-px[0, 0]) > 0.5/255, axis=2)
+    rows = np.flatnonzero(used.any(axis=1))
+    cols = np.flatnonzero(used.any(axis=0))
+    if len(rows) and (len(rows) != h or len(cols) != w):
+        y0, y1 = rows[0], rows[-1]+1
+        x0, x1 = cols[0], cols[-1]+1
+        print(f'  {w}x{h} -> {x1-x0}x{y1-y0}')
+        new = bpy.data.images.new('kibot_crop', int(x1-x0), int(y1-y0), alpha=img.depth in (32, 64))
+        new.pixels.foreach_set(np.ascontiguousarray(px[y0:y1, x0:x1]).ravel())
+        new.filepath_raw = name
+        new.file_format = 'PNG'
+        new.save()
+        bpy.data.images.remove(new)
+    bpy.data.images.remove(img)
 
 
 def do_rotate(rots):
@@ -183,6 +212,7 @@ def create_background_gradient(color1, color0):
 
 jscene = None
 auto_camera = False
+auto_crop = False
 cam_ob = None
 cur_rot = None
 location = None
@@ -209,7 +239,8 @@ def apply_start_scene(file):
     povs = jscene.get('point_of_view')
     if povs:
         global cur_rot
-        pov = povs[0]
+        # When using more than one Blender instance the camera is computed for the first point of view
+        pov = jscene.get('camera_point_of_view', povs[0])
         # Apply point of view
         cur_rot = do_point_of_view(pov, 'view')
         # Apply extra rotations
@@ -362,6 +393,7 @@ def main():
 
     parser = argparse.ArgumentParser(description=description, prog=prog, epilog=epilog,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-a", "--auto_crop", action="store_true", help="remove the empty space around the renders")
     parser.add_argument("-c", "--no_components", action="store_false", help="if the PCB components are discarded")
     parser.add_argument("-C", "--dont_cut_boards", action="store_false", help="do not separate sub-PCBs")
     parser.add_argument("-d", "--texture_dpi", type=float, help="textures density [508-2032] [1016]", default=1016.0)
@@ -414,6 +446,8 @@ def main():
         bpy.ops.pcb2blender.import_pcb3d(**ops)
     if args.no_denoiser:
         bpy.context.scene.cycles.use_denoising = False
+    global auto_crop
+    auto_crop = args.auto_crop
     # Apply the scene first scene
     c_views = apply_start_scene(args.scene)
     c_formats = len(args.format)
@@ -422,7 +456,7 @@ def main():
         sys.exit(2)
     per_pass = int(c_formats/c_views)
     for n in range(c_views):
-        if n:
+        if n or (jscene and jscene.get('camera_point_of_view')):
             # Apply scene N
             apply_scene(n)
         # Get the current slice
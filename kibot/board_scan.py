@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024 Salvador E. Tropea
+# Copyright (c) 2024 Instituto Nacional de Tecnología Industrial
+# License: AGPL-3.0
+# Project: KiBot (formerly KiPlot)
+"""
+Single pass board scanner.
+Collects the attributes of the board primitives (tracks, vias, footprints and pads) in compact lists.
+Asking KiCad for the data is the slow part, the statistics can be computed from these lists.
+The scan is shared by all the outputs in the run, until the board changes (variants, filters, reload).
+The placement of the footprints (used for the position files) is scanned separately, only when needed.
+"""
+from collections import namedtuple
+import math
+from re import compile
+import pcbnew
+from .gs import GS
+from .misc import (UI_SMD, UI_VIRTUAL, MOD_THROUGH_HOLE, MOD_SMD, MOD_EXCLUDE_FROM_POS_FILES, VIATYPE_THROUGH,
+                   VIATYPE_BLIND_BURIED, VIATYPE_MICROVIA)
+from . import log
+
+logger = log.get_logger()
+Via = namedtuple('Via', 'drill width type')
+Footprint = namedtuple('Footprint', 'ref layer attrs pure_smd not_virtual')
+# drill and size are (x, y) tuples, pad is the KiCad object, only used to report problems
+Pad = namedtuple('Pad', 'ref number fab_property net drill size is_pth paste_top paste_bottom paste_area pad')
+# x and y are the center, rotation is in degrees, package is the footprint name without the library
+Placement = namedtuple('Placement', 'ref value package x y rotation bottom attrs')
+ref_re = compile(r'([^\d]+)([\?\d]+)')
+
+
+def ref_key(ref_str):
+    """ Splits a reference intro prefix and suffix.
+        Helps to sort references in a natural way. """
+    m = ref_re.match(ref_str)
+    if not m:
+        return [ref_str]
+    pre, suf = m.groups()
+    return [pre, 0 if suf == '?' else int(suf)]
+
+
+def is_pure_smd(attrs):
+    if GS.ki5:
+        return attrs == UI_SMD
+    return attrs & (MOD_THROUGH_HOLE | MOD_SMD) == MOD_SMD
+
+
+def is_not_virtual(attrs):
+    if GS.ki5:
+        return attrs != UI_VIRTUAL
+    return not (attrs & MOD_EXCLUDE_FROM_POS_FILES)
+
+
+def get_paste_area(pad, size):
+    """ Area of the pad in mm², None if we don't know how to compute it """
+    if GS.ki6:
+        return GS.to_mm(GS.to_mm(pad.GetEffectivePolygon().Area()))
+    shape = pad.GetShape()
+    if shape == pcbnew.PAD_SHAPE_CIRCLE:
+        radius = GS.to_mm(size[0]/2)
+        return math.pi*radius*radius
+    if shape == pcbnew.PAD_SHAPE_RECT:
+        return GS.to_mm(size[0])*GS.to_mm(size[1])
+    if shape == pcbnew.PAD_SHAPE_OVAL:
+        dia_major = GS.to_mm(max(size))
+        dia_minor = GS.to_mm(min(size))
+        # Adjust the area, here the dia_minor is the diameter for a circle
+        return dia_major*dia_minor - (1-math.pi/4)*dia_minor*dia_minor
+    if shape == pcbnew.PAD_SHAPE_TRAPEZOID:
+        delta = pad.GetDelta()
+        if delta.x:
+            a = GS.to_mm(size[1]-delta.y)
+            b = GS.to_mm(size[1]+delta.y)
+            h = GS.to_mm(size[0])
+        else:
+            a = GS.to_mm(size[0]-delta.x)
+            b = GS.to_mm(size[0]+delta.x)
+            h = GS.to_mm(size[1])
+        return a*b/2*h
+    if shape == pcbnew.PAD_SHAPE_ROUNDRECT:
+        # Adjust the corners area
+        radius = GS.to_mm(pad.GetRoundRectCornerRadius())
+        # Taking the 4 corners:
+        # - We computed a square: 2*radius*2*radius = 4*radius
+        # - But we should compute a circle: PI*radius*radius
+        return GS.to_mm(size[0])*GS.to_mm(size[1]) - (4-math.pi)*radius*radius
+    # Introduced in KiCad 6, so we can use GetEffectivePolygon
+    # if shape == pcbnew.PAD_SHAPE_CHAMFERED_RECT:
+    #     area = GS.to_mm(size[0])*GS.to_mm(size[1])
+    #     sz = pad.GetChamferRectRatio()*GS.to_mm(min(size))
+    #     corners = pad.GetChamferPositions()
+    #     n_corners = 1 if corners & 1 else 0
+    #     n_corners += 1 if corners & 2 else 0
+    #     n_corners += 1 if corners & 4 else 0
+    #     n_corners += 1 if corners & 8 else 0
+    #     return area - n_corners*sz*sz/2
+    if shape == pcbnew.PAD_SHAPE_CUSTOM:
+        return GS.to_mm(GS.to_mm(pad.GetCustomShapeAsPolygon().Area()))
+    return None
+
+
+class BoardScan(object):
+    """ The result of scanning a board.
+        track_widths: width of each track segment
+        vias: a Via for each via
+        footprints: a Footprint for each footprint
+        pads: a Pad for each pad """
+    _cache = None
+    # (board, placements)
+    _placements = None
+
+    def __init__(self, board):
+        self.board = board
+        self.scan_tracks(board)
+        self.scan_footprints(board)
+
+    def scan_tracks(self, board):
+        track_type = 'TRACK' if GS.ki5 else 'PCB_TRACK'
+        via_type = 'VIA' if GS.ki5 else 'PCB_VIA'
+        self.track_widths = widths = []
+        self.vias = vias = []
+        for t in board.GetTracks():
+            tclass = t.GetClass()
+            if tclass == track_type:
+                widths.append(t.GetWidth())
+            elif tclass == via_type:
+                via = t.Cast()
+                vias.append(Via(via.GetDrill(), via.GetWidth(), via.GetViaType()))
+
+    def scan_footprints(self, board):
+        npth_attrib = 3 if GS.ki5 else pcbnew.PAD_ATTRIB_NPTH
+        # KiCad 5 doesn't have fabrication properties
+        no_prop = pcbnew.PAD_PROP_NONE if hasattr(pcbnew, 'PAD_PROP_NONE') else 0
+        f_paste = pcbnew.F_Paste
+        b_paste = pcbnew.B_Paste
+        self.footprints = footprints = []
+        self.pads = pads = []
+        for m in GS.get_modules_board(board):
+            ref = m.GetReference()
+            attrs = m.GetAttributes()
+            footprints.append(Footprint(ref, m.GetLayer(), attrs, is_pure_smd(attrs), is_not_virtual(attrs)))
+            for pad in m.Pads():
+                dr = pad.GetDrillSize()
+                sz = pad.GetSize()
+                size = (sz.x, sz.y)
+                paste_top = pad.IsOnLayer(f_paste)
+                paste_bottom = pad.IsOnLayer(b_paste)
+                paste_area = get_paste_area(pad, size) if paste_top or paste_bottom else 0
+                pads.append(Pad(ref, pad.GetNumber(), no_prop if GS.ki5 else pad.GetProperty(), pad.GetNetname(),
+                                (dr.x, dr.y), size, pad.GetAttribute() != npth_attrib, paste_top, paste_bottom, paste_area,
+                                pad))
+
+    @staticmethod
+    def get(board=None):
+        """ Scan the board, or reuse the last scan if this is the same board and didn't change.
+            The cache is keyed on the board object (GS.board by default), GS.board_changed() invalidates it """
+        if board is None:
+            board = GS.board
+        scan = BoardScan._cache
+        if scan is None or scan.board is not board:
+            logger.debug('Scanning the board primitives')
+            scan = BoardScan._cache = BoardScan(board)
+        return scan
+
+    @staticmethod
+    def invalidate():
+        """ Must be called when the board is modified """
+        BoardScan._cache = None
+        BoardScan._placements = None
+
+    @staticmethod
+    def get_placements(board=None):
+        """ A Placement for each footprint, sorted by reference.
+            Only the footprints are scanned, the result is reused while the board doesn't change """
+        if board is None:
+            board = GS.board
+        cache = BoardScan._placements
+        if cache is None or cache[0] is not board:
+            logger.debug('Scanning the footprints placement')
+            placements = []
+            for m in GS.get_modules_board(board):
+                center = GS.get_center(m)
+                placements.append(Placement(m.GetReference(), m.GetValue(), str(m.GetFPID().GetLibItemName()), center.x,
+                                            center.y, m.GetOrientationDegrees(), m.IsFlipped(), m.GetAttributes()))
+            placements.sort(key=lambda p: ref_key(p.ref))
+            cache = BoardScan._placements = (board, placements)
+        return cache[1]
+
+    def via_counts(self):
+        """ Number of through, blind/buried and micro vias """
+        thru = blind = micro = 0
+        for v in self.vias:
+            if v.type == VIATYPE_THROUGH:
+                thru += 1
+            elif v.type == VIATYPE_BLIND_BURIED:
+                blind += 1
+            elif v.type == VIATYPE_MICROVIA:
+                micro += 1
+        return thru, blind, micro
@@ -734,6 +734,56 @@ def create_kicost_sheet(workbook, groups, image_data, fmt_title, fmt_info, fmt_s
         GS.exit_with_error('KiCost error: `{}` ({})'.format(e.msg, e.id), KICOST_ERROR)
 
 
+class RowBuffer(object):
+    """ Collects the cells written to a worksheet, so we can write them sorted by row.
+        Used for the constant memory mode, where the rows must be written in order """
+    BUFFERED = {'write_string', 'write_number', 'merge_range', 'set_row'}
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name in RowBuffer.BUFFERED:
+            return lambda row, *args: self.calls.append((row, len(self.calls), name, args))
+        return getattr(self.worksheet, name)
+
+    def flush(self):
+        for row, _, name, args in sorted(self.calls, key=lambda x: x[:2]):
+            getattr(self.worksheet, name)(row, *args)
+        self.calls = []
+
+
+def write_head(cfg, worksheet, column_widths, image_data, fmt_title, fmt_info, fmt_subtitle, r_info_start):
+    """ Logo, title and PCB/stats info """
+    # Logo
+    col1 = insert_logo(worksheet, image_data, cfg.xlsx.logo_scale)
+    # Title
+    do_title(cfg, worksheet, col1, len(column_widths)-1, fmt_title, fmt_info[0] if fmt_info else None)
+    # PCB & Stats Info
+    if not (cfg.xlsx.hide_pcb_info and cfg.xlsx.hide_stats_info):
+        write_info(cfg, r_info_start, worksheet, column_widths, col1, fmt_info, fmt_subtitle)
+
+
+def classify_rows(groups, row_colors):
+    """ Format for the highlighted rows, computed in one pass for all the groups """
+    if not row_colors:
+        return [None]*len(groups)
+    fmts = []
+    for group in groups:
+        c = group.components[0]
+        fmts.append(next((r.xlsx_fmt for r in row_colors if r.filter.filter(c)), None))
+    return fmts
+
+
+def row_height(row, max_width):
+    max_h = 1
+    for c in row:
+        if len(c) > max_width:
+            max_h = max(len(wrap(c, max_width)), max_h)
+    return max_h
+
+
 def write_xlsx(filename, groups, col_fields, head_names, cfg):
     """
     Write BoM out to a XLSX file
@@ -755,7 +805,9 @@ def write_xlsx(filename, groups, col_fields, head_names, cfg):
     link_lcsc = cfg.xlsx.lcsc_link
     hl_empty = cfg.xlsx.highlight_empty
 
-    workbook = Workbook(filename)
+    # KiCost writes the cells in random order, so it can't be used with the constant memory mode
+    stream = cfg.xlsx.streaming and not cfg.xlsx.kicost
+    workbook = Workbook(filename, {'constant_memory': True} if stream else {})
     ws_names = ['BoM', 'DNF']
     row_headings = head_names
 
@@ -783,6 +835,8 @@ def write_xlsx(filename, groups, col_fields, head_names, cfg):
     fmt_subtitle = create_fmt_subtitle(workbook)
     # Info
     fmt_info = create_fmt_info(workbook, cfg)
+    # Highlighted rows
+    row_fmts = classify_rows(groups, cfg.xlsx.row_colors)
 
     # #######################
     # Fill the cells
@@ -805,27 +859,36 @@ def write_xlsx(filename, groups, col_fields, head_names, cfg):
         for i in range(len(row_headings)):
             # Title for this column
             column_widths[i] = len(row_headings[i]) + 10
+        if stream:
+            # Rows must be written in order, so the page head goes first
+            buffer = RowBuffer(worksheet)
+            write_head(cfg, buffer, column_widths, image_data, fmt_title, fmt_info, fmt_subtitle, r_info_start)
+            buffer.flush()
+            h = row_height(row_headings, max_width)
+            if h > 1:
+                worksheet.set_row(row_count, 15.0*h)
+        for i in range(len(row_headings)):
             worksheet.write_string(row_count, i, row_headings[i], fmt_head)
             if cfg._column_comments[i]:
                 worksheet.write_comment(row_count, i, cfg._column_comments[i])
 
         # Body
         row_count += 1
-        for i, group in enumerate(groups):
+        for n, group in enumerate(groups):
             if (cfg.ignore_dnf and not group.is_fitted()) != dnf:
                 continue
             # Get the data row
             row = group.get_row(col_fields)
-            rows.append(row)
+            if stream:
+                h = row_height(row, max_width)
+                if h > 1:
+                    worksheet.set_row(row_count, 15.0*h)
+            else:
+                rows.append(row)
             if link_datasheet != -1:
                 datasheet = group.get_field(ColumnList.COL_DATASHEET_L)
             # Check if the user wants a color for this row
-            row_fmt = None
-            for r_color in cfg.xlsx.row_colors:
-                c = group.components[0]
-                if r_color.filter.filter(c):
-                    row_fmt = r_color.xlsx_fmt
-                    break
+            row_fmt = row_fmts[n]
             # Fill the row
             for i in range(len(row)):
                 cell = row[i]
@@ -856,18 +919,14 @@ def write_xlsx(filename, groups, col_fields, head_names, cfg):
                     column_widths[i] = len(cell) + 5
             row_count += 1
 
-        # Page head
-        # Logo
-        col1 = insert_logo(worksheet, image_data, cfg.xlsx.logo_scale)
-        # Title
-        do_title(cfg, worksheet, col1, len(column_widths)-1, fmt_title, fmt_info[0] if fmt_info else None)
-        # PCB & Stats Info
-        if not (cfg.xlsx.hide_pcb_info and cfg.xlsx.hide_stats_info):
-            write_info(cfg, r_info_start, worksheet, column_widths, col1, fmt_info, fmt_subtitle)
+        if not stream:
+            # Page head
+            write_head(cfg, worksheet, column_widths, image_data, fmt_title, fmt_info, fmt_subtitle, r_info_start)
 
         # Adjust cols and rows
         adjust_widths(worksheet, column_widths, max_width, cfg._column_levels)
-        adjust_heights(worksheet, rows, max_width, head_size)
+        if not stream:
+            adjust_heights(worksheet, rows, max_width, head_size)
 
         worksheet.freeze_panes(head_size+1, 0)
         worksheet.repeat_rows(head_size+1)
@@ -1,36 +1,213 @@
 # -*- coding: utf-8 -*-
-# Copyright (c) 2022 Salvador E. Tropea
-# Copyright (c) 2022 Instituto Nacional de Tecnología Industrial
+# Copyright (c) 2022-2024 Salvador E. Tropea
+# Copyright (c) 2022-2024 Instituto Nacional de Tecnología Industrial
 # Copyright (c) 2022 Albin Dennevi (create_pdf_from_pages)
 # License: GPL-3.0
 # Project: KiBot (formerly KiPlot)
 # Base idea: https://gitlab.com/dennevi/Board2Pdf/ (Released as Public Domain)
+from copy import copy
+from hashlib import sha1
+from io import BytesIO
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
 from . import PyPDF2
+from .PyPDF2.generic import (ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject,
+                             createStringObject)
 from . import log
 
 logger = log.get_logger()
 
 
-def create_pdf_from_pages(input_files, output_fn, forced_width=None):
+def peak_rss():
+    """ Peak memory used by this process, in MB """
+    if resource is None:
+        return 0
+    # Linux reports KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+
+class StreamingPdfWriter(object):
+    """ A PDF writer that writes the pages as soon as they are added.
+        The objects used by a page are copied to the output and forgotten, so the memory doesn't grow with the number
+        of pages. Identical objects (i.e. the fonts and images used by all the pages) are stored only once, we keep
+        their hash to detect them. """
+    def __init__(self, stream):
+        self.stream = stream
+        # File offset for each object, the index is the object number-1
+        self.offsets = []
+        # Hash of the content -> object
+        self.by_hash = {}
+        self.kids = ArrayObject()
+        self.shared = 0
+        stream.write(b'%PDF-1.3\n%\xe2\xe3\xcf\xd3\n')
+        # The pages tree is written at the end
+        self.pages = self._reserve()
+
+    def _reserve(self):
+        self.offsets.append(None)
+        return IndirectObject(len(self.offsets), 0, self)
+
+    @staticmethod
+    def _serialize(obj):
+        buf = BytesIO()
+        obj.writeToStream(buf, None)
+        return buf.getvalue()
+
+    def _write(self, ref, data):
+        self.offsets[ref.idnum-1] = self.stream.tell()
+        self.stream.write(b'%d 0 obj\n' % ref.idnum)
+        self.stream.write(data)
+        self.stream.write(b'\nendobj\n')
+
+    def _store(self, obj, ref=None):
+        """ Writes an object, reusing an identical one if available.
+            If ref is not None the number was reserved (a reference loop) and we can't reuse. """
+        data = self._serialize(obj)
+        if ref is None:
+            key = sha1(data).digest()
+            ref = self.by_hash.get(key)
+            if ref is not None:
+                self.shared += 1
+                return ref
+            ref = self._reserve()
+            self.by_hash[key] = ref
+        self._write(ref, data)
+        return ref
+
+    def _copy(self, obj, refs, busy):
+        """ Makes a copy of obj using the numbers of the objects already written """
+        if isinstance(obj, IndirectObject):
+            return self._copy_ref(obj, refs, busy)
+        if isinstance(obj, DictionaryObject):
+            new = copy(obj)
+            for k, v in obj.items():
+                v = self._copy(v, refs, busy)
+                if isinstance(v, StreamObject):
+                    # Streams must be indirect
+                    v = self._store(v)
+                new[k] = v
+            return new
+        if isinstance(obj, ArrayObject):
+            new = ArrayObject()
+            for v in obj:
+                v = self._copy(v, refs, busy)
+                if isinstance(v, StreamObject):
+                    v = self._store(v)
+                new.append(v)
+            return new
+        return obj
+
+    def _copy_ref(self, ref, refs, busy):
+        key = (ref.idnum, ref.generation)
+        new = refs.get(key)
+        if new is not None:
+            return new
+        if key in busy:
+            # A reference loop, we need the number now
+            new = refs[key] = self._reserve()
+            return new
+        busy.add(key)
+        obj = self._copy(ref.getObject(), refs, busy)
+        busy.discard(key)
+        new = refs[key] = self._store(obj, refs.get(key))
+        return new
+
+    def add_page(self, page):
+        """ Copies the page and all the objects it uses to the output """
+        # Map for the objects of this page's PDF: (number, generation) -> our reference
+        refs = {}
+        ref = self._reserve()
+        if page.indirectRef is not None:
+            refs[(page.indirectRef.idnum, page.indirectRef.generation)] = ref
+        new = DictionaryObject()
+        for k, v in page.items():
+            if k != '/Parent':
+                v = self._copy(v, refs, set())
+                if isinstance(v, StreamObject):
+                    v = self._store(v)
+                new[NameObject(k)] = v
+        new[NameObject('/Parent')] = self.pages
+        self._write(ref, self._serialize(new))
+        self.kids.append(ref)
+
+    def close(self):
+        """ Writes the pages tree, the catalog, the xref table and the trailer """
+        pages = DictionaryObject({NameObject('/Type'): NameObject('/Pages'), NameObject('/Kids'): self.kids,
+                                  NameObject('/Count'): NumberObject(len(self.kids))})
+        self._write(self.pages, self._serialize(pages))
+        root = self._reserve()
+        self._write(root, self._serialize(DictionaryObject({NameObject('/Type'): NameObject('/Catalog'),
+                                                            NameObject('/Pages'): self.pages})))
+        info = self._reserve()
+        self._write(info, self._serialize(DictionaryObject({NameObject('/Producer'): createStringObject('PyPDF2')})))
+        xref = self.stream.tell()
+        self.stream.write(b'xref\n0 %d\n' % (len(self.offsets)+1))
+        self.stream.write(b'%010d %05d f \n' % (0, 65535))
+        for offset in self.offsets:
+            self.stream.write(b'%010d %05d n \n' % (offset, 0))
+        trailer = DictionaryObject({NameObject('/Size'): NumberObject(len(self.offsets)+1), NameObject('/Root'): root,
+                                    NameObject('/Info'): info})
+        self.stream.write(b'trailer\n')
+        trailer.writeToStream(self.stream, None)
+        self.stream.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref)
+
+
+def get_page(pdf_reader, forced_width):
+    """ The first page, scaled to the forced_width (mm) """
+    page_obj = pdf_reader.getPage(0)
+    if forced_width is not None:
+        width = float(page_obj.mediaBox.getWidth())*25.4/72
+        scale = round(forced_width/width, 4)
+        logger.debugl(1, 'PDF scale {} ({} -> {})'.format(scale, width, forced_width))
+        if abs(1.0-scale) > 0.0001:
+            page_obj.scaleBy(scale)
+    page_obj.compressContentStreams()
+    return page_obj
+
+
+def create_pdf_from_pages_pypdf2(input_files, output_fn, forced_width=None):
+    """ Joins the first page of each file using the PyPDF2 writer, all the pages are kept in memory """
     output = PyPDF2.PdfFileWriter()
     # Collect all pages
     open_files = []
     for filename in input_files:
         file = open(filename, 'rb')
         open_files.append(file)
-        pdf_reader = PyPDF2.PdfFileReader(file)
-        page_obj = pdf_reader.getPage(0)
-        if forced_width is not None:
-            width = float(page_obj.mediaBox.getWidth())*25.4/72
-            scale = round(forced_width/width, 4)
-            logger.debugl(1, 'PDF scale {} ({} -> {})'.format(scale, width, forced_width))
-            if abs(1.0-scale) > 0.0001:
-                page_obj.scaleBy(scale)
-        page_obj.compressContentStreams()
-        output.addPage(page_obj)
+        output.addPage(get_page(PyPDF2.PdfFileReader(file), forced_width))
     # Write all pages to a file
     with open(output_fn, 'wb') as pdf_output:
         output.write(pdf_output)
+        size = pdf_output.tell()
     # Close the files
     for f in open_files:
         f.close()
+    return size, 0
+
+
+def create_pdf_from_pages_streaming(input_files, output_fn, forced_width=None):
+    """ Joins the first page of each file.
+        The pages are written one by one, so the memory needed doesn't depend on the number of pages """
+    with open(output_fn, 'wb') as pdf_output:
+        output = StreamingPdfWriter(pdf_output)
+        for filename in input_files:
+            with open(filename, 'rb') as file:
+                output.add_page(get_page(PyPDF2.PdfFileReader(file), forced_width))
+        output.close()
+        size = pdf_output.tell()
+    return size, output.shared
+
+
+def create_pdf_from_pages(input_files, output_fn, forced_width=None, streaming=True):
+    """ Joins the first page of each file, optionally scaling them to forced_width (mm) """
+    start = time.perf_counter()
+    if streaming:
+        size, shared = create_pdf_from_pages_streaming(input_files, output_fn, forced_width)
+    else:
+        size, shared = create_pdf_from_pages_pypdf2(input_files, output_fn, forced_width)
+    elapsed = time.perf_counter()-start
+    logger.debug('PDF merge: {} pages in {:.3f} s ({:.1f} pages/s), {} KiB, {} shared objects, peak RSS {:.1f} MB'.
+                 format(len(input_files), elapsed, len(input_files)/elapsed if elapsed else 0, size//1024, shared,
+                        peak_rss()))
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024 Salvador E. Tropea
+# Copyright (c) 2024 Instituto Nacional de Tecnología Industrial
+# License: AGPL-3.0
+# Project: KiBot (formerly KiPlot)
+"""
+Daemon mode.
+
+`kibot --daemon` pays the start-up cost once (interpreter, KiCad module, plug-ins) and then waits for jobs on a Unix
+socket. Each job is executed by a forked copy of the daemon, using the command line, working directory and environment
+of the client. The client passes its stdin/stdout/stderr, so the logs go directly to the client, and gets the exit
+code.
+
+After a job the daemon loads the PCB used by the job, so the next jobs for the same project start with it already
+loaded. It is discarded when the files change (modification time and size).
+The schematics aren't kept: loading them expands the text variables and dates of the title blocks, using the
+environment, defines and globals of the job, and reports warnings that belong to the job.
+
+This module is also the thin client (`kibot-client`), so it must import only the standard library at the top level.
+"""
+from array import array
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import traceback
+from .misc import DAEMON_ERROR
+
+SOCKET_ENV = 'KIBOT_DAEMON_SOCKET'
+HEADER = struct.Struct('!I')
+# Maximum number of boards kept loaded
+MAX_WARM = 8
+# Objects loaded by the daemon: (kind, file name, extra) -> (stamp, object)
+WARM = {}
+
+
+def default_socket():
+    """ Socket used when none is specified, can be changed using KIBOT_DAEMON_SOCKET """
+    name = os.environ.get(SOCKET_ENV)
+    if name:
+        return name
+    base = os.environ.get('KIBOT_CACHE_DIR')
+    base = os.path.abspath(base) if base else os.path.join(os.path.expanduser('~'), '.cache', 'kibot')
+    return os.path.join(base, 'daemon.sock')
+
+
+def files_stamp(files):
+    """ Modification time and size for a list of files, None if any is missing """
+    try:
+        return tuple((f, os.stat(f).st_mtime_ns, os.stat(f).st_size) for f in files)
+    except OSError:
+        return None
+
+
+def get_warm(kind, fname, extra=None):
+    """ An object loaded by the daemon, only if the files didn't change.
+        Each object is used only once, this is called from the process running the job, so the job can modify it """
+    entry = WARM.pop((kind, os.path.abspath(fname), extra), None)
+    if entry is None:
+        return None
+    stamp, obj = entry
+    if files_stamp(f[0] for f in stamp) != stamp:
+        return None
+    return obj
+
+
+def recv_all(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size-len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed by the client')
+        data += chunk
+    return data
+
+
+# ##############################################################################################################
+#  Client
+# ##############################################################################################################
+
+
+def client_main():
+    """ Send the command line to the daemon and wait for the job to finish """
+    args = sys.argv[1:]
+    sock_name = default_socket()
+    if args and args[0] == '--socket':
+        if len(args) < 2:
+            print('Usage: kibot-client [--socket PATH] [KIBOT_OPTIONS] [TARGET...]', file=sys.stderr)
+            sys.exit(DAEMON_ERROR)
+        sock_name = args[1]
+        args = args[2:]
+    request = json.dumps({'argv': args, 'cwd': os.getcwd(), 'env': dict(os.environ)}).encode()
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(sock_name)
+    except OSError as e:
+        print('Unable to connect to the KiBot daemon at `{}`: {}'.format(sock_name, e), file=sys.stderr)
+        sys.exit(DAEMON_ERROR)
+    with conn:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Our stdin/stdout/stderr travel with the request
+        fds = array('i', [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+        conn.sendmsg([HEADER.pack(len(request))+request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+        reply = b''
+        try:
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                reply += chunk
+        except KeyboardInterrupt:
+            sys.exit(130)
+    try:
+        sys.exit(json.loads(reply.decode())['exit'])
+    except (ValueError, KeyError):
+        print('The KiBot daemon finished the job without an exit code', file=sys.stderr)
+        sys.exit(DAEMON_ERROR)
+
+
+# ##############################################################################################################
+#  Server
+# ##############################################################################################################
+
+
+def get_logger():
+    from . import log
+    return log.get_logger()
+
+
+def receive_request(conn):
+    """ Read the request and the client's stdin/stdout/stderr """
+    fds = array('i')
+    msg, ancdata, _, _ = conn.recvmsg(HEADER.size, socket.CMSG_LEN(3*fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data)-(len(data) % fds.itemsize)])
+    if len(msg) < HEADER.size:
+        msg += recv_all(conn, HEADER.size-len(msg))
+    request = json.loads(recv_all(conn, HEADER.unpack(msg)[0]).decode())
+    return request, list(fds)
+
+
+def run_job(conn, request, fds, report):
+    """ Executed by the child process. Runs KiBot and informs the exit code """
+    from . import log
+    from .gs import GS
+    from .__main__ import main
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for n, fd in enumerate(fds[:3]):
+        os.dup2(fd, n)
+        os.close(fd)
+    # The colors depend on the client's terminal
+    for handler in list(log.root_logger.handlers):
+        stream = getattr(handler, 'stream', None)
+        if stream is sys.stdout or stream is sys.stderr:
+            handler.setFormatter(log.CustomFormatter(stream))
+        else:
+            # The daemon's log file (-L), the job can ask for its own
+            log.root_logger.removeHandler(handler)
+    # The warning filters applied by the daemon aren't for the job
+    log.filters = []
+    # Start counting from 0
+    log.MyLogger.warn_tcnt = log.MyLogger.warn_cnt = log.MyLogger.n_filtered = 0
+    log.MyLogger.reset_warn_hash()
+    GS.unknown_text_vars.clear()
+    sys.argv = ['kibot']+request['argv']
+    code = 0
+    try:
+        main()
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        if isinstance(e.code, str):
+            print(e.code, file=sys.stderr)
+    except KeyboardInterrupt:
+        # The client was interrupted
+        code = 130
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    # We are done, don't let a late interruption change the exit code
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Tell the daemon which files we used, so it can have them ready for the next job
+    used = {}
+    if GS.board is not None and GS.pcb_file:
+        used['pcb'] = os.path.abspath(GS.pcb_file)
+    try:
+        os.write(report, json.dumps(used).encode())
+        conn.sendall(json.dumps({'exit': code}).encode())
+    except OSError:
+        pass
+    return code
+
+
+def store_warm(key, files, obj):
+    WARM.pop(key, None)
+    while len(WARM) >= MAX_WARM:
+        # Discard the oldest
+        del WARM[next(iter(WARM))]
+    WARM[key] = (files_stamp(files), obj)
+
+
+def is_warm(key):
+    entry = WARM.get(key)
+    return entry is not None and files_stamp(f[0] for f in entry[0]) == entry[0]
+
+
+def project_files(fname):
+    """ KiCad project files related to fname, they also affect how the board is loaded """
+    base = os.path.splitext(fname)[0]
+    return [base+ext for ext in ('.kicad_pro', '.kicad_prl', '.pro') if os.path.isfile(base+ext)]
+
+
+def warm_up(used):
+    """ Load the board used by the last job """
+    logger = get_logger()
+    pcb = used.get('pcb')
+    if pcb and not is_warm(('pcb', pcb, None)):
+        import pcbnew
+        from .misc import hide_stderr
+        logger.debug('Daemon: loading `{}`'.format(pcb))
+        try:
+            with hide_stderr():
+                board = pcbnew.LoadBoard(pcb)
+            store_warm(('pcb', pcb, None), [pcb]+project_files(pcb), board)
+        except Exception as e:
+            logger.debug('Daemon: failed to load `{}`: {}'.format(pcb, e))
+
+
+def create_socket(sock_name):
+    from .gs import GS
+    if os.path.exists(sock_name):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(sock_name)
+            GS.exit_with_error('Another KiBot daemon is using `{}`'.format(sock_name), DAEMON_ERROR)
+        except OSError:
+            # A stale socket
+            os.remove(sock_name)
+        finally:
+            probe.close()
+    os.makedirs(os.path.dirname(os.path.abspath(sock_name)), exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock_name)
+    os.chmod(sock_name, 0o600)
+    server.listen(8)
+    return server
+
+
+def run_server(sock_name=None):
+    """ Wait for jobs, each one runs in a forked process """
+    logger = get_logger()
+    sock_name = sock_name or default_socket()
+    server = create_socket(sock_name)
+    logger.info('KiBot daemon waiting for jobs at `{}`'.format(sock_name))
+    # Jobs in progress: report pipe -> (pid, data)
+    jobs = {}
+    # Connections to the clients of the jobs in progress: socket -> pid
+    clients = {}
+    try:
+        while True:
+            ready, _, _ = select.select([server]+list(jobs.keys())+list(clients.keys()), [], [])
+            for r in ready:
+                if r is server:
+                    start_job(server, jobs, clients)
+                    continue
+                if r in clients:
+                    # The clients don't send anything after the request, so the client is gone (i.e. Ctrl+C)
+                    pid = clients.pop(r)
+                    r.close()
+                    if any(pid == j[0] for j in jobs.values()):
+                        logger.debug('Daemon: client of job {} disconnected, interrupting it'.format(pid))
+                        interrupt_job(pid)
+                    continue
+                data = os.read(r, 65536)
+                if data:
+                    jobs[r][1].append(data)
+                    continue
+                # The job finished
+                pid, chunks = jobs.pop(r)
+                os.close(r)
+                for c, p in list(clients.items()):
+                    if p == pid:
+                        del clients[c]
+                        c.close()
+                _, status = os.waitpid(pid, 0)
+                logger.debug('Daemon: job {} finished ({})'.format(pid, status))
+                try:
+                    warm_up(json.loads(b''.join(chunks).decode()))
+                except ValueError:
+                    pass
+    except KeyboardInterrupt:
+        logger.info('KiBot daemon stopped')
+    finally:
+        server.close()
+        os.remove(sock_name)
+
+
+def interrupt_job(pid):
+    """ Same as Ctrl+C for a job running in the foreground, the job runs in its own process group """
+    try:
+        os.killpg(pid, signal.SIGINT)
+    except OSError:
+        pass
+
+
+def start_job(server, jobs, clients):
+    logger = get_logger()
+    conn, _ = server.accept()
+    try:
+        request, fds = receive_request(conn)
+    except (OSError, ValueError) as e:
+        logger.debug('Daemon: discarding malformed request: {}'.format(e))
+        conn.close()
+        return
+    if len(fds) < 3:
+        logger.debug('Daemon: request without stdin/stdout/stderr')
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+        return
+    logger.debug('Daemon: job {} at `{}`'.format(request['argv'], request['cwd']))
+    report_r, report_w = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        # Child
+        code = DAEMON_ERROR
+        try:
+            # A process group for the job and the tools it runs, so we can interrupt all of them
+            os.setpgid(0, 0)
+            server.close()
+            os.close(report_r)
+            for r in jobs.keys():
+                os.close(r)
+            for c in clients.keys():
+                c.close()
+            code = run_job(conn, request, fds, report_w)
+        finally:
+            os._exit(code)
+    # Daemon
+    try:
+        # Also done by the child, we must be sure it was done before trying to interrupt the job
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    for fd in fds:
+        os.close(fd)
+    os.close(report_w)
+    jobs[report_r] = (pid, [])
+    # Keep the connection to know if the client is interrupted
+    clients[conn] = pid
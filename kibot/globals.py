@@ -248,6 +248,9 @@ class Globals(FiltersOptions):
                 KiCad 6: you should set this in the Board Setup -> Physical Stackup """
             self.output = GS.def_global_output
             """ Default pattern for output file names """
+            self.parallel_preflights = False
+            """ Run the preflights that only read the project in parallel, i.e. `drc` and `erc`.
+                The ones using KiAuto (`run_drc` and `run_erc`) always run alone """
             self.pcb_finish = 'HAL'
             """ Finishing used to protect pads. Currently used for documentation and to choose default colors.
                 KiCad 6: you should set this in the Board Setup -> Board Finish -> Copper Finish option.
@@ -256,6 +259,14 @@ class Globals(FiltersOptions):
             self.pcb_material = 'FR4'
             """ PCB core material. Currently used for documentation and to choose default colors.
                 Currently known are FR1 to FR5 """
+            self.pdf_streaming_merge = True
+            """ Write each page of the PDFs joined by the `pcb_print` and `pdfunite` outputs as soon as it is read.
+                The memory used doesn't grow with the number of pages and the objects shared by the pages (i.e. fonts)
+                are stored only once. Disable it to use the PyPDF2 writer, that keeps all the pages in memory """
+            self.plot_workers = 1
+            """ [0,64] Number of processes used to plot the layers of the `gerber`, `pdf`, `svg`, `dxf`, `hpgl`
+                and `ps` outputs. Each process plots some of the layers. Use 0 to use the `workers` value.
+                Outputs with a `workers` option of 0 use this value """
             self.remove_solder_paste_for_dnp = True
             """ When applying filters and variants remove the solder paste for components that won't be included """
             self.remove_adhesive_for_dnp = True
@@ -338,6 +349,15 @@ class Globals(FiltersOptions):
             self.cache_3d_resistors = False
             """ Use a cache for the generated 3D models of colored resistors.
                 Will save time, but you could need to remove the cache if you need to regenerate them """
+            self.cache_schematics = False
+            """ Keep a copy of the loaded schematics in the cache dir (see `KIBOT_CACHE_DIR`).
+                The next runs use it when the sheets, libraries tables and KiBot version are the same.
+                Schematics that generate warnings aren't cached.
+                The netlists with variants applied, used by iBoM and KiCost, are also kept """
+            self.cache_sub_pcbs = True
+            """ Keep the sub-PCBs separated by KiKit in the cache dir (see `KIBOT_CACHE_DIR`).
+                The next runs use them when the PCB, the sub-PCB options and the tools are the same.
+                Disable it to separate them again on each run """
             self.resources_dir = 'kibot_resources'
             """ Directory where various resources are stored. Currently we support colors and fonts.
                 They must be stored in sub-dirs. I.e. kibot_resources/fonts/MyFont.ttf
@@ -379,11 +399,14 @@ class Globals(FiltersOptions):
                 changes to the PCB and create a new copy to send to somebody without changing the cached values.
                 Note that it will save the PCB with the cache erased.
                 The `auto` value will remove the cached values only when using `set_text_variables` """
-            self.git_diff_strategy = 'worktree'
-            """ [worktree,stash] When computing a PCB/SCH diff it configures how do we preserve the current
-                working state. The *worktree* mechanism creates a separated worktree, that then is just removed.
-                The *stash* mechanism uses *git stash push/pop* to save the current changes. Using *worktree*
-                is the preferred mechanism """
+            self.git_diff_strategy = 'blob'
+            """ [blob,worktree,stash] When computing a PCB/SCH diff it configures how do we preserve the current
+                working state. The *blob* mechanism reads the needed files directly from the git objects, without
+                a checkout. It falls back to *worktree* when this isn't possible, i.e. files inside submodules
+                or KiCad 5 schematics.
+                The *worktree* mechanism creates a separated worktree, that then is just removed.
+                The *stash* mechanism uses *git stash push/pop* to save the current changes. Using *blob*
+                or *worktree* is the preferred mechanism """
             self.layer_defaults = Layer
             """ [list(dict)=[]] Used to indicate the default suffix and description for the layers.
                 Note that the name for the layer must match exactly, no aliases """
@@ -400,6 +423,9 @@ class Globals(FiltersOptions):
             """ String used for *yes*. Currently used by the **update_pcb_characteristics** preflight """
             self.str_no = 'no'
             """ String used for *no*. Currently used by the **update_pcb_characteristics** preflight """
+            self.workers = 0
+            """ [0,256] Number of parallel workers used by the outputs that can split their job.
+                Outputs with a `workers` option of 0 use this value. 0 means to use the number of CPUs """
         self.set_doc('filters', " [list(dict)=[]] KiBot warnings to be ignored ")
         self._filter_what = 'KiBot warnings'
         self.filters = FilterOptionsKiBot
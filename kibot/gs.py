@@ -16,9 +16,10 @@ except ImportError:
         IU_PER_MILS = 1
 from datetime import datetime
 import shlex
-from shutil import copy2
+from shutil import copy2, rmtree
 from sys import exit, exc_info
 import tempfile
+import time
 from traceback import extract_stack, format_list, print_tb
 from .misc import EXIT_BAD_ARGS, W_DATEFORMAT, W_UNKVAR, WRONG_INSTALL, CORRUPTED_PRO
 from .log import get_logger
@@ -73,6 +74,12 @@ class GS(object):
     pro_ext = '.pro'
     pro_variables = None  # KiCad 6 text variables defined in the project
     vars_regex = re.compile(r'\$\{([^\}]+)\}')
+    # Texts already split by expand_text_variables: text -> [literal, var name, literal, ...]
+    text_templates = {}
+    # Expanded texts that only depend on the project variables: text -> result
+    expanded_texts = {}
+    # Unknown text variables already reported
+    unknown_text_vars = set()
     # Main output dir
     out_dir = None
     out_dir_in_cmd_line = False
@@ -145,6 +152,8 @@ class GS(object):
     global_allow_component_ranges = None
     global_always_warn_about_paste_pads = None
     global_cache_3d_resistors = None
+    global_cache_schematics = None
+    global_cache_sub_pcbs = None
     global_castellated_pads = None
     global_colored_tht_resistors = None
     global_copper_thickness = None
@@ -184,8 +193,11 @@ class GS(object):
     #  Classes supporting global "output" option must call super().__init__()
     #  after defining its own options to allow Optionable do the overwrite.
     global_output = None
+    global_parallel_preflights = None
     global_pcb_finish = None
     global_pcb_material = None
+    global_pdf_streaming_merge = None
+    global_plot_workers = None
     global_remove_solder_paste_for_dnp = None
     global_remove_solder_mask_for_dnp = None
     global_remove_adhesive_for_dnp = None
@@ -206,6 +218,7 @@ class GS(object):
     global_use_dir_for_preflights = None
     global_use_os_env_for_expand = None
     global_variant = None
+    global_workers = None
     # Only for v7+
     global_allow_blind_buried_vias = None
     global_allow_microvias = None
@@ -243,6 +256,7 @@ class GS(object):
             name = os.path.abspath(name)
             GS.pro_file = name
             GS.pro_fname = os.path.basename(name)
+            GS.text_variables_changed()
             GS.pro_basename = os.path.splitext(GS.pro_fname)[0]
             GS.pro_no_ext = os.path.splitext(name)[0]
             GS.pro_dir = os.path.dirname(name)
@@ -262,6 +276,7 @@ class GS(object):
         except Exception:
             GS.exit_with_error('Corrupted project {}'.format(GS.pro_file), CORRUPTED_PRO)
         GS.pro_variables = data.get('text_variables', {})
+        GS.text_variables_changed()
         logger.debug("Current text variables: {}".format(GS.pro_variables))
         return GS.pro_variables
 
@@ -461,28 +476,52 @@ class GS(object):
     def dummy1(fp):
         """ KiCad 8 doesn't need footprint_update_local_coords """
 
+    @staticmethod
+    def text_variables_changed():
+        """ Must be called when the project text variables change """
+        GS.expanded_texts.clear()
+
+    @staticmethod
+    def board_changed():
+        """ Must be called when the board is loaded again or modified """
+        from .board_scan import BoardScan
+        BoardScan.invalidate()
+
     @staticmethod
     def expand_text_variables(text, extra_vars=None):
+        if '${' not in text:
+            # Nothing to expand
+            return text
+        parts = GS.text_templates.get(text)
+        if parts is None:
+            # Literals in the even positions, variable names in the odd positions
+            parts = GS.text_templates[text] = GS.vars_regex.split(text)
+        if extra_vars is None:
+            new_text = GS.expanded_texts.get(text)
+            if new_text is not None:
+                return new_text
         vars = GS.load_pro_variables()
-        new_text = ''
-        last = 0
-        text_l = len(text)
-        for match in GS.vars_regex.finditer(text):
-            vname = match.group(1)
+        # Results that only depend on the project variables can be reused
+        reusable = extra_vars is None
+        new_parts = parts[:]
+        for c in range(1, len(parts), 2):
+            vname = parts[c]
             value = vars.get(vname, None)
-            if value is None and extra_vars is not None:
-                value = extra_vars.get(vname, None)
-            if value is None and GS.global_use_os_env_for_expand:
-                value = os.environ.get(vname, None)
             if value is None:
-                value = '${'+vname+'}'
-                logger.warning(W_UNKVAR+"Unknown text variable `{}`".format(vname))
-            if match.start():
-                new_text += text[last:match.start()]
-            new_text += value
-            last = match.end()
-        if last < text_l:
-            new_text += text[last:text_l]
+                reusable = False
+                if extra_vars is not None:
+                    value = extra_vars.get(vname, None)
+                if value is None and GS.global_use_os_env_for_expand:
+                    value = os.environ.get(vname, None)
+                if value is None:
+                    value = '${'+vname+'}'
+                    if vname not in GS.unknown_text_vars:
+                        GS.unknown_text_vars.add(vname)
+                        logger.warning(W_UNKVAR+"Unknown text variable `{}`".format(vname))
+            new_parts[c] = value
+        new_text = ''.join(new_parts)
+        if reusable:
+            GS.expanded_texts[text] = new_text
         if new_text != text:
             if GS.debug_level > 3:
                 logger.debug('Replacing KiCad text variables: {} -> {}'.format(text, new_text))
@@ -651,6 +690,7 @@ class GS(object):
         assert sm.LoadProject(pro_name)
         # If we use the old project KiCad SIGSEGV
         GS.board = None
+        GS.board_changed()
 
     @staticmethod
     def get_resource_path(name):
@@ -788,6 +828,7 @@ class GS(object):
             zones = board.Zones()
         pcbnew.ZONE_FILLER(board).Fill(zones)
         board.BuildConnectivity()
+        GS.board_changed()
 
     @staticmethod
     def get_kiauto_video_name(cmd):
@@ -993,6 +1034,37 @@ class GS(object):
     def mkdtemp(mod):
         return tempfile.mkdtemp(prefix='tmp-kibot-'+mod+'-')
 
+    @staticmethod
+    def get_cache_dir(mod):
+        """ Directory used to keep data between runs.
+            The base dir can be changed using the KIBOT_CACHE_DIR environment variable """
+        base = os.environ.get('KIBOT_CACHE_DIR')
+        base = os.path.abspath(base) if base else os.path.join(os.path.expanduser('~'), '.cache', 'kibot')
+        cache_dir = os.path.join(base, mod)
+        os.makedirs(cache_dir, exist_ok=True)
+        return cache_dir
+
+    @staticmethod
+    def prune_cache_dir(cache_dir, days=30):
+        """ Remove the entries of a cache dir that weren't used in the specified number of days """
+        limit = time.time()-days*24*3600
+        for entry in os.scandir(cache_dir):
+            if entry.stat().st_mtime < limit:
+                logger.debug('Removing old cache entry '+entry.path)
+                if entry.is_dir():
+                    rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+
+    @staticmethod
+    def get_workers(workers=0):
+        """ Number of parallel workers to use. 0 means the global value, and 0 there means the number of CPUs """
+        if not workers:
+            workers = GS.global_workers
+        if not workers:
+            workers = os.cpu_count() or 1
+        return int(workers)
+
     @staticmethod
     def set_global_options_tree(tree):
         glb = GS.class_for_global_opts()
@@ -1013,6 +1085,8 @@ class GS(object):
         prj = GS.read_pro()
         board.Save(pcb_file)
         GS.write_pro(prj)
+        # We save the board after modifying it
+        GS.board_changed()
 
     # Naive stop mechanism, abstracted in case we need something more complex
     @staticmethod
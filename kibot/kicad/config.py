@@ -17,6 +17,7 @@ I'm not even sure the values are correct.
 import atexit
 import csv
 from glob import glob
+from hashlib import sha1
 from io import StringIO
 import json
 import os
@@ -116,6 +117,11 @@ def expand_env(val, env, extra_env, used_extra=None):
     return val
 
 
+LIB_ALIAS_ATTRS = {'name', 'type', 'uri', 'options', 'descr'}
+# Increment it when the format of the cached lib tables changes
+LIB_TABLE_CACHE_VERSION = 1
+
+
 class LibAlias(object):
     """ An entry for the symbol libs table """
     def __init__(self):
@@ -129,21 +135,34 @@ class LibAlias(object):
 
     @staticmethod
     def parse(items, env, extra_env):
-        s = LibAlias()
+        warnings = []
+        s = LibAlias.from_raw(LibAlias.parse_raw(items, warnings), env, extra_env)
+        for w in warnings:
+            logger.warning(w)
+        return s
+
+    @staticmethod
+    def parse_raw(items, warnings):
+        """ The attributes of a lib table entry, without expanding the variables """
+        raw = {}
         for i in items[1:]:
             i_type = _check_is_symbol_list(i)
-            if i_type == 'name':
-                s.name = _check_relaxed(i, 1, i_type)
-            elif i_type == 'type':
-                s.type = _check_relaxed(i, 1, i_type)
-            elif i_type == 'uri':
-                s.uri = os.path.abspath(expand_env(_check_relaxed(i, 1, i_type), env, extra_env))
-            elif i_type == 'options':
-                s.options = _check_relaxed(i, 1, i_type)
-            elif i_type == 'descr':
-                s.descr = _check_relaxed(i, 1, i_type)
+            if i_type in LIB_ALIAS_ATTRS:
+                raw[i_type] = _check_relaxed(i, 1, i_type)
             else:
-                logger.warning(W_LIBTUNK+'Unknown lib table attribute `{}`'.format(i))
+                warnings.append(W_LIBTUNK+'Unknown lib table attribute `{}`'.format(i))
+        return raw
+
+    @staticmethod
+    def from_raw(raw, env, extra_env):
+        s = LibAlias()
+        s.name = raw.get('name')
+        s.type = raw.get('type')
+        uri = raw.get('uri')
+        if uri is not None:
+            s.uri = os.path.abspath(expand_env(uri, env, extra_env))
+        s.options = raw.get('options')
+        s.descr = raw.get('descr')
         s.legacy = s.type is not None and s.type != 'Legacy'
         return s
 
@@ -166,6 +185,8 @@ class KiConf(object):
     kicad_env = {}
     lib_aliases = None
     fp_aliases = None
+    # Parsed lib tables, by file name
+    lib_tables = {}
     aliases_3D = {}
 
     def __init__(self):
@@ -474,8 +495,49 @@ class KiConf(object):
     def load_lib_aliases(fname, lib_aliases):
         if not os.path.isfile(fname):
             return False
+        table = KiConf.load_lib_table(fname)
+        for w in table['warnings']:
+            logger.warning(w)
+        for raw in table['entries']:
+            alias = LibAlias.from_raw(raw, KiConf.kicad_env, {})
+            if GS.debug_level > 1:
+                logger.debug('- Adding lib alias '+str(alias))
+            lib_aliases[alias.name] = alias
+        return True
+
+    def load_lib_table(fname):
+        """ The entries of a lib table, without expanding the variables.
+            The result is kept in memory and on disk, the hash of the file is used to validate it. """
+        with open(fname, 'rb') as f:
+            hash = sha1(f.read()).hexdigest()
+        fname = os.path.abspath(fname)
+        table = KiConf.lib_tables.get(fname)
+        if table is not None and table['hash'] == hash:
+            return table
+        cache_name = os.path.join(GS.get_cache_dir('lib_tables'), sha1(fname.encode()).hexdigest()+'.json')
+        try:
+            with open(cache_name, 'rt') as f:
+                table = json.load(f)
+            if table.get('version') != LIB_TABLE_CACHE_VERSION or table.get('hash') != hash:
+                table = None
+        except (OSError, ValueError):
+            table = None
+        if table is None:
+            table = KiConf.parse_lib_table(fname)
+            table['hash'] = hash
+            try:
+                with open(cache_name+'.tmp', 'wt') as f:
+                    json.dump(table, f)
+                os.replace(cache_name+'.tmp', cache_name)
+            except OSError as e:
+                logger.debug('Failed to cache the lib table `{}`: {}'.format(fname, e))
+        else:
+            logger.debug('Using the cached lib table `{}`'.format(fname))
+        KiConf.lib_tables[fname] = table
+        return table
+
+    def parse_lib_table(fname):
         logger.debug('Loading symbols lib table `{}`'.format(fname))
-        version = 0
         with open(fname, 'rt') as f:
             error = None
             try:
@@ -486,20 +548,19 @@ class KiConf(object):
                 raise KiPlotConfigurationError('Error loading `{}`: {}'.format(fname, error))
         if not isinstance(table, list) or (table[0].value() != 'sym_lib_table' and table[0].value() != 'fp_lib_table'):
             raise KiPlotConfigurationError('Error loading `{}`: not a library table'.format(fname))
+        entries = []
+        warnings = []
         for e in table[1:]:
             e_type = _check_is_symbol_list(e)
             if e_type == 'version':
                 version = _check_integer(e, 1, e_type)
                 if version > SUP_VERSION:
-                    logger.warning(W_LIBTVERSION+"Unsupported lib table version, loading could fail")
+                    warnings.append(W_LIBTVERSION+"Unsupported lib table version, loading could fail")
             elif e_type == 'lib':
-                alias = LibAlias.parse(e, KiConf.kicad_env, {})
-                if GS.debug_level > 1:
-                    logger.debug('- Adding lib alias '+str(alias))
-                lib_aliases[alias.name] = alias
+                entries.append(LibAlias.parse_raw(e, warnings))
             else:
-                logger.warning(W_LIBTUNK+"Unknown lib table entry `{}`".format(e_type))
-        return True
+                warnings.append(W_LIBTUNK+"Unknown lib table entry `{}`".format(e_type))
+        return {'version': LIB_TABLE_CACHE_VERSION, 'entries': entries, 'warnings': warnings}
 
     def load_all_lib_aliases(table_name, sys_dir, pattern):
         # Load the default symbol libs table.
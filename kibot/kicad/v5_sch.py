@@ -9,6 +9,8 @@ A basic implementation of the .sch file format.
 Currently oriented to collect the components for the BoM.
 """
 # Encapsulate file/line
+from hashlib import sha1
+import json
 import re
 import os
 from xml.etree.ElementTree import Element, SubElement, tostring
@@ -25,6 +27,45 @@ from ..misc import (W_BADPOLI, W_POLICOORDS, W_BADSQUARE, W_BADCIRCLE, W_BADARC,
 from .. import log
 
 logger = log.get_logger()
+# Increment it when the format of the libraries index changes
+LIB_INDEX_VERSION = 2
+
+
+def _lib_index_name(file):
+    return os.path.join(GS.get_cache_dir('lib_index'), sha1(file.encode()).hexdigest()+'.json')
+
+
+def load_lib_index(file, encoding=None):
+    """ Index for a library (position of each entry) created by a previous run.
+        None if we don't have it or the library changed. """
+    file = os.path.abspath(file)
+    name = _lib_index_name(file)
+    try:
+        st = os.stat(file)
+        with open(name, 'rt') as f:
+            index = json.load(f)
+        if (index.get('version') != LIB_INDEX_VERSION or index.get('file') != file or
+           index.get('mtime') != st.st_mtime_ns or index.get('size') != st.st_size or index.get('encoding') != encoding):
+            return None
+        # Mark it as used
+        os.utime(name)
+    except (OSError, ValueError, AttributeError):
+        return None
+    return index
+
+
+def save_lib_index(file, st, entries, encoding=None, no_end=False):
+    """ Store the index for a library, st is the stat of the file we scanned """
+    file = os.path.abspath(file)
+    name = _lib_index_name(file)
+    index = {'version': LIB_INDEX_VERSION, 'file': file, 'mtime': st.st_mtime_ns, 'size': st.st_size,
+             'encoding': encoding, 'no_end': no_end, 'entries': entries}
+    try:
+        with open(name+'.tmp', 'wt') as f:
+            json.dump(index, f)
+        os.replace(name+'.tmp', name)
+    except OSError as e:
+        logger.debug('Failed to save the index for `{}`: {}'.format(file, e))
 
 
 class LineReader(object):
@@ -632,54 +673,96 @@ class SymLib(object):
         self.alias = {}
 
     @staticmethod
-    def _check_add(o, id, lib, needed, translate):
+    def _needed_name(id, lib, needed, translate):
+        """ The name used in `needed` for this symbol, None if we don't need it """
         if lib is None:
             # From a cache
-            if id in translate:
-                needed[translate[id]] = o
-                return True
-            return False
+            return translate.get(id)
         name = lib+':'+id
         if name in needed:
-            needed[name] = o
-            return True
-        else:
-            name = 'None:'+id
-            if name in needed:
-                needed[name] = o
-                return True
-        return False
+            return name
+        name = 'None:'+id
+        if name in needed:
+            return name
+        return None
+
+    @staticmethod
+    def _check_add(o, id, lib, needed, translate):
+        name = SymLib._needed_name(id, lib, needed, translate)
+        if name is None:
+            return False
+        needed[name] = o
+        return True
+
+    def _add(self, o, lib_alias, needed, translate):
+        # Only add components we need
+        if self._check_add(o, o.name, lib_alias, needed, translate):
+            self.comps[o.name] = o
+        if o.alias and lib_alias is not None:
+            for a in o.alias:
+                if self._check_add(o, a, lib_alias, needed, translate):
+                    self.alias[a] = o
 
     def load(self, file, lib_alias, needed):
-        """ Populates the class, file must exist """
-        logger.debug('Loading library `{}`'.format(file))
+        """ Populates the class, file must exist.
+            The first time we parse the whole library and create an index, so the next time we parse only the
+            components we need """
+        translate = {k.replace(':', '_'): k for k, v in needed.items() if v is None} if lib_alias is None else None
         with open(file, 'rt') as fh:
-            f = LibLineReader(fh, file)
-            line = f.get_line()
-            if not line.startswith('EESchema-LIBRARY'):
-                if file.endswith('kicad_sym'):
-                    raise SchLibError('Mixing KiCad 5 and KiCad 6 files is not allowed', line, f)
-                raise SchLibError('Missing library signature', line, f)
-            line = f.get_line()
-            translate = {k.replace(':', '_'): k for k, v in needed.items() if v is None} if lib_alias is None else None
-            while not (line.startswith('#End Library') or line.startswith('# End Library')):
-                if line.startswith('DEF'):
-                    o = LibComponent(line, f, file)
-                    if o.name:
-                        # Only add components we need
-                        if self._check_add(o, o.name, lib_alias, needed, translate):
-                            self.comps[o.name] = o
-                        if o.alias and lib_alias is not None:
-                            for a in o.alias:
-                                if self._check_add(o, a, lib_alias, needed, translate):
-                                    self.alias[a] = o
-                else:
-                    raise SchLibError('Unknown library entry', line, f)
-                try:
-                    line = f.get_line()
-                except SchLibError:
-                    logger.warning(W_NOENDLIB + 'Library without end of file comment: `{}`'.format(file))
-                    break
+            index = load_lib_index(file, fh.encoding)
+            if index is None:
+                self.load_all(fh, file, lib_alias, needed, translate)
+            else:
+                self.load_indexed(fh, file, lib_alias, needed, translate, index)
+
+    def load_all(self, fh, file, lib_alias, needed, translate):
+        logger.debug('Loading library `{}`'.format(file))
+        st = os.fstat(fh.fileno())
+        # Position and line number for each component, its name, aliases and if it generated warnings
+        entries = []
+        no_end = False
+        f = LibLineReader(fh, file)
+        line = f.get_line()
+        if not line.startswith('EESchema-LIBRARY'):
+            if file.endswith('kicad_sym'):
+                raise SchLibError('Mixing KiCad 5 and KiCad 6 files is not allowed', line, f)
+            raise SchLibError('Missing library signature', line, f)
+        pos = (fh.tell(), f.line)
+        line = f.get_line()
+        while not (line.startswith('#End Library') or line.startswith('# End Library')):
+            if line.startswith('DEF'):
+                warnings = log.MyLogger.warn_tcnt
+                o = LibComponent(line, f, file)
+                entries.append((pos[0], pos[1], o.name, o.alias, log.MyLogger.warn_tcnt != warnings))
+                if o.name:
+                    self._add(o, lib_alias, needed, translate)
+            else:
+                raise SchLibError('Unknown library entry', line, f)
+            pos = (fh.tell(), f.line)
+            try:
+                line = f.get_line()
+            except SchLibError:
+                logger.warning(W_NOENDLIB + 'Library without end of file comment: `{}`'.format(file))
+                no_end = True
+                break
+        save_lib_index(file, st, entries, fh.encoding, no_end)
+
+    def load_indexed(self, fh, file, lib_alias, needed, translate, index):
+        logger.debug('Loading library `{}` using its index'.format(file))
+        f = LibLineReader(fh, file)
+        for pos, line_n, name, alias, warned in index['entries']:
+            # Broken entries (no name) and the ones with warnings are parsed again to get the same warnings
+            if name is not None and not warned:
+                ids = [name]+alias if alias and lib_alias is not None else [name]
+                if all(self._needed_name(id, lib_alias, needed, translate) is None for id in ids):
+                    continue
+            fh.seek(pos)
+            f.line = line_n
+            o = LibComponent(f.get_line(), f, file)
+            if o.name:
+                self._add(o, lib_alias, needed, translate)
+        if index['no_end']:
+            logger.warning(W_NOENDLIB + 'Library without end of file comment: `{}`'.format(file))
 
 
 class DocLibEntry(object):
@@ -715,24 +798,54 @@ class DocLib(object):
         super().__init__()
         self.comps = OrderedDict()
 
-    def load(self, file):
-        """ Populates the class, file must exist """
-        logger.debug('Loading doc-lib `{}`'.format(file))
+    def load(self, file, names=None):
+        """ Populates the class, file must exist.
+            If we have an index for the file and `names` is provided we load only these entries """
         with open(file, 'rb') as fh:
-            f = DCMLineReader(fh, file)
-            line = f.get_line()
-            if not line.startswith('EESchema-DOCLIB'):
-                raise SchLibError('Missing DCM signature', line, f)
+            index = load_lib_index(file) if names is not None else None
+            if index is None:
+                self.load_all(fh, file)
+            else:
+                self.load_indexed(fh, file, names, index)
+
+    def _add(self, o):
+        self.comps[o.name] = o
+        if GS.debug_level > 1:
+            logger.debug('- '+repr(o))
+
+    def load_all(self, fh, file):
+        logger.debug('Loading doc-lib `{}`'.format(file))
+        st = os.fstat(fh.fileno())
+        # Position and line number for each entry, its name and if it generated warnings
+        entries = []
+        f = DCMLineReader(fh, file)
+        line = f.get_line()
+        if not line.startswith('EESchema-DOCLIB'):
+            raise SchLibError('Missing DCM signature', line, f)
+        pos = (fh.tell(), f.line)
+        line = f.get_line()
+        while not line.startswith('#End Doc Library'):
+            if line.startswith('$CMP'):
+                warnings = log.MyLogger.warn_tcnt
+                o = DocLibEntry(line[5:].lstrip(), f)
+                entries.append((pos[0], pos[1], o.name, log.MyLogger.warn_tcnt != warnings))
+                self._add(o)
+            else:
+                raise SchLibError('Unknown DCM entry', line, f)
+            pos = (fh.tell(), f.line)
             line = f.get_line()
-            while not line.startswith('#End Doc Library'):
-                if line.startswith('$CMP'):
-                    o = DocLibEntry(line[5:].lstrip(), f)
-                    self.comps[o.name] = o
-                    if GS.debug_level > 1:
-                        logger.debug('- '+repr(o))
-                else:
-                    raise SchLibError('Unknown DCM entry', line, f)
-                line = f.get_line()
+        save_lib_index(file, st, entries)
+
+    def load_indexed(self, fh, file, names, index):
+        logger.debug('Loading doc-lib `{}` using its index'.format(file))
+        f = DCMLineReader(fh, file)
+        for pos, line_n, name, warned in index['entries']:
+            # The entries with warnings are parsed again to get the same warnings
+            if name not in names and not warned:
+                continue
+            fh.seek(pos)
+            f.line = line_n
+            self._add(DocLibEntry(f.get_line()[5:].lstrip(), f))
 
 
 class SchematicField(object):
@@ -1541,12 +1654,7 @@ class Schematic(object):
         while True:
             line = f.get_line()
             if line.startswith('$EndDescr'):
-                self.title_ori = self.title = self.title_block.get('Title', '')
-                self.date = self.title_block.get('Date', '')
-                self.revision = self.title_block.get('Rev', '')
-                self.company = self.title_block.get('Comp', '')
-                for num in range(4):
-                    self.comment[num] = self.title_block.get('Comment'+str(num+1), '')
+                self.title_ori = self.title_block.get('Title', '')
                 return
             elif line.startswith('encoding'):
                 if line[9:14] != 'utf-8':
@@ -1563,6 +1671,30 @@ class Schematic(object):
                     raise SchFileError('Wrong entry in title block', line, f)
                 self.title_block[m.group(1)] = m.group(2)
 
+    def expand_title_block(self):
+        """ Copy the title block values and fill the missing ones.
+            The date can come from the file time, so this is also done for schematics from the cache """
+        self.title = self.title_block.get('Title', '')
+        self.date = GS.format_date(self.title_block.get('Date', ''), self.fname, 'SCH')
+        self.revision = self.title_block.get('Rev', '')
+        self.company = self.title_block.get('Comp', '')
+        for num in range(4):
+            self.comment[num] = self.title_block.get('Comment'+str(num+1), '')
+        if not self.title:
+            self.title = os.path.splitext(os.path.basename(self.fname))[0]
+
+    def expand_title_blocks(self):
+        """ Expand the title blocks of all the sheets """
+        done = set()
+        for s in [self]+self.all_sheets:
+            if id(s) not in done:
+                done.add(id(s))
+                s.expand_title_block()
+
+    def title_blocks(self):
+        """ The expanded title blocks of all the sheets """
+        return sorted(set((s.fname, s.title, s.date, s.revision, s.company, tuple(s.comment)) for s in [self]+self.all_sheets))
+
     def load(self, fname, project, sheet_path='', sheet_path_h='/', libs=None, fields=None, fields_lc=None, parent=None):
         """ Load a v5.x KiCad Schematic.
             The caller must be sure the file exists.
@@ -1602,10 +1734,7 @@ class Schematic(object):
                 raise SchFileError('Missing EELAYER END', line, f)
             # Load the title block
             self._get_title_block(f)
-            # Fill in some missing info
-            self.date = GS.format_date(self.date, fname, 'SCH')
-            if not self.title:
-                self.title = os.path.splitext(os.path.basename(fname))[0]
+            self.expand_title_block()
             logger.debug("SCH title: `{}`".format(self.title))
             logger.debug("SCH date: `{}`".format(self.date))
             logger.debug("SCH revision: `{}`".format(self.revision))
@@ -1716,6 +1845,7 @@ class Schematic(object):
                     logger.debug('Using `{}` for library alias `{}`'.format(alias.uri, k))
             else:
                 logger.warning(W_MISSLIB + 'Missing library `{}`'.format(k))
+        GS.prune_cache_dir(GS.get_cache_dir('lib_index'))
         # Create a hash with all the used components
         self.comps_data = {'{}:{}'.format(c.lib, c.name): None for c in self.get_components(exclude_power=False)}
         if GS.debug_level > 1:
@@ -1731,11 +1861,14 @@ class Schematic(object):
                     logger.warning(W_MISSLIB + 'Missing library `{}` ({})'.format(v, k))
                     o = None
                 self.lib_comps[k] = o
-                # Load doc-lib
+                # Load doc-lib, only the entries for the components we use
                 file = os.path.splitext(v)[0]+'.dcm'
                 if os.path.isfile(file):
+                    names = {n[len(k)+1:] for n in self.comps_data.keys() if n.startswith(k+':')}
+                    if o is not None:
+                        names.update(o.comps.keys(), o.alias.keys())
                     o = DocLib()
-                    o.load(file)
+                    o.load(file, names)
                 else:
                     o = None
                 self.dcms[k] = o
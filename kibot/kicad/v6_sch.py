@@ -1846,6 +1846,16 @@ class SchematicV6(Schematic):
         if not self.title:
             self.title = os.path.splitext(os.path.basename(self.fname))[0]
 
+    def expand_title_block(self):
+        """ Expand the text variables of the title block and fill the missing values.
+            The result depends on the project, environment and globals, not only on the file """
+        self.title = GS.expand_text_variables(self.title_ori or '')
+        self.date = GS.expand_text_variables(self.date_ori or '')
+        self.revision = GS.expand_text_variables(self.revision_ori or '')
+        self.company = GS.expand_text_variables(self.company_ori or '')
+        self.comment = [GS.expand_text_variables(c) for c in self.comment_ori]
+        self._fill_missing_title_block()
+
     def _get_title_block(self, items):
         if not isinstance(items, list):
             raise SchError('The title block is not a list')
@@ -1855,26 +1865,20 @@ class SchematicV6(Schematic):
             i_type = item[0].value()
             if i_type == 'title':
                 self.title_ori = _check_str(item, 1, i_type)
-                self.title = GS.expand_text_variables(self.title_ori)
             elif i_type == 'date':
                 self.date_ori = _check_str(item, 1, i_type)
-                self.date = GS.expand_text_variables(self.date_ori)
             elif i_type == 'rev':
                 self.revision_ori = _check_str(item, 1, i_type)
-                self.revision = GS.expand_text_variables(self.revision_ori)
             elif i_type == 'company':
                 self.company_ori = _check_str(item, 1, i_type)
-                self.company = GS.expand_text_variables(self.company_ori)
             elif i_type == 'comment':
                 index = _check_integer(item, 1, i_type)
                 if index < 1 or index > 9:
                     raise SchError('Unsupported comment index {} in title block'.format(index))
-                value = _check_str(item, 2, i_type)
-                self.comment_ori[index-1] = value
-                self.comment[index-1] = GS.expand_text_variables(value)
+                self.comment_ori[index-1] = _check_str(item, 2, i_type)
             else:
                 raise SchError('Unsupported entry in title block ({})'.format(item))
-        self._fill_missing_title_block()
+        self.expand_title_block()
         logger.debug("SCH title: `{}`".format(self.title_ori))
         logger.debug("SCH date: `{}`".format(self.date_ori))
         logger.debug("SCH revision: `{}`".format(self.revision_ori))
@@ -12,7 +12,9 @@ A basic implementation of the .kicad_wks file format.
 Documentation: https://dev-docs.kicad.org/en/file-formats/sexpr-worksheet/
 """
 from base64 import b64decode
+from copy import copy
 import io
+import os
 from struct import unpack
 from pcbnew import wxPoint, wxSize, FromMM, wxPointMM
 from ..gs import GS
@@ -39,6 +41,8 @@ from .. import log
 
 logger = log.get_logger()
 setup = None
+# Worksheets already loaded: absolute file name -> ((mtime, size), Worksheet)
+_loaded = {}
 # The version of "kicad_wks" used for all tests is 20210606
 # 20220228 seems to be fully supported
 # And now 20231118, but the documentation is from 2023-04-13 ...
@@ -115,6 +119,10 @@ class WksDrawing(object):
         self.name = ''
         self.option = ''
 
+    def is_static(self):
+        """ True if the element looks the same for all the pages """
+        return True
+
     def parse_fixed_args(self, items):
         """ Default parser for fixed arguments.
             Used when no fixed args are used. """
@@ -289,6 +297,9 @@ class WksText(WksDrawing):
         else:
             super().parse_specific_args(i_type, i, items, offset)
 
+    def is_static(self):
+        return '${' not in self.text
+
     def draw(e, p):
         pos, posi = p.solve_ref(e.pos, e.incrx, e.incry, e.pos_ref)
         text = GS.expand_text_variables(e.text, p.tb_vars)
@@ -400,6 +411,9 @@ class WksBitmap(WksDrawing):
         self.pos_ref = 'rbcorner'
         self.scale = 1.0
         self.data = b''
+        # Gray version of the image, computed by the user (monochrome outputs)
+        self.gray_data = None
+        self.png_info = None
 
     def parse_specific_args(self, i_type, i, items, offset):
         if i_type == 'pos':
@@ -419,12 +433,21 @@ class WksBitmap(WksDrawing):
         else:
             super().parse_specific_args(i_type, i, items, offset)
 
+    def is_static(self):
+        # Not plotted by KiCad, we add it to the SVG of each page
+        return False
+
     def draw(e, p):
         # Can we draw it using KiCad? I don't see how
         # Make a list to be added to the SVG output
         p.images.append(e)
 
     def parse_png(e):
+        if e.png_info is None:
+            e.png_info = e.parse_png_data()
+        return e.png_info
+
+    def parse_png_data(e):
         s = e.data
         offset = 8
         ppi = 300
@@ -454,10 +477,10 @@ class WksBitmap(WksDrawing):
             raise WksError('Broken PNG, no IHDR chunk')
         return w, h, ppi
 
-    def add_to_svg(e, svg, p, svg_precision):
+    def add_to_svg(e, svg, p, svg_precision, monochrome=False):
         # Note: we compute all in KiCad IUs, and then apply a scale for the SVG
         w, h, ppi = e.parse_png()
-        s = e.data
+        s = e.gray_data if monochrome and e.gray_data is not None else e.data
         # For KiCad 300 dpi is 1:1 scale
         dpi = ppi/e.scale
         # Convert pixels to mm and then to KiCad units
@@ -543,6 +566,22 @@ class Worksheet(object):
                 raise WksError('Unknown worksheet attribute `{}`'.format(e_type))
         return Worksheet(setup, elements, version, generator+generator_version, has_images, wks)
 
+    @staticmethod
+    def load_cached(file):
+        """ Like load(), but the file is parsed only once, until it changes.
+            The elements are shared, don't modify them """
+        file = os.path.abspath(file)
+        st = os.stat(file)
+        stamp = (st.st_mtime_ns, st.st_size)
+        entry = _loaded.get(file)
+        if entry is None or entry[0] != stamp:
+            entry = (stamp, Worksheet.load(file))
+            _loaded[file] = entry
+        else:
+            logger.debugl(1, 'Using the already loaded worksheet `{}`'.format(file))
+        # A new object for the drawing state
+        return copy(entry[1])
+
     def set_page(self, pw, ph):
         pw = FromMM(pw)
         ph = FromMM(ph)
@@ -570,7 +609,10 @@ class Worksheet(object):
     def check_page(self, e):
         return e.option and ((e.option == 'page1only' and self.page != 1) or (e.option == 'notonpage1' and self.page == 1))
 
-    def draw(self, board, layer, page, page_w, page_h, tb_vars):
+    def draw(self, board, layer, page, page_w, page_h, tb_vars, static=None):
+        """ Adds the elements to the board.
+            Use static=True to draw only the elements that look the same for all the pages,
+            static=False for the rest and None for all """
         self.pcb_items = []
         self.set_page(page_w, page_h)
         self.layer = layer
@@ -580,13 +622,13 @@ class Worksheet(object):
         self.images = []
         for e in self.elements:
             # Some objects are for the first page, other for all but the first page, and most for all
-            if self.check_page(e):
+            if self.check_page(e) or (static is not None and e.is_static() != static):
                 continue
             e.draw(self)
 
-    def add_images_to_svg(self, svg, svg_precision):
+    def add_images_to_svg(self, svg, svg_precision, monochrome=False):
         for e in self.images:
-            e.add_to_svg(svg, self, svg_precision)
+            e.add_to_svg(svg, self, svg_precision, monochrome)
 
     def out_of_margin(self, p):
         """ Used to check if the repeat went outside the page usable area """
@@ -604,6 +646,8 @@ class Worksheet(object):
         for e in self.sexp[1:]:
             e_type = _check_is_symbol_list(e)
             if e_type == 'tbtext':
+                # Don't modify the original, could be shared
+                e = e[:]
                 e[1] = GS.expand_text_variables(e[1], vars)
             if e_type != 'bitmap' or not remove_images:
                 new_sexp.append(e)
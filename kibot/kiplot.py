@@ -35,6 +35,8 @@ import kibot.dep_downloader as dep_downloader
 from .kicad.v5_sch import Schematic, SchFileError, SchError, SchematicField
 from .kicad.v6_sch import SchematicV6, SchematicComponentV6
 from .kicad.config import KiConfError, KiConf, expand_env
+from .daemon import get_warm
+from .sch_cache import load_cached, save_cached
 from . import log
 INTERNAL_FIELDS = {'reference', 'value', 'footprint', 'datasheet', 'description'}
 
@@ -211,8 +213,11 @@ def load_board(pcb_file=None, forced=False):
         GS.check_pcb()
         pcb_file = GS.pcb_file
     try:
-        with hide_stderr():
-            board = pcbnew.LoadBoard(pcb_file)
+        # When running as a daemon the board could be already loaded
+        board = get_warm('pcb', pcb_file)
+        if board is None:
+            with hide_stderr():
+                board = pcbnew.LoadBoard(pcb_file)
         if GS.global_invalidate_pcb_text_cache == 'yes' and GS.ki6:
             # Workaround for unexpected KiCad behavior:
             # https://gitlab.com/kicad/code/kicad/-/issues/14360
@@ -243,6 +248,8 @@ def load_board(pcb_file=None, forced=False):
             # https://gitlab.com/kicad/code/kicad/-/commit/8184ed64e732ed0812831a13ebc04bd12e8d1d19
             board.SetElementVisibility(pcbnew.LAYER_HIDDEN_TEXT, False)
         GS.board = board
+        # Even when we got the same object (daemon) it could be modified
+        GS.board_changed()
     except OSError as e:
         GS.exit_with_error(['Error loading PCB file. Corrupted?', str(e)], CORRUPTED_PCB)
     assert board is not None
@@ -256,6 +263,10 @@ def ki_conf_error(e):
 
 
 def load_any_sch(file, project, fatal=True, extra_msg=None):
+    if GS.global_cache_schematics:
+        sch = load_cached(file, project)
+        if sch is not None:
+            return sch
     if file[-9:] == 'kicad_sch':
         sch = SchematicV6()
         load_libs = False
@@ -263,11 +274,15 @@ def load_any_sch(file, project, fatal=True, extra_msg=None):
         sch = Schematic()
         load_libs = True
     try:
+        warnings = log.MyLogger.warn_tcnt
         sch.load(file, project)
         if load_libs:
             sch.load_libs(file)
         if GS.debug_level > 1:
             logger.debug('Schematic dependencies: '+str(sch.get_files()))
+        # Don't cache it if we got warnings, they must be reported on each run
+        if GS.global_cache_schematics and log.MyLogger.warn_tcnt == warnings:
+            save_cached(file, project, sch)
     except SchFileError as e:
         if extra_msg is not None:
             logger.error(extra_msg)
@@ -50,6 +50,7 @@ CORRUPTED_PRO = 34
 BLENDER_ERROR = 35
 WARN_AS_ERROR = 36
 CHECK_FIELD = 37
+DAEMON_ERROR = 38
 error_level_to_name = ['NONE',
                        'INTERNAL_ERROR',
                        'WRONG_ARGUMENTS',
@@ -87,7 +88,8 @@ error_level_to_name = ['NONE',
                        'CORRUPTED_PRO',
                        'BLENDER_ERROR',
                        'WARN_AS_ERROR',
-                       'CHECK_FIELD'
+                       'CHECK_FIELD',
+                       'DAEMON_ERROR'
                        ]
 KICOST_SUBMODULE = '../submodules/KiCost/src/kicost'
 EXAMPLE_CFG = 'example_template.kibot.yaml'
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024 Salvador E. Tropea
+# Copyright (c) 2024 Instituto Nacional de Tecnología Industrial
+# License: AGPL-3.0
+# Project: KiBot (formerly KiPlot)
+"""
+Variant netlists shared by the outputs.
+iBoM and KiCost need an XML netlist with the variant applied. The netlist is generated once for each list of
+components (after applying filters and variants) and excluded fields, all the outputs get the same file.
+When the `cache_schematics` global option is enabled the netlists are also kept in the cache dir, in this case the
+key also contains the hash of the files used to load the schematic.
+"""
+import atexit
+from hashlib import sha1
+import os
+from shutil import rmtree
+from .gs import GS
+from . import sch_cache
+from . import log
+
+logger = log.get_logger()
+# Netlists generated during this run: (components hash, name) -> (schematic, file name)
+_netlists = {}
+# Hash of the files for the current schematic: (schematic, hash)
+_sch_hash = (None, None)
+_tmp_dir = None
+
+
+def comps_hash(comps, excluded, fitted, no_field):
+    """ Hash for all the data used to create the components section """
+    h = sha1()
+    for c in comps:
+        sheet = getattr(c, 'parent_sheet', None)
+        h.update(repr((c.ref, c.id, c.included, c.fitted, c.value, c.footprint, c.datasheet, c.get_user_fields(), c.lib,
+                       c.name, c.desc, c.sheet_path_h, c.sheet_path, sheet.fname if sheet else None)).encode())
+    h.update(repr((excluded, fitted, sorted(no_field), GS.sch.netlist_version)).encode())
+    return h.hexdigest()
+
+
+def sch_hash():
+    """ Hash for the files used to load the schematic and the title blocks, the design and libparts sections depend
+        on them """
+    global _sch_hash
+    if _sch_hash[0] is not GS.sch:
+        h = sha1(repr((sch_cache.environment(), GS.sch.title_blocks())).encode())
+        for fname in sch_cache.related_files(GS.sch_file, GS.sch):
+            h.update((fname+'\0'+str(sch_cache.file_hash(fname))).encode())
+        _sch_hash = (GS.sch, h.hexdigest())
+    return _sch_hash[1]
+
+
+def remove_tmp_dir():
+    if _tmp_dir is not None:
+        rmtree(_tmp_dir, ignore_errors=True)
+
+
+def get_tmp_dir():
+    global _tmp_dir
+    if _tmp_dir is None:
+        _tmp_dir = GS.mkdtemp('netlists')
+        atexit.register(remove_tmp_dir)
+    return _tmp_dir
+
+
+def get_netlist(comps, base_name, excluded=False, fitted=True, no_field=()):
+    """ Name of an XML netlist for the components, the file will be base_name.xml (some tools show it).
+        The rest of the arguments are the same used by save_netlist.
+        The file is shared, don't modify or remove it """
+    chash = comps_hash(comps, excluded, fitted, no_field)
+    key = (chash, base_name)
+    sch, name = _netlists.get(key, (None, None))
+    if sch is GS.sch and os.path.isfile(name):
+        logger.debug('Using the already created variant netlist `{}`'.format(name))
+        return name
+    if GS.global_cache_schematics:
+        cache_dir = GS.get_cache_dir('netlists')
+        GS.prune_cache_dir(cache_dir)
+        net_dir = os.path.join(cache_dir, sha1((chash+sch_hash()).encode()).hexdigest())
+    else:
+        net_dir = os.path.join(get_tmp_dir(), chash)
+    name = os.path.join(net_dir, base_name+'.xml')
+    if os.path.isfile(name):
+        # Mark it as used
+        os.utime(net_dir)
+        logger.debug('Using the cached variant netlist `{}`'.format(name))
+    else:
+        logger.debug('Creating variant netlist `{}`'.format(name))
+        os.makedirs(net_dir, exist_ok=True)
+        with open(name+'.tmp', 'wb') as f:
+            GS.sch.save_netlist(f, comps, excluded, fitted, no_field)
+        os.replace(name+'.tmp', name)
+    _netlists[key] = (GS.sch, name)
+    return name
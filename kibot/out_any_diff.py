@@ -3,8 +3,14 @@
 # Copyright (c) 2022-2024 Instituto Nacional de Tecnología Industrial
 # License: GPL-3.0
 # Project: KiBot (formerly KiPlot)
+from contextlib import contextmanager
+from hashlib import sha1
+import json
 import os
-from subprocess import CalledProcessError
+from shutil import rmtree, copytree
+from subprocess import CalledProcessError, Popen, PIPE
+from tempfile import mkdtemp
+import time
 from .gs import GS
 from .kiplot import run_command
 from .out_base import VariantOptions
@@ -29,6 +35,149 @@ def has_repo(git_command, file):
     return len(res.split('\n'))
 
 
+class GitObjectReader(object):
+    """ Reads files from the git objects, without a checkout.
+        Uses only one `git cat-file --batch` process for all the requests """
+    def __init__(self, git_command, repo_dir):
+        self.top = run_command([git_command, 'rev-parse', '--show-toplevel'], change_to=repo_dir)
+        logger.debug('Starting git cat-file at '+self.top)
+        self.proc = Popen([git_command, 'cat-file', '--batch'], stdin=PIPE, stdout=PIPE, cwd=self.top)
+
+    def read(self, rev, path):
+        """ Contents of `path` (relative to the top of the repo) at `rev`. None if not there """
+        self.proc.stdin.write('{}:{}\n'.format(rev, path.replace(os.sep, '/')).encode())
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().decode().split()
+        if len(header) != 3:
+            # missing/ambiguous
+            return None
+        data = self.proc.stdout.read(int(header[2])+1)[:-1]
+        return data if header[1] == 'blob' else None
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+class RenderStore(object):
+    """ Cache of rendered revisions, shared by all the runs.
+        Each entry is a directory named using a hash of the file and the render options.
+        The entries are created atomically and a lock file avoids rendering the same entry
+        from more than one KiBot instance """
+    def __init__(self, name):
+        self.path = GS.get_cache_dir(name)
+        self.hits = self.misses = 0
+        self.used = set()
+
+    def entry(self, key):
+        return os.path.join(self.path, key)
+
+    def has(self, key):
+        """ Check if we have this entry, and mark it as used """
+        dest = self.entry(key)
+        self.used.add(key)
+        if not os.path.isdir(dest):
+            self.misses += 1
+            logger.debug('Render cache miss for '+key)
+            return False
+        # Used for the LRU
+        os.utime(dest)
+        self.hits += 1
+        logger.debug('Render cache hit for '+key)
+        return True
+
+    @contextmanager
+    def lock(self, key, stale=3600):
+        """ Lock an entry, locks older than `stale` seconds are from dead instances """
+        name = self.entry(key)+'.lock'
+        waiting = False
+        while True:
+            try:
+                os.close(os.open(name, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time()-os.path.getmtime(name) > stale:
+                        logger.debug('Removing stale lock '+name)
+                        os.remove(name)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if not waiting:
+                    logger.debug('Waiting for another instance rendering '+key)
+                    waiting = True
+                time.sleep(0.5)
+        try:
+            yield
+        finally:
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def mkdtemp(self):
+        return mkdtemp(dir=self.path, prefix='.tmp-')
+
+    def publish(self, src, key, copy=False):
+        """ Move (or copy) a rendered directory to the store """
+        tmp = None
+        if copy:
+            tmp = self.mkdtemp()
+            copytree(src, os.path.join(tmp, key))
+            src = os.path.join(tmp, key)
+        dest = self.entry(key)
+        if os.path.isdir(dest):
+            rmtree(dest)
+        os.rename(src, dest)
+        if tmp:
+            rmtree(tmp)
+
+    @staticmethod
+    def dir_size(path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, f))
+                except OSError:
+                    pass
+        return total
+
+    def prune(self, max_size, keep_recent=600):
+        """ Remove the least recently used entries until the store fits in `max_size` MB.
+            The entries used by this run and the ones used in the last `keep_recent` seconds are kept """
+        now = time.time()
+        entries = []
+        total = 0
+        for e in os.scandir(self.path):
+            if not e.is_dir():
+                continue
+            mtime = e.stat().st_mtime
+            if e.name.startswith('.tmp-'):
+                # Left by an interrupted run
+                if now-mtime > 24*3600:
+                    rmtree(e.path, ignore_errors=True)
+                continue
+            size = self.dir_size(e.path)
+            total += size
+            entries.append((mtime, size, e))
+        max_size *= 1024*1024
+        if not max_size or total <= max_size:
+            return
+        for mtime, size, e in sorted(entries, key=lambda x: x[0]):
+            if total <= max_size:
+                break
+            if e.name in self.used or now-mtime < keep_recent or os.path.isfile(e.path+'.lock'):
+                continue
+            logger.debug('Removing render cache entry '+e.path)
+            rmtree(e.path, ignore_errors=True)
+            total -= size
+
+    def report(self):
+        if self.hits or self.misses:
+            logger.info(f'- Render cache: {self.hits} hit/s, {self.misses} miss/es')
+
+
 class AnyDiffOptions(VariantOptions):
     def __init__(self):
         with document:
@@ -36,10 +185,21 @@ class AnyDiffOptions(VariantOptions):
             """ [global,fill,unfill,none] How to handle PCB zones. The default is *global* and means that we
                 fill zones if the *check_zone_fills* preflight is enabled. The *fill* option always forces
                 a refill, *unfill* forces a zone removal and *none* lets the zones unchanged """
+            self.cache_renders = True
+            """ Keep the images of the compared revisions between runs (in ~/.cache/kibot), so a revision
+                is rendered only once. The images are reused when the file and the options that affect
+                the images are the same """
+            self.cache_size = 1024
+            """ [0,1000000] Maximum size for the cache of rendered revisions, in MB. When exceeded the least
+                recently used revisions are removed. Use 0 for no limit """
         super().__init__()
         self._expand_id = 'diff'
         self._expand_ext = 'pdf'
         self._kiri_mode = False
+        self._store_name = 'diff'
+        self._solved_layers = None
+        self._store = None
+        self._kidiff_version = None
 
     def add_zones_ops(self, cmd):
         if self.zones == 'global':
@@ -50,21 +210,59 @@ class AnyDiffOptions(VariantOptions):
         elif self.zones == 'unfill':
             cmd.extend(['--zones', 'unfill'])
 
-    def add_to_cache(self, name, hash):
-        cmd = [self.command, '--no_reader', '--only_cache', '--old_file_hash', hash, '--cache_dir', self.cache_dir]
+    def all_pages(self):
+        return not getattr(self, 'only_first_sch_page', False)
+
+    def init_store(self):
+        """ Create the render store, if enabled """
+        self._store = RenderStore(self._store_name) if self.cache_renders else None
+        return self._store
+
+    def close_store(self):
+        if self._store is None:
+            return
+        self._store.report()
+        self._store.prune(self.cache_size)
+
+    def render_key(self, hash):
+        """ Key for the render store: the file hash plus anything that affects the images """
+        zones = []
+        self.add_zones_ops(zones)
+        layers = [la.id for la in self._solved_layers] if self._solved_layers else None
+        data = [hash, zones, layers, self.all_pages(), self._kiri_mode, self._kidiff_version, GS.kicad_version]
+        return sha1(json.dumps(data, default=str).encode()).hexdigest()
+
+    def render(self, name, hash, cache_dir):
+        cmd = [self.command, '--no_reader', '--only_cache', '--old_file_hash', hash, '--cache_dir', cache_dir]
         if self._kiri_mode:
             cmd.append('--kiri_mode')
         self.add_zones_ops(cmd)
         if self.incl_file:
             cmd.extend(['--layers', self.incl_file])
-        if not hasattr(self, 'only_first_sch_page') or not self.only_first_sch_page:
+        if self.all_pages():
             cmd.append('--all_pages')
         if GS.debug_enabled:
             cmd.insert(1, '-'+'v'*GS.debug_level)
         cmd.extend([name, name])
-        self.name_used_for_cache = name
         run_command(cmd)
 
+    def add_to_cache(self, name, hash):
+        """ Render the file to the cache, returns the hash used for it """
+        self.name_used_for_cache = name
+        if self._store is None:
+            self.render(name, hash, self.cache_dir)
+            return hash
+        key = self.render_key(hash)
+        with self._store.lock(key):
+            if not self._store.has(key):
+                tmp = self._store.mkdtemp()
+                try:
+                    self.render(name, key, tmp)
+                    self._store.publish(os.path.join(tmp, key), key)
+                finally:
+                    rmtree(tmp, ignore_errors=True)
+        return key
+
     def run_git(self, cmd, cwd=None, just_raise=False):
         if cwd is None:
             cwd = self.repo_dir
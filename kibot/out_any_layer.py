@@ -5,6 +5,7 @@
 # License: GPL-3.0
 # Project: KiBot (formerly KiPlot)
 # Adapted from: https://github.com/johnbeard/kiplot
+from multiprocessing import get_all_start_methods, get_context
 import os
 import re
 from pcbnew import (GERBER_JOBFILE_WRITER, PLOT_CONTROLLER, IsCopperLayer, F_Cu, B_Cu, Edge_Cuts, PLOT_FORMAT_HPGL,
@@ -43,6 +44,26 @@ class CustomReport(Optionable):
         return self.output
 
 
+# The job for the plot_layer_job workers, inherited when forking
+plot_job = None
+
+
+def plot_layer_job(index):
+    """ Worker for AnyLayerOptions.plot_layers_parallel, runs in a forked process """
+    options, plot_ctrl, po, layers, output_dir = plot_job
+    msgs = []
+    cnts = (log.MyLogger.warn_tcnt, log.MyLogger.warn_cnt, log.MyLogger.n_filtered)
+    filename = error = None
+    try:
+        filename = options.plot_one_layer(plot_ctrl, po, layers[index], output_dir, debug=msgs.append)
+    except BaseException as e:
+        # Things like GS.exit_with_error raise SystemExit, if we let it go the pool waits forever
+        error = e
+    # The parent must know about the warnings we reported
+    cnts = (log.MyLogger.warn_tcnt-cnts[0], log.MyLogger.warn_cnt-cnts[1], log.MyLogger.n_filtered-cnts[2])
+    return filename, msgs, error, cnts
+
+
 class AnyLayerOptions(VariantOptions):
     """ Base class for: DXF, Gerber, HPGL, PDF, PS and SVG """
     def __init__(self):
@@ -89,6 +110,9 @@ class AnyLayerOptions(VariantOptions):
             self.individual_page_scaling = True
             """ Tell KiCad to apply the scaling for each layer as a separated entity.
                 Disabling it the pages are coherent and can be superposed """
+            self.workers = 0
+            """ [0,64] Number of processes used to plot the layers. Use 0 to use the `plot_workers` global
+                option. Only available on systems that can fork processes (i.e. not Windows) """
         super().__init__()
 
     def config(self, parent):
@@ -150,6 +174,64 @@ class AnyLayerOptions(VariantOptions):
             return
         plot_ctrl.PlotLayer()
 
+    def plot_one_layer(self, plot_ctrl, po, la, output_dir, debug=logger.debug):
+        """ Plot a layer to a file, returns the name of the file """
+        suffix = la.suffix
+        id = la.id
+        if self._plot_format != PLOT_FORMAT_GERBER and self.individual_page_scaling:
+            # Only this layer is visible
+            vis_layers = LSET()
+            vis_layers.addLayer(la._id)
+            GS.board.SetVisibleLayers(vis_layers)
+        # Set current layer
+        plot_ctrl.SetLayer(id)
+        # Skipping NPTH is controlled by whether or not this is
+        # a copper layer
+        is_cu = IsCopperLayer(id)
+        po.SetSkipPlotNPTH_Pads(is_cu)
+        # Plot single layer to file
+        debug("Opening plot file for layer `{}` format `{}`".format(la, self._plot_format))
+        if not plot_ctrl.OpenPlotfile(suffix, self._plot_format, la.description):
+            # Shouldn't happen
+            raise PlotError("OpenPlotfile failed!")  # pragma: no cover (Internal)
+        # Compute the current file name and the one we want
+        k_filename = plot_ctrl.GetPlotFileName()
+        filename = self.compute_name(k_filename, output_dir, self.output, id, suffix)
+        debug("Plotting layer `{}` to `{}`".format(la, filename))
+        self.plot_layer(plot_ctrl, id)
+        plot_ctrl.ClosePlot()
+        if self.output and k_filename != filename:
+            os.replace(k_filename, filename)
+        return filename
+
+    def plot_layers_parallel(self, plot_ctrl, po, layers, output_dir, workers):
+        """ Plot the layers using forked processes.
+            The children inherit the board (with the variant applied) and the plot controller """
+        global plot_job
+        logger.debug(f'Plotting {len(layers)} layers using {workers} processes')
+        plot_job = (self, plot_ctrl, po, layers, output_dir)
+        try:
+            with get_context('fork').Pool(workers) as pool:
+                res = pool.map(plot_layer_job, range(len(layers)), chunksize=1)
+        finally:
+            plot_job = None
+        # Show the messages from the children in the same order used for a serial run
+        filenames = []
+        error = None
+        for filename, msgs, err, cnts in res:
+            for msg in msgs:
+                logger.debug(msg)
+            filenames.append(filename)
+            log.MyLogger.warn_tcnt += cnts[0]
+            log.MyLogger.warn_cnt += cnts[1]
+            log.MyLogger.n_filtered += cnts[2]
+            if error is None:
+                error = err
+        if error is not None:
+            # Report the first error, as a serial run would do
+            raise error
+        return filenames
+
     def run(self, output_dir, layers):
         super().run(output_dir)
         if GS.ki7 and GS.kicad_version_n < KICAD_VERSION_7_0_1 and not self.exclude_edge_layer:
@@ -180,39 +262,20 @@ class AnyLayerOptions(VariantOptions):
             for la in layers:
                 vis_layers.addLayer(la._id)
             GS.board.SetVisibleLayers(vis_layers)
+        used = []
         for la in layers:
-            suffix = la.suffix
-            desc = la.description
-            id = la.id
-            if not GS.board.IsLayerEnabled(id):
-                logger.warning(W_NOLAYER+f'Layer "{desc}" ({la.suffix}) isn\'t used')
+            if not GS.board.IsLayerEnabled(la.id):
+                logger.warning(W_NOLAYER+f'Layer "{la.description}" ({la.suffix}) isn\'t used')
                 continue
-            if self._plot_format != PLOT_FORMAT_GERBER and self.individual_page_scaling:
-                # Only this layer is visible
-                vis_layers = LSET()
-                vis_layers.addLayer(la._id)
-                GS.board.SetVisibleLayers(vis_layers)
-            # Set current layer
-            plot_ctrl.SetLayer(id)
-            # Skipping NPTH is controlled by whether or not this is
-            # a copper layer
-            is_cu = IsCopperLayer(id)
-            po.SetSkipPlotNPTH_Pads(is_cu)
-            # Plot single layer to file
-            logger.debug("Opening plot file for layer `{}` format `{}`".format(la, self._plot_format))
-            if not plot_ctrl.OpenPlotfile(suffix, self._plot_format, desc):
-                # Shouldn't happen
-                raise PlotError("OpenPlotfile failed!")  # pragma: no cover (Internal)
-            # Compute the current file name and the one we want
-            k_filename = plot_ctrl.GetPlotFileName()
-            filename = self.compute_name(k_filename, output_dir, self.output, id, suffix)
-            logger.debug("Plotting layer `{}` to `{}`".format(la, filename))
-            self.plot_layer(plot_ctrl, id)
-            plot_ctrl.ClosePlot()
-            if self.output and k_filename != filename:
-                os.replace(k_filename, filename)
+            used.append(la)
+        workers = min(GS.get_workers(self.workers or GS.global_plot_workers), len(used))
+        if workers > 1 and 'fork' in get_all_start_methods():
+            filenames = self.plot_layers_parallel(plot_ctrl, po, used, output_dir, workers)
+        else:
+            filenames = [self.plot_one_layer(plot_ctrl, po, la, output_dir) for la in used]
+        for la, filename in zip(used, filenames):
             if create_job:
-                jobfile_writer.AddGbrFile(id, os.path.basename(filename))
+                jobfile_writer.AddGbrFile(la.id, os.path.basename(filename))
             generated[la.layer] = os.path.basename(filename)
         # Create the job file
         if create_job:
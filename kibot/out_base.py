@@ -846,6 +846,8 @@ class VariantOptions(BaseOptions):
     def filter_pcb_components(self, do_3D=False, do_2D=True, highlight=None):
         if not self.will_filter_pcb_components():
             return False
+        # The board will change, the primitives must be scanned again
+        GS.board_changed()
         self._comps_hash = self.get_refs_hash()
         if self._sub_pcb:
             self._sub_pcb.apply(self._comps_hash)
@@ -872,6 +874,7 @@ class VariantOptions(BaseOptions):
     def unfilter_pcb_components(self, do_3D=False, do_2D=True):
         if not self.will_filter_pcb_components():
             return
+        GS.board_changed()
         if do_2D and self._comps_hash:
             self.uncross_modules(GS.board, self._comps_hash)
             self.restore_paste_and_glue(GS.board, self._comps_hash)
@@ -1128,6 +1131,10 @@ class VariantOptions(BaseOptions):
         self._parent.dir = self.old_dir
         self._parent._done = self.old_done
 
+    def can_compose_steps(self):
+        """ Renderers that can create the `populate` steps from a base plot must implement `create_step_images` """
+        return False
+
     def apply_show_components(self):
         if self._show_all_components:
             # Don't change anything
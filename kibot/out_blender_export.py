@@ -8,12 +8,11 @@ Dependencies:
   - from: Blender
     role: mandatory
     version: 3.4.0
-  - from: ImageMagick
-    role: Automatically crop images
 """
 import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 from .error import KiPlotConfigurationError
 from .kiplot import get_output_targets, run_output, run_command, register_xmp_import, config_output, configure_and_run
@@ -361,6 +360,10 @@ class Blender_ExportOptions(BaseOptions):
             """ *[dict={}] Controls how the render is done for the `render` output type """
             self.point_of_view = BlenderPointOfViewOptions
             """ *[dict|list(dict)] How the object is viewed by the camera """
+            self.workers = 1
+            """ [0,64] Number of Blender instances used to process the points of view.
+                Each instance loads the scene once and processes a group of consecutive points of view.
+                0 means to use the global `workers` value. Note that each instance needs its own memory """
         super().__init__()
         self._expand_id = '3D_blender'
         self._unknown_is_error = True
@@ -536,6 +539,32 @@ class Blender_ExportOptions(BaseOptions):
         if 'Traceback ' in msg:
             GS.exit_with_error('Error from Blender run:\n'+msg[msg.index('Traceback '):], BLENDER_ERROR)
 
+    def get_shards(self, povs, outputs):
+        """ Split the points of view in contiguous groups, one for each Blender instance """
+        workers = min(GS.get_workers(self.workers), len(povs))
+        shards = []
+        for n in range(workers):
+            b = n*len(povs)//workers
+            e = (n+1)*len(povs)//workers
+            shards.append((povs[b:e], outputs[b:e]))
+        return shards
+
+    def run_shard(self, cmd, scene, povs, outputs, pcb3d_file):
+        """ Runs one Blender instance to render the `povs` points of view """
+        with NamedTemporaryFile(mode='w', suffix='.json') as f:
+            scene = dict(scene)
+            scene['point_of_view'] = povs
+            text = json.dumps(scene, sort_keys=True, indent=2)
+            logger.debug('Scene:\n'+text)
+            f.write(text)
+            f.flush()
+            cmd = cmd+['--format']+[o[0] for outs in outputs for o in outs]
+            cmd += ['--output']+[o[1] for outs in outputs for o in outs]
+            cmd.extend(['--scene', f.name])
+            cmd.append(pcb3d_file)
+            # Execute the command
+            self.analyze_errors(run_command(cmd))
+
     def run(self, output):
         if GS.ki5:
             GS.exit_with_error("`blender_export` needs KiCad 6+", MISSING_TOOL)
@@ -551,110 +580,101 @@ class Blender_ExportOptions(BaseOptions):
         if self.render_options.auto_crop:
             # Avoid a gradient
             self.render_options.background2 = self.render_options.background1
-            convert_command = self.ensure_tool('ImageMagick')
-        # Create a JSON with the scene information
-        with NamedTemporaryFile(mode='w', suffix='.json') as f:
-            scene = {}
-            if self.light:
-                lights = [{'name': light.name,
-                           'position': (light._pos_x, light._pos_y, light._pos_z),
-                           'type': light.type,
-                           'energy': light.energy} for light in self.light]
-                scene['lights'] = lights
-            if self.get_user_defined('camera'):
-                # Only when the user defined a camera, otherwise let the script create a suitable one
-                ca = self.camera
-                scene['camera'] = {'name': ca.name,
-                                   'type': ca._type}
-                if (hasattr(ca, '_pos_x_user_defined') or hasattr(ca, '_pos_y_user_defined') or
-                   hasattr(ca, '_pos_z_user_defined')):
-                    scene['camera']['position'] = (ca._pos_x, ca._pos_y, ca._pos_z)
-                if ca.clip_start >= 0:
-                    scene['camera']['clip_start'] = ca.clip_start
-            scene['fixed_auto_camera'] = self.fixed_auto_camera
-            scene['auto_camera_z_axis_factor'] = self.auto_camera_z_axis_factor
-            ro = self.render_options
-            scene['render'] = {'samples': ro.samples,
-                               'resolution_x': ro.resolution_x,
-                               'resolution_y': ro.resolution_y,
-                               'transparent_background': ro.transparent_background,
-                               'background1': ro.background1,
-                               'background2': ro.background2}
-            povs = []
-            last_pov = BlenderPointOfViewOptions()
-            for pov in point_of_view:
+        # Collect the scene information
+        scene = {}
+        if self.light:
+            lights = [{'name': light.name,
+                       'position': (light._pos_x, light._pos_y, light._pos_z),
+                       'type': light.type,
+                       'energy': light.energy} for light in self.light]
+            scene['lights'] = lights
+        if self.get_user_defined('camera'):
+            # Only when the user defined a camera, otherwise let the script create a suitable one
+            ca = self.camera
+            scene['camera'] = {'name': ca.name,
+                               'type': ca._type}
+            if (hasattr(ca, '_pos_x_user_defined') or hasattr(ca, '_pos_y_user_defined') or
+               hasattr(ca, '_pos_z_user_defined')):
+                scene['camera']['position'] = (ca._pos_x, ca._pos_y, ca._pos_z)
+            if ca.clip_start >= 0:
+                scene['camera']['clip_start'] = ca.clip_start
+        scene['fixed_auto_camera'] = self.fixed_auto_camera
+        scene['auto_camera_z_axis_factor'] = self.auto_camera_z_axis_factor
+        ro = self.render_options
+        scene['render'] = {'samples': ro.samples,
+                           'resolution_x': ro.resolution_x,
+                           'resolution_y': ro.resolution_y,
+                           'transparent_background': ro.transparent_background,
+                           'background1': ro.background1,
+                           'background2': ro.background2}
+        # Points of view and the files generated for each one
+        povs = []
+        pov_outputs = []
+        names = set()
+        order = 1
+        last_pov = BlenderPointOfViewOptions()
+        for pov in point_of_view:
+            for _ in range(pov.steps):
                 if pov.steps > 1:
-                    for _ in range(pov.steps):
-                        last_pov.increment(pov)
-                        povs.append({'rotate_x': -last_pov.rotate_x,
-                                     'rotate_y': -last_pov.rotate_y,
-                                     'rotate_z': -last_pov.rotate_z,
-                                     'view': pov._view})
+                    last_pov.increment(pov)
+                    cur_pov = last_pov
                 else:
-                    povs.append({'rotate_x': -pov.rotate_x,
-                                 'rotate_y': -pov.rotate_y,
-                                 'rotate_z': -pov.rotate_z,
-                                 'view': pov._view})
-                    last_pov = pov
-            scene['point_of_view'] = povs
-            text = json.dumps(scene, sort_keys=True, indent=2)
-            logger.debug('Scene:\n'+text)
-            f.write(text)
-            f.flush()
-            # Create the command line
-            script = os.path.join(os.path.dirname(__file__), 'blender_scripts', 'blender_export.py')
-            cmd = [command, '-b', '--factory-startup', '-P', script, '--']
-            pi = self.pcb_import
-            if not pi.components:
-                cmd.append('--no_components')
-            if not pi.cut_boards:
-                cmd.append('--dont_cut_boards')
-            if pi.texture_dpi != 1016.0:
-                cmd.extend(['--texture_dpi', str(pi.texture_dpi)])
-            if not pi.center:
-                cmd.append('--dont_center')
-            if not pi.enhance_materials:
-                cmd.append('--dont_enhance_materials')
-            if not pi.merge_materials:
-                cmd.append('--dont_merge_materials')
-            if pi.solder_joints != "SMART":
-                cmd.extend(['--solder_joints', pi.solder_joints])
-            if not pi.stack_boards:
-                cmd.append('--dont_stack_boards')
-            if self.render_options.no_denoiser:
-                cmd.append('--no_denoiser')
-            cmd.append('--format')
-            for pov in point_of_view:
-                for _ in range(pov.steps):
-                    for o in outputs:
-                        cmd.append(o.type)
-            cmd.append('--output')
-            names = set()
-            order = 1
-            for pov in point_of_view:
-                for _ in range(pov.steps):
-                    for o in outputs:
-                        name = self.get_output_filename(o, self._parent.output_dir, pov, order)
-                        if name in names:
-                            raise KiPlotConfigurationError('Repeated name (use `file_id`): '+name)
-                        cmd.append(name)
-                        names.add(name)
-                        os.makedirs(os.path.dirname(name), exist_ok=True)
-                    order += 1
-            cmd.extend(['--scene', f.name])
-            cmd.append(pcb3d_file)
-            # Execute the command
-            self.analyze_errors(run_command(cmd))
-        if self.render_options.auto_crop:
-            order = 1
-            for pov in point_of_view:
-                for _ in range(pov.steps):
-                    for o in outputs:
-                        if o.type != 'render':
-                            continue
-                        name = self.get_output_filename(o, self._parent.output_dir, pov, order)
-                        run_command([convert_command, name, '-trim', '+repage', '-trim', '+repage', name])
-                    order += 1
+                    cur_pov = last_pov = pov
+                povs.append({'rotate_x': -cur_pov.rotate_x,
+                             'rotate_y': -cur_pov.rotate_y,
+                             'rotate_z': -cur_pov.rotate_z,
+                             'view': pov._view})
+                files = []
+                for o in outputs:
+                    name = self.get_output_filename(o, self._parent.output_dir, pov, order)
+                    if name in names:
+                        raise KiPlotConfigurationError('Repeated name (use `file_id`): '+name)
+                    files.append((o.type, name))
+                    names.add(name)
+                    os.makedirs(os.path.dirname(name), exist_ok=True)
+                pov_outputs.append(files)
+                order += 1
+        # Create the command line
+        script = os.path.join(os.path.dirname(__file__), 'blender_scripts', 'blender_export.py')
+        shards = self.get_shards(povs, pov_outputs)
+        cmd = [command, '-b', '--factory-startup']
+        if len(shards) > 1:
+            # Share the CPUs between the Blender instances
+            cmd.extend(['-t', str(max(1, (os.cpu_count() or 1)//len(shards)))])
+        cmd.extend(['-P', script, '--'])
+        pi = self.pcb_import
+        if not pi.components:
+            cmd.append('--no_components')
+        if not pi.cut_boards:
+            cmd.append('--dont_cut_boards')
+        if pi.texture_dpi != 1016.0:
+            cmd.extend(['--texture_dpi', str(pi.texture_dpi)])
+        if not pi.center:
+            cmd.append('--dont_center')
+        if not pi.enhance_materials:
+            cmd.append('--dont_enhance_materials')
+        if not pi.merge_materials:
+            cmd.append('--dont_merge_materials')
+        if pi.solder_joints != "SMART":
+            cmd.extend(['--solder_joints', pi.solder_joints])
+        if not pi.stack_boards:
+            cmd.append('--dont_stack_boards')
+        if ro.no_denoiser:
+            cmd.append('--no_denoiser')
+        if ro.auto_crop:
+            cmd.append('--auto_crop')
+        if len(shards) == 1:
+            self.run_shard(cmd, scene, povs, pov_outputs, pcb3d_file)
+            return
+        logger.debug(f'Rendering {len(povs)} points of view using {len(shards)} Blender instances')
+        if self.fixed_auto_camera:
+            # All the instances must compute the camera using the first point of view
+            scene['camera_point_of_view'] = povs[0]
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            jobs = [pool.submit(self.run_shard, cmd, scene, s_povs, s_outputs, pcb3d_file) for s_povs, s_outputs in shards]
+            # Wait for all of them, in order, so errors are reported in a deterministic way
+            for job in jobs:
+                job.result()
 
 
 @output_class
@@ -366,6 +366,10 @@ class BoMXLSX(BoMLinkable):
                 Note that an empty list means all available specs, use `specs` options to disable it """
             self.logo_scale = 2
             """ Scaling factor for the logo. Note that this value isn't honored by all spreadsheet software """
+            self.streaming = False
+            """ Write the BoM and DNF sheets row by row, using a constant amount of memory. Recommended for
+                very big BoMs. The strings are stored in each cell (no shared strings table).
+                Not used when `kicost` is enabled, KiCost needs to write the cells in random order """
 
     def process_columns_config(self, cols):
         columns = []
@@ -21,6 +21,7 @@ Dependencies:
 """
 from hashlib import sha1
 from itertools import combinations
+import json
 import os
 import re
 from shutil import rmtree, copy2
@@ -31,12 +32,13 @@ from .kiplot import load_any_sch, run_command, config_output, get_output_dir, ru
 from .layer import Layer
 from .misc import DIFF_TOO_BIG, FAILED_EXECUTE
 from .registrable import RegOutput
-from .out_any_diff import AnyDiffOptions, has_repo
+from .out_any_diff import AnyDiffOptions, GitObjectReader, has_repo
 from .macros import macros, document, output_class  # noqa: F401
 from . import log
 
 logger = log.get_logger()
 STASH_MSG = 'KiBot_Changes_Entry'
+SHEET_FILE = re.compile(r'\(property\s+"Sheet ?file"\s+"((?:[^"\\]|\\.)*)"')
 
 
 class DiffOptions(AnyDiffOptions):
@@ -71,7 +73,8 @@ class DiffOptions(AnyDiffOptions):
                 This is an extension of the `output` mode.
                 If `old` is also `multivar` then it becomes the reference, otherwise we compare using pairs of variants """
             self.cache_dir = ''
-            """ Directory to cache the intermediate files. Leave it blank to disable the cache """
+            """ Directory to cache the intermediate files. Leave it blank to use the cache of rendered
+                revisions (see `cache_renders`), or a temporal directory if it is disabled """
             self.diff_mode = 'red_green'
             """ [red_green,stats,2color] In the `red_green` mode added stuff is green and red when removed.
                 The `stats` mode is used to measure the amount of difference. In this mode all
@@ -157,8 +160,7 @@ class DiffOptions(AnyDiffOptions):
             name, to_remove = self.write_empty_file(name, create_tmp=True)
             self._to_remove.extend(to_remove)
         hash = self.get_digest(name)
-        self.add_to_cache(name, hash)
-        return hash
+        return self.add_to_cache(name, hash)
 
     def cache_sch(self, name, force_exist):
         if name:
@@ -180,8 +182,7 @@ class DiffOptions(AnyDiffOptions):
             for f in files[1:]:
                 hash = self.get_digest(f, restart=False)
         hash = 'sch'+hash
-        self.add_to_cache(name, hash)
-        return hash
+        return self.add_to_cache(name, hash)
 
     def cache_file(self, name=None, force_exist=False):
         self.git_hash = 'Current' if not name else 'FILE'
@@ -353,6 +354,99 @@ class DiffOptions(AnyDiffOptions):
             self.undo_git_use_stash()
         return hash
 
+    def get_git_rev_desc(self, user_name, rev):
+        """ Like get_git_point_desc, but for a revision we didn't check out """
+        name = None
+        try:
+            name = self.run_git(['describe', '--tags', rev], just_raise=True)
+        except CalledProcessError:
+            logger.debug("Can't find a tag name")
+        return '{}({})'.format(self.run_git(['rev-parse', '--short', rev]), name or user_name)
+
+    def extract_git_file(self, rev, path, dest_dir):
+        data = self.git_reader.read(rev, path)
+        if data is None:
+            return None
+        dest = os.path.join(dest_dir, path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, 'wb') as f:
+            f.write(data)
+        return data
+
+    def materialize_wks(self, rev, pro, base_dir, ext, tmp_dir):
+        """ Extract the drawing sheet referenced by the project.
+            Returns False when we need a real checkout """
+        try:
+            data = json.loads(pro.decode(errors='replace'))
+        except ValueError:
+            logger.debug('- Malformed project, using a worktree')
+            return False
+        section = data.get('pcbnew' if ext == '.kicad_pcb' else 'schematic')
+        wks = section.get('page_layout_descr_file') if isinstance(section, dict) else None
+        if not wks:
+            return True
+        wks = wks.replace('${KIPRJMOD}/', '')
+        if os.path.isabs(wks) or '${' in wks:
+            # Not part of the project, the same file for both
+            return True
+        wks = os.path.normpath(os.path.join(base_dir, wks))
+        if wks.startswith('..'):
+            logger.debug('- Drawing sheet outside the repo '+wks+', using a worktree')
+            return False
+        if self.extract_git_file(rev, wks, tmp_dir) is None:
+            logger.debug('- Missing drawing sheet '+wks+', using a worktree')
+            return False
+        return True
+
+    def materialize_git(self, rev):
+        """ Extract the PCB/SCH (its sub-sheets and drawing sheet) from the git objects to a temporal dir.
+            Returns None when we need a real checkout """
+        ext = os.path.splitext(self.file)[1]
+        if ext not in ('.kicad_pcb', '.kicad_sch'):
+            # KiCad 5 schematics needs the libs
+            return None
+        if not self.run_git(['ls-files', self.file]):
+            # Not in this repo, i.e. inside a submodule
+            return None
+        if self.git_reader is None:
+            self.git_reader = GitObjectReader(self.git_command, self.repo_dir)
+        rel = os.path.relpath(os.path.realpath(self.file), os.path.realpath(self.git_reader.top))
+        if rel.startswith('..'):
+            return None
+        tmp_dir = GS.mkdtemp('diff-blobs')
+        self.dirs_to_remove.append(tmp_dir)
+        logger.debug('Extracting '+rel+' from '+rev+' to '+tmp_dir)
+        # Project and lib-tables, if available
+        base_dir = os.path.dirname(rel)
+        pro = self.extract_git_file(rev, os.path.splitext(rel)[0]+'.kicad_pro', tmp_dir)
+        for f in (os.path.join(base_dir, 'sym-lib-table'), os.path.join(base_dir, 'fp-lib-table')):
+            self.extract_git_file(rev, f, tmp_dir)
+        # The drawing sheet used by the project
+        if pro is not None and not self.materialize_wks(rev, pro, base_dir, ext, tmp_dir):
+            return None
+        pending = [rel]
+        done = set()
+        while pending:
+            f = pending.pop()
+            if f in done:
+                continue
+            done.add(f)
+            data = self.extract_git_file(rev, f, tmp_dir)
+            if data is None:
+                if f == rel:
+                    # Not in this revision, cache_file will use an empty file
+                    break
+                logger.debug('- Missing sub-sheet '+f+', using a worktree')
+                return None
+            if ext == '.kicad_sch':
+                for m in SHEET_FILE.finditer(data.decode(errors='replace')):
+                    sub = os.path.normpath(os.path.join(os.path.dirname(f), re.sub(r'\\(.)', r'\1', m.group(1))))
+                    if os.path.isabs(sub) or sub.startswith('..'):
+                        logger.debug('- Sub-sheet outside the repo '+sub+', using a worktree')
+                        return None
+                    pending.append(sub)
+        return os.path.join(tmp_dir, rel)
+
     def cache_git(self, name):
         self.stashed = False
         self.checkedout = False
@@ -366,9 +460,14 @@ class DiffOptions(AnyDiffOptions):
         # Place where we know we have a repo
         self.repo_dir = os.path.dirname(os.path.abspath(self.file))
         if name:
-            # Checkout the target
             name_ori = name
             name = self.solve_git_name(name)
+            name_copy = self.materialize_git(name) if GS.global_git_diff_strategy == 'blob' else None
+            if name_copy is not None:
+                hash = self.cache_file(name_copy, force_exist=True)
+                self.git_hash = self.get_git_rev_desc(name_ori, name)
+                return hash
+            # Checkout the target
             git_tmp_wd = GS.mkdtemp('diff-checkout')
             logger.debug('Checking out '+name+' to '+git_tmp_wd)
             self.run_git(['worktree', 'add', '--detach', '--force', git_tmp_wd, name])
@@ -439,7 +538,7 @@ class DiffOptions(AnyDiffOptions):
 
     def cache_obj(self, name, type):
         if type == 'git':
-            return self.cache_git(name) if GS.global_git_diff_strategy == 'worktree' else self.cache_git_use_stash(name)
+            return self.cache_git_use_stash(name) if GS.global_git_diff_strategy == 'stash' else self.cache_git(name)
         if type == 'file':
             return self.cache_file(name)
         if type == 'current':
@@ -496,9 +595,10 @@ class DiffOptions(AnyDiffOptions):
                 os.symlink(os.path.basename(name), target)
 
     def run(self, name):
-        self.command = self.ensure_tool('KiDiff')
+        self.command, self._kidiff_version = self.ensure_tool_get_ver('KiDiff')
         self._to_remove = []
         self._worktrees_to_remove = []
+        self.git_reader = None
         if self.old_type == 'git' or self.new_type == 'git':
             self.git_command = self.ensure_tool('Git')
         if not self.pcb:
@@ -506,9 +606,13 @@ class DiffOptions(AnyDiffOptions):
             self.ensure_tool('KiAuto')
         # Solve the cache dir
         self.dirs_to_remove = []
+        self._store = None
         if not self.cache_dir:
-            self.cache_dir = GS.mkdtemp('diff-cache')
-            self.dirs_to_remove.append(self.cache_dir)
+            if self.init_store():
+                self.cache_dir = self._store.path
+            else:
+                self.cache_dir = GS.mkdtemp('diff-cache')
+                self.dirs_to_remove.append(self.cache_dir)
         self.incl_file = None
         name_ori = name
         try:
@@ -547,6 +651,9 @@ class DiffOptions(AnyDiffOptions):
             # Remove any git worktree that we created
             for w in self._worktrees_to_remove:
                 self.remove_git_worktree(w)
+            if self.git_reader is not None:
+                self.git_reader.close()
+            self.close_store()
 
 
 @output_class
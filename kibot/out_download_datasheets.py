@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
-# Copyright (c) 2021 Salvador E. Tropea
-# Copyright (c) 2021 Instituto Nacional de Tecnología Industrial
+# Copyright (c) 2021-2024 Salvador E. Tropea
+# Copyright (c) 2021-2024 Instituto Nacional de Tecnología Industrial
 # License: GPL-3.0
 # Project: KiBot (formerly KiPlot)
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from shutil import copy2
+from threading import BoundedSemaphore, Lock, local
+from time import perf_counter
+from urllib.parse import urlparse
 from .optionable import Optionable
 from .out_base import VariantOptions
 from .fil_base import DummyFilter
@@ -20,6 +27,9 @@ SUBDIRS = {'C': 'Capacitors', 'R': 'Resistors', 'L': 'Inductors', 'U': 'Integrat
            'M': 'Motors', 'K': 'Relays', 'HS': 'Heat_Sinks', 'F': 'Fuses', 'AE': 'Antennas'}
 
 
+META_FILE = 'datasheets.json'
+
+
 def is_url(ds):
     return ds.startswith('http://') or ds.startswith('https://')
 
@@ -45,12 +55,33 @@ class Download_Datasheets_Options(VariantOptions):
             """ Include the DNF components """
             self.repeated = False
             """ Download URLs that we already downloaded.
-                It only makes sense if the `output` field makes their output different """
+                It only makes sense if the `output` field makes their output different.
+                The URL is fetched only once, the rest of the files are copies or links (see `link_repeated`) """
             self.link_repeated = True
             """ Instead of download things we already downloaded use symlinks """
+            self.workers = 4
+            """ [1,32] Number of simultaneous downloads """
+            self.workers_per_host = 2
+            """ [1,32] Maximum number of simultaneous connections to the same server """
+            self.revalidate = True
+            """ Ask the server if the datasheets we already have changed.
+                We use the ETag/Last-Modified information collected when they were downloaded, so the file is
+                transferred only if it changed. Files without this information are kept """
+            self.timeout = 20
+            """ [1,600] Time-out for each download, in seconds """
         # Used to collect the targets
         self._dry = False
         self._unknown_is_error = True
+        # Download machinery. Also used when calling `download` without `run`
+        self._pool = None
+        self._jobs = []
+        self._links = []
+        self._meta = {}
+        self._meta_changed = False
+        self._hosts = {}
+        self._lock = Lock()
+        self._sessions = local()
+        self._all_sessions = []
 
     def config(self, parent):
         super().config(parent)
@@ -64,6 +95,96 @@ class Download_Datasheets_Options(VariantOptions):
         logger.warning(W_FAILDL+'{} during download of `{}` [{}]'.format(msg, ds, c.ref))
         return None
 
+    def get_session(self):
+        """ One session for each thread, so we can keep the connections alive """
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=self.workers_per_host)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._sessions.session = session
+            with self._lock:
+                self._all_sessions.append(session)
+        return session
+
+    def get_host_limit(self, ds):
+        """ Semaphore used to limit the connections to the server of this URL """
+        host = urlparse(ds).netloc
+        with self._lock:
+            sem = self._hosts.get(host)
+            if sem is None:
+                sem = self._hosts[host] = BoundedSemaphore(self.workers_per_host)
+        return sem
+
+    def load_meta(self):
+        self._meta_file = os.path.join(GS.get_cache_dir('datasheets'), META_FILE)
+        self._meta = {}
+        self._meta_changed = False
+        if os.path.isfile(self._meta_file):
+            try:
+                with open(self._meta_file, 'rt') as f:
+                    self._meta = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.debug('Discarding datasheets metadata `{}` ({})'.format(self._meta_file, e))
+
+    def save_meta(self):
+        if not self._meta_changed:
+            return
+        tmp_name = self._meta_file+'.tmp'
+        with open(tmp_name, 'wt') as f:
+            json.dump(self._meta, f, indent=2)
+        os.replace(tmp_name, self._meta_file)
+
+    def validators(self, ds, dest):
+        """ Headers for a conditional request, only if we know the file in `dest` is the one we got from `ds` """
+        meta = self._meta.get(ds)
+        if not self.revalidate or meta is None or meta.get('file') != os.path.abspath(dest) or \
+           meta.get('size') != os.path.getsize(dest):
+            return None
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers or None
+
+    def fetch(self, c, ds, dest, validators):
+        """ Download `ds` to `dest`. Runs in the workers, returns True on success """
+        headers = {'User-Agent': USER_AGENT}
+        if validators:
+            headers.update(validators)
+        start = perf_counter()
+        with self.get_host_limit(ds):
+            try:
+                r = self.get_session().get(ds, allow_redirects=True, headers=headers, timeout=self.timeout)
+            except requests.exceptions.ReadTimeout:
+                return self.do_warning('Timeout', ds, c)
+            except requests.exceptions.SSLError:
+                return self.do_warning('SSL Error', ds, c)
+            except requests.exceptions.TooManyRedirects:
+                return self.do_warning('More than 30 redirections', ds, c)
+            except requests.exceptions.ConnectionError:
+                return self.do_warning('Connection', ds, c)
+            except requests.exceptions.RequestException as e:
+                return self.do_warning(str(e), ds, c)
+        elapsed = perf_counter()-start
+        if r.status_code == 304 and validators:
+            logger.debug('- {:.3f} s `{}` not modified'.format(elapsed, ds))
+            return True
+        if r.status_code != 200:
+            return self.do_warning('Failed with status '+str(r.status_code), ds, c)
+        tmp_name = dest+'.part'
+        with open(tmp_name, 'wb') as f:
+            f.write(r.content)
+        os.replace(tmp_name, dest)
+        with self._lock:
+            self._meta[ds] = {'file': os.path.abspath(dest), 'size': len(r.content), 'etag': r.headers.get('ETag'),
+                              'last_modified': r.headers.get('Last-Modified')}
+            self._meta_changed = True
+        logger.debug('- {:.3f} s `{}` ({} bytes)'.format(elapsed, ds, len(r.content)))
+        return True
+
     def download(self, c, ds, dir, name, known):
         if self.classify:
             subdir = self.classify_extra.get(c.ref_prefix, SUBDIRS.get(c.ref_prefix, 'Miscellaneous'))
@@ -74,36 +195,53 @@ class Download_Datasheets_Options(VariantOptions):
         if name in self._downloaded:
             logger.warning(W_ALRDOWN+'Datasheet `{}` already downloaded'.format(name))
             return None
-        elif known is not None and self.link_repeated:
-            # We already downloaded this URL, but stored it with a different name
+        elif known is not None:
+            # We already downloaded this URL, but stored it with a different name.
+            # Link or copy it once the download is finished
             if not self._dry:
-                os.symlink(known, dest)
+                self._links.append((known, os.path.join(dir, known), dest, c))
             self._created.append(os.path.relpath(dest))
-        elif not os.path.isfile(dest):
+        elif not os.path.isfile(dest) or (not self._dry and self.validators(ds, dest)):
             # Download
             if not self._dry:
-                try:
-                    r = requests.get(ds, allow_redirects=True, headers={'User-Agent': USER_AGENT}, timeout=20)
-                except requests.exceptions.ReadTimeout:
-                    return self.do_warning('Timeout', ds, c)
-                except requests.exceptions.SSLError:
-                    return self.do_warning('SSL Error', ds, c)
-                except requests.exceptions.TooManyRedirects:
-                    return self.do_warning('More than 30 redirections', ds, c)
-                except requests.exceptions.ConnectionError:
-                    return self.do_warning('Connection', ds, c)
-                except requests.exceptions.RequestException as e:
-                    return self.do_warning(str(e), ds, c)
-                if r.status_code != 200:
-                    return self.do_warning('Failed with status '+str(r.status_code), ds, c)
-                with open(dest, 'wb') as f:
-                    f.write(r.content)
+                validators = self.validators(ds, dest) if os.path.isfile(dest) else None
+                if self._pool is None:
+                    if not self.fetch(c, ds, dest, validators):
+                        return None
+                else:
+                    self._jobs.append((name, dest, self._pool.submit(self.fetch, c, ds, dest, validators)))
+                    self._downloaded.add(name)
+                    return name
             self._downloaded.add(name)
             self._created.append(os.path.relpath(dest))
         elif self._dry:
             self._created.append(os.path.relpath(dest))
         return name
 
+    def finish_downloads(self):
+        """ Wait for the workers, then solve the repeated URLs """
+        for name, dest, job in self._jobs:
+            if job.result():
+                self._created.append(os.path.relpath(dest))
+            else:
+                self._downloaded.discard(name)
+        for known, src, dest, c in self._links:
+            if os.path.lexists(dest):
+                continue
+            if not os.path.isfile(src):
+                logger.debug('Not creating `{}`, `{}` failed'.format(dest, src))
+                continue
+            if self.link_repeated:
+                os.symlink(known, dest)
+            else:
+                copy2(src, dest)
+        for session in self._all_sessions:
+            session.close()
+        self._all_sessions = []
+        self._sessions = local()
+        self._jobs = []
+        self._links = []
+
     def out_name(self, c):
         """ Compute the name of the output file.
             Replaces `${FIELD}` and %X. """
@@ -136,21 +274,35 @@ class Download_Datasheets_Options(VariantOptions):
         self._downloaded = set()
         self._created = []
         field_used = False
-        for c in self._comps:
-            ds = c.get_field_value(self.field)
-            if ds is not None:
-                field_used = True
-            if not c.included or (not c.fitted and not self.dnf):
-                continue
-            if ds and is_url(ds):
-                known = self._urls.get(ds, None)
-                if known is None or self.repeated:
-                    name = self.out_name(c)  # Here to simplify the tests
-                    name = self.download(c, ds, output_dir, name, known)
-                    if known is None:
-                        self._urls[ds] = name
-                else:
-                    logger.debug('Already downloaded: '+ds)
+        if not self._dry:
+            self.load_meta()
+            if self.workers > 1:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        start = perf_counter()
+        try:
+            for c in self._comps:
+                ds = c.get_field_value(self.field)
+                if ds is not None:
+                    field_used = True
+                if not c.included or (not c.fitted and not self.dnf):
+                    continue
+                if ds and is_url(ds):
+                    known = self._urls.get(ds, None)
+                    if known is None or self.repeated:
+                        name = self.out_name(c)  # Here to simplify the tests
+                        name = self.download(c, ds, output_dir, name, known)
+                        if known is None:
+                            self._urls[ds] = name
+                    else:
+                        logger.debug('Already downloaded: '+ds)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+        if not self._dry:
+            self.finish_downloads()
+            self.save_meta()
+            logger.debug('Download time: {:.3f} s'.format(perf_counter()-start))
         if not field_used:
             known_fields = GS.sch.get_field_names({})
             if self.field not in known_fields:
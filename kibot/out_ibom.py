@@ -25,6 +25,7 @@ from shutil import which, rmtree
 from .misc import BOM_ERROR, W_EXTNAME, W_NONETLIST
 from .gs import GS
 from .out_base import VariantOptions
+from .netlist_cache import get_netlist
 from .macros import macros, document, output_class  # noqa: F401
 from . import log
 
@@ -180,15 +181,11 @@ class IBoMOptions(VariantOptions):
         net_dir = None
         pcb_name = GS.pcb_file
         if self.will_filter_pcb_components():
-            # Write a custom netlist to a temporal dir
+            # Get a custom netlist, shared with other outputs using the same components
             prj_name = os.path.basename(self.expand_filename('', self.forced_name, 'ibom', '')) if self.forced_name \
                        else GS.pcb_basename
             net_dir = GS.mkdtemp('ibom')
-            netlist = os.path.join(net_dir, prj_name+'.xml')
-            self.extra_data_file = netlist
-            logger.debug('Creating variant netlist `{}`'.format(netlist))
-            with open(netlist, 'wb') as f:
-                GS.sch.save_netlist(f, self._comps)
+            self.extra_data_file = get_netlist(self._comps, prj_name)
             # Write a board with the filtered values applied
             self.filter_pcb_components()
             pcb_name, _ = self.save_tmp_dir_board('ibom', force_dir=net_dir, forced_name=prj_name)
@@ -11,7 +11,6 @@ Dependencies:
 """
 import os
 from os.path import isfile, abspath, join, dirname
-from shutil import rmtree
 from .misc import (BOM_ERROR, DISTRIBUTORS, W_UNKDIST, ISO_CURRENCIES, W_UNKCUR, KICOST_SUBMODULE,
                    W_KICOSTFLD, W_MIXVARIANT)
 from .error import KiPlotConfigurationError
@@ -21,6 +20,7 @@ from .out_base import VariantOptions
 from .macros import macros, document, output_class  # noqa: F401
 from .fil_base import FieldRename
 from .kiplot import run_command
+from .netlist_cache import get_netlist
 from . import log
 
 logger = log.get_logger()
@@ -147,7 +147,6 @@ class KiCostOptions(VariantOptions):
 
     def run(self, name):
         super().run(name)
-        net_dir = None
         if self._comps:
             var_fields = {'variant', 'version'}
             if self.variant and self.variant.type == 'kicost' and self.variant.variant_field not in var_fields:
@@ -156,12 +155,8 @@ class KiCostOptions(VariantOptions):
                                format(self.variant, self.variant.variant_field))
             if self.kicost_variant:
                 logger.warning(W_MIXVARIANT+'Avoid using KiCost variants and internal variants on the same output')
-            # Write a custom netlist to a temporal dir
-            net_dir = GS.mkdtemp('kicost')
-            netlist = os.path.join(net_dir, GS.sch_basename+'.xml')
-            logger.debug('Creating variant netlist `{}`'.format(netlist))
-            with open(netlist, 'wb') as f:
-                GS.sch.save_netlist(f, self._comps, no_field=var_fields)
+            # Get a custom netlist, shared with other outputs using the same components
+            netlist = get_netlist(self._comps, GS.sch_basename, no_field=var_fields)
         else:
             # Make sure the XML is there.
             # Currently we only support the XML mechanism.
@@ -220,12 +215,7 @@ class KiCostOptions(VariantOptions):
                 raise KiPlotConfigurationError(f"Missing config file: `{cfg_name}`")
             cmd.extend(['--config', ])
         # Run the command
-        try:
-            run_command(cmd, err_msg='Failed to create costs spreadsheet, error {ret}', err_lvl=BOM_ERROR)
-        finally:
-            if net_dir:
-                logger.debug('Removing temporal variant dir `{}`'.format(net_dir))
-                rmtree(net_dir)
+        run_command(cmd, err_msg='Failed to create costs spreadsheet, error {ret}', err_lvl=BOM_ERROR)
 
 
 @output_class
@@ -27,7 +27,7 @@ try:
 except Exception:
     pass
 import os
-from shutil import copy2, rmtree
+from shutil import copy2, copytree, rmtree
 from .error import KiPlotConfigurationError
 from .gs import GS
 from .kicad.color_theme import load_color_theme
@@ -74,6 +74,7 @@ class KiRiOptions(AnyDiffOptions):
         super().__init__()
         self.add_to_doc("zones", "Be careful with the *keep_generated* option when changing this setting")
         self._kiri_mode = True
+        self._store_name = 'kiri'
 
     def config(self, parent):
         super().config(parent)
@@ -115,7 +116,8 @@ class KiRiOptions(AnyDiffOptions):
         if not os.path.isfile(name_copy):
             self.write_empty_file(name_copy)
         logger.debug('- Using temporal copy: '+name_copy)
-        self.add_to_cache(name_copy, hash[:7])
+        self.name_used_for_cache = name_copy
+        self.render(name_copy, hash[:7], self.cache_dir)
         return name_copy
 
     def save_pcb_layers(self, hash):
@@ -245,7 +247,7 @@ class KiRiOptions(AnyDiffOptions):
 
     def init_tools(self, out_dir):
         self.cache_dir = out_dir
-        self.command = self.ensure_tool('KiDiff')
+        self.command, self._kidiff_version = self.ensure_tool_get_ver('KiDiff')
         self.git_command = self.ensure_tool('Git')
         # Only needed for schematic
         self.ensure_tool('KiAuto')
@@ -282,6 +284,7 @@ class KiRiOptions(AnyDiffOptions):
         self.get_modified_status(GS.pcb_file, sch_files)
         self.create_layers_incl(self.layers)
         self.solve_layer_colors()
+        store = self.init_store()
         try:
             git_tmp_wd = None
             try:
@@ -294,6 +297,11 @@ class KiRiOptions(AnyDiffOptions):
                         continue
                     if already_generated:
                         rmtree(dst_dir)
+                    # A commit is immutable, so its hash and the names of the files are enough
+                    key = self.render_key([hash, self.sch_rel_name, self.pcb_rel_name])
+                    if store is not None and store.has(key):
+                        copytree(store.entry(key), dst_dir)
+                        continue
                     git_tmp_wd = GS.mkdtemp('kiri-checkout')
                     logger.debug('Checking out '+hash+' to '+git_tmp_wd)
                     self.run_git(['worktree', 'add', '--detach', '--force', git_tmp_wd, hash])
@@ -308,6 +316,9 @@ class KiRiOptions(AnyDiffOptions):
                     self.save_sch_sheet(hash, name_sch)
                     self.remove_git_worktree(git_tmp_wd)
                     git_tmp_wd = None
+                    if store is not None:
+                        with store.lock(key):
+                            store.publish(dst_dir, key, copy=True)
             finally:
                 if git_tmp_wd:
                     self.remove_git_worktree(git_tmp_wd)
@@ -334,6 +345,7 @@ class KiRiOptions(AnyDiffOptions):
         finally:
             if self.incl_file:
                 os.remove(self.incl_file)
+            self.close_store()
         self.create_kiri_files()
         self.save_commits(hashes)
         self.save_project_data()
@@ -21,6 +21,9 @@ Dependencies:
     role: Find origin url
 """
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+import json
 import os
 import subprocess
 import pprint
@@ -115,6 +118,8 @@ IMAGEABLES_SIMPLE = {'png', 'jpg'}
 IMAGEABLES_GS = {'pdf', 'eps', 'ps'}
 IMAGEABLES_SVG = {'svg'}
 TITLE_HEIGHT = 30
+# Used to know if the thumbnails we created in previous runs are still valid
+THUMBS_INDEX = '.thumbnails.json'
 STYLE = """
 .cat-table { margin-left: auto; margin-right: auto; }
 .cat-table td { padding: 20px 24px; }
@@ -254,6 +259,14 @@ def _run_command(cmd):
     return True
 
 
+def hash_file(file):
+    h = sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def get_png_size(file):
     with open(file, 'rb') as f:
         s = f.read()
@@ -288,6 +301,11 @@ class Navigate_ResultsOptions(BaseOptions):
             """ Add a side navigation bar to quickly access to the outputs """
             self.header = True
             """ Add a header containing information for the project """
+            self.cache_thumbnails = True
+            """ Reuse the images created by previous runs when the source file didn't change.
+                This is checked using the hash of the file """
+            self.workers = 0
+            """ [0,256] Number of images to create in parallel. 0 means to use the global `workers` value """
         super().__init__()
         self._expand_id = 'navigate'
         self._expand_ext = 'html'
@@ -331,6 +349,45 @@ class Navigate_ResultsOptions(BaseOptions):
         cmd = [self.rsvg_command, '-w', str(width), '-f', 'png', '-o', png_file, svg_file]
         return _run_command(cmd)
 
+    def load_thumbs_index(self):
+        """ Load the information about the images created by a previous run """
+        self._thumbs_old = {}
+        self._thumbs_new = {}
+        fname = os.path.join(self.img_dst_dir, THUMBS_INDEX)
+        if self.cache_thumbnails and os.path.isfile(fname):
+            try:
+                with open(fname, 'rt') as f:
+                    self._thumbs_old = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.debug('Discarding the images index `{}` ({})'.format(fname, e))
+
+    def save_thumbs_index(self):
+        with open(os.path.join(self.img_dst_dir, THUMBS_INDEX), 'wt') as f:
+            json.dump(self._thumbs_new, f, indent=2)
+
+    def cached_image(self, dst, src, *extra):
+        """ Computes the key for an image created from `src`.
+            Also returns if `dst` is an image we created from the same source in a previous run """
+        key = '-'.join([hash_file(src), str(os.path.getsize(src))]+[str(e) for e in extra])
+        return key, os.path.isfile(dst) and self._thumbs_old.get(os.path.relpath(dst, self.out_dir)) == key
+
+    def remember_image(self, dst, key):
+        self._thumbs_new[os.path.relpath(dst, self.out_dir)] = key
+
+    def warning(self, msg):
+        """ Warnings are reported only once, not during the first pass """
+        if not self._collecting:
+            logger.warning(msg)
+
+    def icon_to_png(self, src, dst, width):
+        key, cached = self.cached_image(dst, src, width)
+        if cached:
+            logger.debug('- Using cached '+os.path.relpath(dst))
+        elif not self.svg_to_png(src, dst, width):
+            return False
+        self.remember_image(dst, key)
+        return True
+
     def copy(self, img, width):
         """ Copy an SVG icon to the images/ dir.
             Tries to convert it to PNG. """
@@ -341,7 +398,7 @@ class Navigate_ResultsOptions(BaseOptions):
         src = os.path.join(self.img_src_dir, img+'.svg') if not img.endswith('.svg') else img
         dst = os.path.join(self.out_dir, 'images', img_w)
         id = img_w
-        if self.rsvg_command is not None and self.svg_to_png(src, dst+'.png', width):
+        if self.rsvg_command is not None and self.icon_to_png(src, dst+'.png', width):
             img_w += '.png'
         else:
             copy2(src, dst+'.svg')
@@ -352,16 +409,26 @@ class Navigate_ResultsOptions(BaseOptions):
 
     def can_be_converted(self, ext):
         if ext in IMAGEABLES_SVG and self.rsvg_command is None:
-            logger.warning(W_MISSTOOL+"Missing SVG to PNG converter")
+            self.warning(W_MISSTOOL+"Missing SVG to PNG converter")
             return False
         if ext in IMAGEABLES_GS and not self.ps2img_avail:
-            logger.warning(W_MISSTOOL+"Missing PS/PDF to PNG converter")
+            self.warning(W_MISSTOOL+"Missing PS/PDF to PNG converter")
             return False
         if ext in IMAGEABLES_SIMPLE and self.convert_command is None:
-            logger.warning(W_MISSTOOL+"Missing ImageMagick converter")
+            self.warning(W_MISSTOOL+"Missing ImageMagick converter")
             return False
         return ext in IMAGEABLES_SVG or ext in IMAGEABLES_GS or ext in IMAGEABLES_SIMPLE
 
+    def get_targets_for(self, out, out_dir, navigate=False):
+        """ Cached version of get_targets/get_navigate_targets, we need them in both passes """
+        key = (out.name, navigate)
+        res = self._targets.get(key)
+        if res is None:
+            res = out.get_navigate_targets(out_dir) if navigate else (out.get_targets(out_dir), None)
+            self._targets[key] = res
+        targets, icons = res
+        return list(targets), list(icons) if icons is not None else None
+
     def get_image_for_cat(self, cat):
         img = None
         # Check if we have an output that can represent this category
@@ -373,7 +440,7 @@ class Navigate_ResultsOptions(BaseOptions):
                 # Is this one that can be used to represent it?
                 if o.type in outs_rep:
                     out_dir = get_output_dir(o.dir, o, dry=True)
-                    targets = o.get_targets(out_dir)
+                    targets, _ = self.get_targets_for(o, out_dir)
                     # Look the output targets
                     for tg in targets:
                         ext = os.path.splitext(tg)[1][1:].lower()
@@ -393,17 +460,8 @@ class Navigate_ResultsOptions(BaseOptions):
                    format(cat_img, cat))
         return cat
 
-    def compose_image(self, file, ext, img, out_name, no_icon=False):
-        if not os.path.isfile(file):
-            logger.warning(W_NOTYET+"{} not yet generated, using an icon".format(os.path.relpath(file)))
-            return False, None, None
-        if self.convert_command is None:
-            return False, None, None
-        # Create a unique name using the output name and the generated file name
-        bfname = os.path.splitext(os.path.basename(file))[0]
-        fname = os.path.join(self.out_dir, 'images', out_name+'_'+bfname+'.png')
-        # Full path for the icon image
-        icon = os.path.join(self.out_dir, img)
+    def create_thumbnail(self, file, ext, icon, fname, no_icon):
+        """ Creates the image for `file`, runs in parallel with other images """
         if ext == 'pdf':
             # Only page 1
             file += '[0]'
@@ -411,7 +469,7 @@ class Navigate_ResultsOptions(BaseOptions):
             tmp_name = GS.tmp_file(suffix='.png')
             logger.debug('Temporal convert: {} -> {}'.format(file, tmp_name))
             if not self.svg_to_png(file, tmp_name, BIG_ICON):
-                return False, None, None
+                return False
             file = tmp_name
         cmd = [self.convert_command, file,
                # Size for the big icons (width)
@@ -431,7 +489,53 @@ class Navigate_ResultsOptions(BaseOptions):
         if ext == 'svg':
             logger.debug('Removing temporal {}'.format(tmp_name))
             os.remove(tmp_name)
-        return res, fname, os.path.relpath(fname, start=self.out_dir)
+        return res
+
+    def create_pending_thumbnails(self):
+        """ Create the images collected during the first pass """
+        jobs = self._thumb_jobs
+        if not jobs:
+            return
+        workers = min(GS.get_workers(self.workers), len(jobs))
+        logger.debug('Creating {} images using {} workers'.format(len(jobs), workers))
+        if workers > 1:
+            # The real work is done by child processes (ImageMagick, rsvg, etc.), so threads are enough
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(lambda job: self.create_thumbnail(*job[2]), jobs))
+        else:
+            results = [self.create_thumbnail(*job[2]) for job in jobs]
+        for (fname, key, _), res in zip(jobs, results):
+            self._thumbs[fname] = res
+            if res:
+                self.remember_image(fname, key)
+        self._thumb_jobs = []
+
+    def compose_image(self, file, ext, img, out_name, no_icon=False):
+        if not os.path.isfile(file):
+            self.warning(W_NOTYET+"{} not yet generated, using an icon".format(os.path.relpath(file)))
+            return False, None, None
+        if self.convert_command is None:
+            return False, None, None
+        # Create a unique name using the output name and the generated file name
+        bfname = os.path.splitext(os.path.basename(file))[0]
+        fname = os.path.join(self.out_dir, 'images', out_name+'_'+bfname+'.png')
+        if fname not in self._thumbs:
+            # Full path for the icon image
+            icon = os.path.join(self.out_dir, img)
+            # The icon is part of the image, so its content is part of the key
+            icon_hash = hash_file(icon) if not no_icon and os.path.isfile(icon) else ''
+            key, cached = self.cached_image(fname, file, BIG_ICON, img, no_icon, icon_hash)
+            if cached:
+                logger.debug('- Using cached '+os.path.relpath(fname))
+                self._thumbs[fname] = True
+                self.remember_image(fname, key)
+            else:
+                # Schedule its creation, we use the icon until the image is created
+                self._thumbs[fname] = None
+                self._thumb_jobs.append((fname, key, (file, ext, icon, fname, no_icon)))
+                if not self._collecting:
+                    self.create_pending_thumbnails()
+        return bool(self._thumbs[fname]), fname, os.path.relpath(fname, start=self.out_dir)
 
     def get_image_for_file(self, file, out_name, no_icon=False, image=None):
         ext = os.path.splitext(file)[1][1:].lower()
@@ -493,9 +597,13 @@ class Navigate_ResultsOptions(BaseOptions):
         f.write(self.top_menu)
         f.write('<div id="main">\n')
 
+    def page_name(self, name):
+        """ Name for the page file, the first pass discards the pages """
+        return os.devnull if self._collecting else os.path.join(self.out_dir, name)
+
     def generate_cat_page_for(self, name, node, prev, category):
         logger.debug('- Categories: '+str(node.keys()))
-        with open(os.path.join(self.out_dir, name), 'wt') as f:
+        with open(self.page_name(name), 'wt') as f:
             self.write_head(f, category)
             name, ext = os.path.splitext(name)
             # Limit to 5 categories by row
@@ -533,7 +641,7 @@ class Navigate_ResultsOptions(BaseOptions):
             f.write('<thead><tr><th colspan="{}">{}</th></tr></thead>\n'.format(OUT_COLS, oname))
             out_dir = get_output_dir(out.dir, out, dry=True)
             f.write('<tbody><tr>\n')
-            targets, icons = out.get_navigate_targets(out_dir)
+            targets, icons = self.get_targets_for(out, out_dir, navigate=True)
             c_targets = len(targets)
             # Make the icons a list with same len as targets
             if icons is None:
@@ -578,7 +686,7 @@ class Navigate_ResultsOptions(BaseOptions):
 
     def generate_end_page_for(self, name, node, prev, category):
         logger.debug('- Outputs: '+str(node.keys()))
-        with open(os.path.join(self.out_dir, name), 'wt') as f:
+        with open(self.page_name(name), 'wt') as f:
             self.write_head(f, category)
             name, ext = os.path.splitext(name)
             self.generate_outputs(f, node)
@@ -730,6 +838,11 @@ class Navigate_ResultsOptions(BaseOptions):
         self.img_dst_dir = os.path.join(self.out_dir, 'images')
         os.makedirs(self.img_dst_dir, exist_ok=True)
         self.copied_images = {}
+        self._collecting = False
+        self._thumbs = {}
+        self._thumb_jobs = []
+        self._targets = {}
+        self.load_thumbs_index()
         name = os.path.basename(name)
         # Create a tree with all the outputs
         o_tree = self.create_tree()
@@ -758,7 +871,14 @@ class Navigate_ResultsOptions(BaseOptions):
         self.solve_title()
         self.navbar = self.generate_navbar(o_tree, name) if self.nav_bar else ''
         self.top_menu = self.generate_top_menu() if self.nav_bar or self.header else ''
+        # First pass: collect the images we need, so we can create them in parallel
+        self._collecting = True
+        self.generate_page_for(o_tree, name)
+        self._collecting = False
+        self.create_pending_thumbnails()
+        # Second pass: create the pages
         self.generate_page_for(o_tree, name)
+        self.save_thumbs_index()
         # Link it?
         if self.link_from_root:
             redir_file = os.path.join(GS.out_dir, self.link_from_root)
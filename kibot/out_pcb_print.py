@@ -28,6 +28,7 @@ Dependencies:
 #     role: Create EPS format
 #     version: '2.40'
 #     id: rsvg2
+from collections import OrderedDict
 from copy import deepcopy
 import datetime
 import re
@@ -36,6 +37,7 @@ import importlib
 from pcbnew import B_Cu, B_Mask, F_Cu, F_Mask, FromMM, IsCopperLayer, LSET, PLOT_CONTROLLER, PLOT_FORMAT_SVG
 from shutil import rmtree, copy2
 import sys
+from time import perf_counter
 from .error import KiPlotConfigurationError
 from .gs import GS
 from .optionable import Optionable
@@ -59,6 +61,10 @@ from . import log
 logger = log.get_logger()
 POLY_FILL_STYLE = ("fill:{0}; fill-opacity:1.0; stroke:{0}; stroke-width:1; stroke-opacity:1; stroke-linecap:round; "
                    "stroke-linejoin:round;fill-rule:evenodd;")
+# KiCad 5 polygon segment
+ML_COORD = re.compile(r'M(\d+) (\d+) L(\d+) (\d+)')
+# Steps used to merge the layers, the time used by each one is reported
+SVG_STEPS = ('load', 'parse', 'fill_polygons', 'search_text', 'scale', 'save')
 DRAWING_LAYERS = ['Dwgs.User', 'Cmts.User', 'Eco1.User', 'Eco2.User']
 EXTRA_LAYERS = ['F.Fab', 'B.Fab', 'F.CrtYd', 'B.CrtYd']
 # The following modules will be downloaded after we solve the dependencies
@@ -121,6 +127,45 @@ def get_size(svg):
     return float(view_box[2]), float(view_box[3])
 
 
+class SolderMaskCache(object):
+    """ Solder masks rendered by PcbDraw, shared by all the pages and outputs in the run.
+        The entries are the PcbDraw SVGs already filtered (cut-off, mask and substrate), the color, mirror, scale and
+        paper size are applied to a copy. They are indexed by board file, variant, side and SVG precision.
+        The size is limited, the least recently used entries are discarded. """
+    MAX_ENTRIES = 16
+    MAX_BYTES = 64*1024*1024
+    _entries = OrderedDict()
+    _bytes = 0
+    hits = misses = evictions = 0
+
+    @staticmethod
+    def get(key):
+        entry = SolderMaskCache._entries.get(key)
+        if entry is None:
+            SolderMaskCache.misses += 1
+            return None
+        SolderMaskCache.hits += 1
+        SolderMaskCache._entries.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def put(key, svg):
+        """ Store the SVG (a string, empty if PcbDraw failed) """
+        entries = SolderMaskCache._entries
+        entries[key] = svg
+        SolderMaskCache._bytes += len(svg)
+        while len(entries) > 1 and (len(entries) > SolderMaskCache.MAX_ENTRIES or
+                                    SolderMaskCache._bytes > SolderMaskCache.MAX_BYTES):
+            SolderMaskCache._bytes -= len(entries.popitem(last=False)[1])
+            SolderMaskCache.evictions += 1
+
+    @staticmethod
+    def stats():
+        return ('{} hits, {} misses, {} evictions, {} entries ({} KiB)'.
+                format(SolderMaskCache.hits, SolderMaskCache.misses, SolderMaskCache.evictions,
+                       len(SolderMaskCache._entries), SolderMaskCache._bytes//1024))
+
+
 class LayerOptions(Layer):
     """ Data for a layer """
     def __init__(self):
@@ -537,7 +582,9 @@ class PCB_PrintOptions(VariantOptions):
         return vars
 
     def plot_frame_internal(self, pc, po, p, page, pages):
-        """ Here we plot the frame manually """
+        """ Here we plot the frame manually.
+            The elements that look the same for all the pages are plotted only once, to a separated file.
+            Returns the list of SVGs for the frame """
         self.clear_layer('Edge.Cuts')
         po.SetPlotFrameRef(False)
         po.SetScale(1.0)
@@ -548,20 +595,41 @@ class PCB_PrintOptions(VariantOptions):
         # Load the WKS
         error = None
         try:
-            ws = kicad_worksheet.Worksheet.load(self.layout)
+            ws = kicad_worksheet.Worksheet.load_cached(self.layout)
         except (kicad_worksheet.WksError, SchError) as e:
             error = str(e)
         if error:
             raise KiPlotConfigurationError('Error reading `{}` ({})'.format(self.layout, error))
         tb_vars = self.fill_kicad_vars(page, pages, p)
-        ws.draw(GS.board, self.cleared_layer, page, self.pcb.paper_w, self.pcb.paper_h, tb_vars)
-        pc.OpenPlotfile('frame', PLOT_FORMAT_SVG, p.sheet)
-        pc.PlotLayer()
-        pc.ClosePlot()
-        ws.undraw(GS.board)
+        if os.environ.get('KIBOT_NO_STATIC_FRAME'):
+            # Plot the whole frame for each page, used to check the static frame
+            files = []
+            static = None
+        else:
+            # The static part only changes for the first page (page1only/notonpage1 options)
+            static_key = page == 1
+            static_frame = self._static_frames.get(static_key)
+            if static_frame is None:
+                logger.debug('- Plotting the static part of the frame')
+                ws.draw(GS.board, self.cleared_layer, page, self.pcb.paper_w, self.pcb.paper_h, tb_vars, static=True)
+                pc.OpenPlotfile('static-frame', PLOT_FORMAT_SVG, p.sheet)
+                pc.PlotLayer()
+                pc.ClosePlot()
+                ws.undraw(GS.board)
+                static_frame = self._static_frames[static_key] = pc.GetPlotFileName()
+            files = [static_frame]
+            static = False
+        ws.draw(GS.board, self.cleared_layer, page, self.pcb.paper_w, self.pcb.paper_h, tb_vars, static=static)
+        if ws.pcb_items:
+            pc.OpenPlotfile('frame', PLOT_FORMAT_SVG, p.sheet)
+            pc.PlotLayer()
+            pc.ClosePlot()
+            ws.undraw(GS.board)
+            files.append(GS.pcb_basename+"-frame.svg")
         self.restore_layer()
         # We need to plot the images in a separated pass
         self.last_worksheet = ws
+        return files
 
     def plot_frame_gui(self, dir_name, layer='Edge.Cuts'):
         """ KiCad 5 crashes if we try to print the frame.
@@ -795,68 +863,60 @@ class PCB_PrintOptions(VariantOptions):
            not self.last_worksheet or not self.last_worksheet.has_images):
             return
         if monochrome:
-            convert_command = self.ensure_tool('ImageMagick')
             for img in self.last_worksheet.images:
+                if img.gray_data is not None:
+                    # Already converted for another page
+                    continue
+                convert_command = self.ensure_tool('ImageMagick')
                 fname = GS.tmp_file(content=img.data, suffix='.png', binary=True)
                 dest = fname.replace('.png', '_gray.png')
                 _run_command([convert_command, fname, '-set', 'colorspace', 'Gray', '-separate', '-average', dest])
                 with open(dest, 'rb') as f:
-                    img.data = f.read()
+                    img.gray_data = f.read()
                 os.remove(fname)
                 os.remove(dest)
-        self.last_worksheet.add_images_to_svg(svg, self.svg_precision)
+        self.last_worksheet.add_images_to_svg(svg, self.svg_precision, monochrome)
 
-    def fill_polygons(self, svg, color):
+    def fill_polygon(self, e, color):
         """ I don't know how to generate filled polygons on KiCad 5.
             So here we look for KiCad 5 unfilled polygons and transform them into filled polygons.
-            Note that all polygons in the frame are filled. """
-        logger.debug('- Filling KiCad 5 polygons')
-        cnt = 0
-        ml_coord = re.compile(r'M(\d+) (\d+) L(\d+) (\d+)')
-        # Scan the SVG
-        for e in svg.root:
-            if e.tag.endswith('}g'):
-                # This is a graphic
-                if len(e) < 2:
-                    # Polygons have at least 2 paths
-                    continue
-                # Check that all elements are paths and that they have the coordinates in 'd'
-                all_path = True
-                for c in e:
-                    if not c.tag.endswith('}path') or c.get('d') is None:
-                        all_path = False
-                        break
-                if all_path:
-                    # Ok, this is a KiCad 5 polygon
-                    # Create a list with all the points
-                    coords = 'M '
-                    all_coords = True
-                    first = True
-                    for c in e:
-                        coord = c.get('d')
-                        res = ml_coord.match(coord)
-                        if not res:
-                            # Discard it if we can't understand the coordinates
-                            all_coords = False
-                            break
-                        coords += res.group(1)+','+res.group(2)+'\n'
-                        if first:
-                            start = res.group(1)+','+res.group(2)
-                            first = False
-                    if all_coords:
-                        # Ok, we have all the points
-                        end = res.group(3)+','+res.group(4)
-                        if start == end:
-                            # Must be a closed polygon
-                            coords += end+'\nZ'
-                            # Make the first a single filled polygon
-                            e[0].set('style', POLY_FILL_STYLE.format(color))
-                            e[0].set('d', coords)
-                            # Remove the rest
-                            for c in e[1:]:
-                                e.remove(c)
-                            cnt = cnt+1
-        logger.debug('- Filled {} polygons'.format(cnt))
+            Note that all polygons in the frame are filled.
+            Returns True if `e` was a polygon """
+        # This is a graphic
+        if len(e) < 2:
+            # Polygons have at least 2 paths
+            return False
+        # Check that all elements are paths and that they have the coordinates in 'd'
+        for c in e:
+            if not c.tag.endswith('}path') or c.get('d') is None:
+                return False
+        # Ok, this is a KiCad 5 polygon
+        # Create a list with all the points
+        coords = 'M '
+        first = True
+        for c in e:
+            coord = c.get('d')
+            res = ML_COORD.match(coord)
+            if not res:
+                # Discard it if we can't understand the coordinates
+                return False
+            coords += res.group(1)+','+res.group(2)+'\n'
+            if first:
+                start = res.group(1)+','+res.group(2)
+                first = False
+        # Ok, we have all the points
+        end = res.group(3)+','+res.group(4)
+        if start != end:
+            # Must be a closed polygon
+            return False
+        coords += end+'\nZ'
+        # Make the first a single filled polygon
+        e[0].set('style', POLY_FILL_STYLE.format(color))
+        e[0].set('d', coords)
+        # Remove the rest
+        for c in e[1:]:
+            e.remove(c)
+        return True
 
     def process_background(self, svg_out, width, height):
         """ Applies the background options """
@@ -891,55 +951,74 @@ class PCB_PrintOptions(VariantOptions):
                 # Process all text inside
                 self.search_text_for_g(c, texts)
 
-    def search_text(self, svg, texts):
-        """ Transparent text is discarded by rsvg-convert """
-        logger.debug(' - Looking for text tags')
-        # Scan the SVG
+    def transform_layer(self, svg, fill_color, texts, scale, times):
+        """ Applies all the needed transforms to a layer in one pass over its elements.
+            - fill_color: fill the KiCad 5 polygons using this color (None to skip)
+            - texts: collect the transparent texts here, rsvg-convert discards them (None to skip)
+            - scale: scale factor for all the elements (1.0 to skip)
+            - times: time used by each transform """
+        polygons = 0
         for e in svg.root:
-            # Look for graphics
             if e.tag.endswith('}g'):
-                # Process all text inside
-                self.search_text_for_g(e, texts)
+                if fill_color is not None:
+                    start = perf_counter()
+                    polygons += self.fill_polygon(e, fill_color)
+                    times['fill_polygons'] += perf_counter()-start
+                if texts is not None:
+                    start = perf_counter()
+                    self.search_text_for_g(e, texts)
+                    times['search_text'] += perf_counter()-start
+            if scale != 1.0:
+                start = perf_counter()
+                svgutils.FigureElement(e).scale(scale)
+                times['scale'] += perf_counter()-start
+        if fill_color is not None:
+            logger.debug(' - Filled {} KiCad 5 polygons'.format(polygons))
 
     def merge_svg(self, input_folder, input_files, output_folder, output_file, p):
         """ Merge all layers into one page """
         first = True
-        texts = []
+        # Look for transparent text that we will copy to a suitable place
+        texts = [] if self.format == 'PDF' else None
+        times = dict.fromkeys(SVG_STEPS, 0.0)
         for (file, color) in input_files:
             logger.debug(' - Loading layer file '+file)
             file = os.path.join(input_folder, file)
-            new_layer = svgutils.fromstring(load_svg(file, color, p.colored_holes, p.holes_color, p.monochrome))
+            start = perf_counter()
+            content = load_svg(file, color, p.colored_holes, p.holes_color, p.monochrome)
+            times['load'] += perf_counter()-start
+            start = perf_counter()
+            new_layer = svgutils.fromstring(content)
+            times['parse'] += perf_counter()-start
             width, height = get_size(new_layer)
             # Workaround for polygon fill on KiCad 5
+            fill_color = None
             if GS.ki5 and file.endswith('frame.svg'):
-                if p.monochrome:
-                    color = to_gray_hex(color)
-                self.fill_polygons(new_layer, color)
-            if self.format == 'PDF':
-                # Look for transparent text that we will copy to a suitable place
-                self.search_text(new_layer, texts)
+                fill_color = to_gray_hex(color) if p.monochrome else color
             if first:
-                svg_out = new_layer
                 # This is the width declared at the beginning of the file
                 base_width = width
+            # Adjust the coordinates of this section to the main width
+            scale = base_width/width
+            if scale != 1.0:
+                logger.debug(' - Scaling {} by {}'.format(file, scale))
+            self.transform_layer(new_layer, fill_color, texts, scale, times)
+            if first:
+                svg_out = new_layer
                 first = False
                 self.process_background(svg_out, width, height)
                 self.add_frame_images(svg_out, p.monochrome)
             else:
-                root = new_layer.getroot()
-                # Adjust the coordinates of this section to the main width
-                scale = base_width/width
-                if scale != 1.0:
-                    logger.debug(' - Scaling {} by {}'.format(file, scale))
-                    for e in root:
-                        e.scale(scale)
-                svg_out.append([root])
-        if self.format == 'PDF':
+                svg_out.append([new_layer.getroot()])
+        if texts:
             # Make the text searchable
             # Add it before anything using the background color
             for text in texts:
                 svg_out.insert(text)
+        start = perf_counter()
         svg_out.save(os.path.join(output_folder, output_file))
+        times['save'] = perf_counter()-start
+        logger.debug(' - SVG steps: '+', '.join('{} {:.3f} s'.format(k, v) for k, v in times.items()))
 
     def plot_extra_cu(self, id, la, pc, p, filelist):
         """ Plot pads and vias to make them different """
@@ -1011,19 +1090,70 @@ class PCB_PrintOptions(VariantOptions):
 #     def get_view_box(self, svg):
 #         return tuple(map(lambda x: float(x), svg.root.get('viewBox').split(' ')))
 
+    def solder_mask_key(self, back):
+        """ Things used by PcbDraw to render the solder mask: the board and how we changed it (variant) """
+        st = os.stat(GS.pcb_file)
+        variant = None
+        if self.will_filter_pcb_components():
+            comps = tuple((c.ref, c.included, c.fitted,
+                           c.get_field_value('footprint') if getattr(c, '_footprint_variant', False) else None)
+                          for c in self._comps or ())
+            variant = (self.variant.name if self.variant else None, self._sub_pcb.name if self._sub_pcb else None,
+                       GS.global_remove_solder_mask_for_dnp, comps)
+        return (GS.pcb_file, st.st_mtime_ns, st.st_size, variant, back, self.svg_precision)
+
+    def get_solder_mask(self, pcbdraw_file, back):
+        """ The solder mask created by PcbDraw, filtered to keep only what we need.
+            Rendered once for each board state and side, an empty string means PcbDraw didn't give what we need """
+        key = self.solder_mask_key(back)
+        svg = SolderMaskCache.get(key)
+        if svg is not None:
+            logger.debug(' - Using the already rendered solder mask')
+            return svg
+        # Create an SVG using PcbDraw engine to generate the solder mask
+        svg = svgutils.fromstring(self.pcbdraw_by_module(pcbdraw_file, back))
+        # Filter the PcbDraw SVG to get what we want
+        defs = None
+        g = None
+        for child in svg.root:
+            if child.tag.endswith('}defs'):
+                # Keep the cut-off and pads-mask-silkscreen defs
+                defs = child
+                logger.debug(' - Found <defs>')
+                for df in child:
+                    if df.get('id') not in ['cut-off', 'pads-mask-silkscreen']:
+                        child.remove(df)  # noqa: B038
+            elif child.tag.endswith('}g') and child.get('id') == "boardContainer":
+                # Keep the solder mask
+                g = child
+                g_mask = g[0]
+                if g_mask.get('clip-path') == "url(#cut-off)" and g_mask.get('mask') == "url(#hole-mask)":
+                    logger.debug(' - Found clip-path')
+                    g_mask.set('mask', "url(#pads-mask-silkscreen)")
+                    for gf in g_mask:
+                        if gf.get('id') != 'substrate-board':
+                            g_mask.remove(gf)  # noqa: B038
+        svg = '' if g is None or defs is None else svg.to_str().decode()
+        SolderMaskCache.put(key, svg)
+        return svg
+
     def plot_realistic_solder_mask(self, id, temp_dir, out_file, color, mirror, scale):
         """ Plot the solder mask closer to reality, not the apertures """
         if not self.realistic_solder_mask or (id != F_Mask and id != B_Mask):
             return
         logger.debug('- Plotting realistic solder mask using PcbDraw')
         pcbdraw_file = os.path.join(temp_dir, out_file.replace('.svg', '-pcbdraw.svg'))
-        # Create an SVG using PcbDraw engine to generate the solder mask
-        svg = svgutils.fromstring(self.pcbdraw_by_module(pcbdraw_file, id == B_Mask))
-        # Load the plot file from KiCad to get the real coordinates system
+        svg = self.get_solder_mask(pcbdraw_file, id == B_Mask)
+        if not svg:
+            logger.warning(W_PDMASKFAIL+'Failed to extract elements from the PcbDraw SVG')
+            return
+        svg = svgutils.fromstring(svg)
+        # Get the real coordinates system from the plot file from KiCad, only the <svg> tag is needed
         out_file = os.path.join(temp_dir, out_file)
-        with open(out_file, 'rt') as f:
-            svg_kicad = svgutils.fromstring(f.read())
-        view_box = svg_kicad.root.get('viewBox')
+        from lxml.etree import iterparse
+        with open(out_file, 'rb') as f:
+            _, svg_kicad = next(iterparse(f, events=('start',), huge_tree=True))
+        view_box = svg_kicad.get('viewBox')
         view_box_elements = view_box.split(' ')
         # This is the paper size using the SVG precision
         paper_size_x = float(view_box_elements[2])
@@ -1044,41 +1174,20 @@ class PCB_PrintOptions(VariantOptions):
         else:
             if mirror:
                 transform = 'scale(-1,1) translate({},0)'.format(-paper_size_x)
-        # Filter the PcbDraw SVG to get what we want
-        defs = None
-        g = None
-        for child in svg.root:
-            if child.tag.endswith('}defs'):
-                # Keep the cut-off and pads-mask-silkscreen defs
-                defs = child
-                logger.debug(' - Found <defs>')
-                for df in child:
-                    if df.get('id') not in ['cut-off', 'pads-mask-silkscreen']:
-                        child.remove(df)  # noqa: B038
-            elif child.tag.endswith('}g') and child.get('id') == "boardContainer":
-                # Keep the solder mask
-                g = child
-                g.set('transform', transform)
-                g_mask = g[0]
-                if g_mask.get('clip-path') == "url(#cut-off)" and g_mask.get('mask') == "url(#hole-mask)":
-                    logger.debug(' - Found clip-path')
-                    g_mask.set('mask', "url(#pads-mask-silkscreen)")
-                    for gf in g_mask:
-                        if gf.get('id') != 'substrate-board':
-                            g_mask.remove(gf)  # noqa: B038
-                        else:
-                            # Apply our color to the solder mask
-                            alpha = 1.0
-                            if len(color) == 9:
-                                alpha = int(color[7:], 16)/255
-                                color = color[:7]
-                            gf.set('style', "fill:{0}; fill-opacity:{1}; stroke:{0}; stroke-width:0;".format(color, alpha))
-        if g is None or defs is None:
-            logger.warning(W_PDMASKFAIL+'Failed to extract elements from the PcbDraw SVG')
-            return
+        # Apply the transform and our color to the solder mask
+        g = next(c for c in svg.root if c.tag.endswith('}g') and c.get('id') == "boardContainer")
+        g.set('transform', transform)
+        g_mask = g[0]
+        if g_mask.get('mask') == "url(#pads-mask-silkscreen)":
+            alpha = 1.0
+            if len(color) == 9:
+                alpha = int(color[7:], 16)/255
+                color = color[:7]
+            for gf in g_mask:
+                gf.set('style', "fill:{0}; fill-opacity:{1}; stroke:{0}; stroke-width:0;".format(color, alpha))
         # Adjust the paper to what KiCad used
-        svg.root.set('width', svg_kicad.root.get('width'))
-        svg.root.set('height', svg_kicad.root.get('height'))
+        svg.root.set('width', svg_kicad.get('width'))
+        svg.root.set('height', svg_kicad.get('height'))
         svg.root.set('viewBox', view_box)
         # Save the filtered file
         svg.save(out_file)
@@ -1152,7 +1261,8 @@ class PCB_PrintOptions(VariantOptions):
             self.svg_to_pdf(input_folder, svg_file, pdf_file)
             svg_files.append(os.path.join(input_folder, pdf_file))
         logger.debug('- Joining {} into {} ({}x{})'.format(svg_files, output_fn, self.pcb.paper_w, self.pcb.paper_h))
-        create_pdf_from_pages(svg_files, output_fn, forced_width=self.pcb.paper_w)
+        create_pdf_from_pages(svg_files, output_fn, forced_width=self.pcb.paper_w,
+                              streaming=GS.global_pdf_streaming_merge)
 
     def check_tools(self):
         if self.format != 'SVG':
@@ -1253,6 +1363,8 @@ class PCB_PrintOptions(VariantOptions):
             layout = os.path.abspath(os.path.join(GS.get_resource_path('kicad_layouts'), 'default.kicad_wks'))
         logger.debug('- Using layout: '+layout)
         self.layout = layout
+        # Frame elements that are the same for all the pages, plotted only once
+        self._static_frames = {}
         # Memorize the list of visible layers
         old_visible = GS.board.GetVisibleLayers()
         # Plot options
@@ -1343,6 +1455,7 @@ class PCB_PrintOptions(VariantOptions):
             if self.plot_sheet_reference:
                 logger.debug('- Plotting the frame')
                 color = p.sheet_reference_color if p.sheet_reference_color else self._color_theme.pcb_frame
+                frame_files = [GS.pcb_basename+"-frame.svg"]
                 if self.frame_plot_mechanism == 'gui':
                     self.plot_frame_gui(temp_dir)
                 elif self.frame_plot_mechanism == 'plot':
@@ -1355,8 +1468,8 @@ class PCB_PrintOptions(VariantOptions):
                         # We already have the correct color, marking it as black will keep the color
                         color = '#000000'
                     else:
-                        self.plot_frame_internal(pc, po, p, len(pages)+1, len(self._pages))
-                filelist.append((GS.pcb_basename+"-frame.svg", color))
+                        frame_files = self.plot_frame_internal(pc, po, p, len(pages)+1, len(self._pages))
+                filelist.extend((f, color) for f in frame_files)
             # 3) Stack all layers in one file
             if self.format == 'SVG':
                 id, ext = self.get_id_and_ext(n, p.page_id)
@@ -1408,6 +1521,8 @@ class PCB_PrintOptions(VariantOptions):
             rmtree(temp_dir_base)
         # Restore the list of visible layers
         GS.board.SetVisibleLayers(old_visible)
+        if self.realistic_solder_mask and SolderMaskCache.hits+SolderMaskCache.misses:
+            logger.debug('- Solder mask cache: '+SolderMaskCache.stats())
         logger.debug('Finished generating `{}`'.format(output))
 
     def run(self, output):
@@ -21,6 +21,7 @@ Dependencies:
 PROFILE_PLOT = False
 if PROFILE_PLOT:
     import cProfile
+from concurrent.futures import ThreadPoolExecutor
 import os
 # Here we import the whole module to make monkeypatch work
 from .error import KiPlotConfigurationError
@@ -247,6 +248,8 @@ class PcbDrawOptions(VariantOptions):
                 The value is how much zeros has the multiplier (1 mm = 10 power `svg_precision` units).
                 Note that for an A4 paper Firefox 91 and Chrome 105 can't handle more than 5 """
         super().__init__()
+        # Populate steps for the next run, see compose_steps
+        self._steps = None
 
     def config(self, parent):
         self._filters_to_expand = False
@@ -405,65 +408,59 @@ class PcbDrawOptions(VariantOptions):
             plot_components.highlight = lambda ref: ref in highlight_set
         return plot_components
 
-    def create_image(self, name, board):
+    def check_format_tools(self):
+        """ Check we have the tools needed for the output format """
         self.ensure_tool('LXML')
-        from .PcbDraw.plot import PcbPlotter, PlotPaste, PlotPlaceholders, PlotSubstrate, PlotVCuts
-        # Select a name and format that PcbDraw can handle
-        svg_save_output_name = save_output_name = name
         self.rsvg_command = None
         self.convert_command = None
-        # Check we have the tools needed for the output format
         if self.format != 'svg':
             # We need RSVG for anything other than SVG
             self.rsvg_command = self.ensure_tool('RSVG')
-            svg_save_output_name = GS.tmp_file(suffix='.svg')
             # We need ImageMagick for anything other than SVG and PNG
             if self.format != 'png':
                 self.convert_command = self.ensure_tool('ImageMagick')
-                save_output_name = GS.tmp_file(suffix='.png')
 
+    def create_plotter(self, board, components=None):
+        """ Creates a PcbDraw plotter configured according to our options.
+            `components` is the PlotComponents to use, None means no components """
+        from .PcbDraw.plot import PcbPlotter, PlotPaste, PlotPlaceholders, PlotSubstrate, PlotVCuts
+        plotter = PcbPlotter(board)
+        # Read libs from KiBot resources
+        plotter.setup_arbitrary_data_path(GS.get_resource_path('pcbdraw'))
+        # Libs indicated by PCBDRAW_LIB_PATH
+        plotter.setup_env_data_path()
+        # Libs from the user HOME and the system (for pcbdraw)
+        plotter.setup_global_data_path()
+        logger.debugl(3, 'PcbDraw data path: {}'.format(plotter.data_path))
+        plotter.yield_warning = pcbdraw_warnings
+        plotter.libs = self.libs
+        plotter.render_back = self.bottom
+        plotter.mirror = self.mirror
+        plotter.margin = self._margin
+        plotter.svg_precision = self.svg_precision
+        if self._style:
+            if isinstance(self._style, str):
+                plotter.resolve_style(self._style)
+            else:
+                plotter.style = self._style
+        plotter.plot_plan = [PlotSubstrate(drill_holes=not self.no_drillholes, outline_width=mm2ki(self.outline_width))]
+        if self.show_solderpaste:
+            plotter.plot_plan.append(PlotPaste())
+        if self.vcuts:
+            plotter.plot_plan.append(PlotVCuts(layer=self._vcuts_layer))
+        if components is not None:
+            plotter.plot_plan.append(components)
+        if self.placeholder:
+            plotter.plot_plan.append(PlotPlaceholders())
+        plotter.compute_bbox = self.size_detection == 'svg_paths'
+        # Make sure we can use svgpathtools
+        if plotter.compute_bbox:
+            self.ensure_tool('numpy')
+        plotter.kicad_bb_only_edge = self.size_detection == 'kicad_edge'
+        return plotter
+
+    def plot(self, plotter):
         try:
-            plotter = PcbPlotter(board)
-            # Read libs from KiBot resources
-            plotter.setup_arbitrary_data_path(GS.get_resource_path('pcbdraw'))
-            # Libs indicated by PCBDRAW_LIB_PATH
-            plotter.setup_env_data_path()
-            # Libs from the user HOME and the system (for pcbdraw)
-            plotter.setup_global_data_path()
-            logger.debugl(3, 'PcbDraw data path: {}'.format(plotter.data_path))
-            plotter.yield_warning = pcbdraw_warnings
-            plotter.libs = self.libs
-            plotter.render_back = self.bottom
-            plotter.mirror = self.mirror
-            plotter.margin = self._margin
-            plotter.svg_precision = self.svg_precision
-            if self._style:
-                if isinstance(self._style, str):
-                    plotter.resolve_style(self._style)
-                else:
-                    plotter.style = self._style
-            plotter.plot_plan = [PlotSubstrate(drill_holes=not self.no_drillholes, outline_width=mm2ki(self.outline_width))]
-            if self.show_solderpaste:
-                plotter.plot_plan.append(PlotPaste())
-            if self.vcuts:
-                plotter.plot_plan.append(PlotVCuts(layer=self._vcuts_layer))
-            # Adjust the show_components option if needed
-            if self.add_to_variant:
-                # Enable the old behavior
-                if self._comps and self.show_components is None:
-                    # A variant automatically adds their components
-                    # So `none` becomes `all`
-                    self.show_components = []
-            if self.show_components is not None:
-                plotter.plot_plan.append(self.build_plot_components())
-            if self.placeholder:
-                plotter.plot_plan.append(PlotPlaceholders())
-            plotter.compute_bbox = self.size_detection == 'svg_paths'
-            # Make sure we can use svgpathtools
-            if plotter.compute_bbox:
-                self.ensure_tool('numpy')
-            plotter.kicad_bb_only_edge = self.size_detection == 'kicad_edge'
-            # Plot it
             if PROFILE_PLOT:
                 logger.error('Start')
                 with cProfile.Profile() as pr:
@@ -478,10 +475,19 @@ class PcbDrawOptions(VariantOptions):
         # When the SVG contains errors we get SyntaxError
         except (RuntimeError, SyntaxError, IOError) as e:
             GS.exit_with_error('PcbDraw error: '+str(e), PCBDRAW_ERR)
+        return image
 
-        # Save the result
+    def save_image(self, image, name):
+        """ Saves the SVG. Returns the arguments for `convert_image` """
+        # Select a name and format that PcbDraw can handle
+        svg_save_output_name = GS.tmp_file(suffix='.svg') if self.rsvg_command else name
+        save_output_name = GS.tmp_file(suffix='.png') if self.convert_command else name
         logger.debug('Saving output to '+svg_save_output_name)
         image.write(svg_save_output_name)
+        return svg_save_output_name, save_output_name, name
+
+    def convert_image(self, svg_save_output_name, save_output_name, name):
+        """ Converts the saved SVG to the output format """
         # Do we need to convert to PNG?
         if self.rsvg_command:
             logger.debug('Converting {} -> {}'.format(svg_save_output_name, save_output_name))
@@ -499,8 +505,90 @@ class PcbDrawOptions(VariantOptions):
             _run_command(cmd)
             os.remove(save_output_name)
 
+    def create_image(self, name, board):
+        self.check_format_tools()
+        # Adjust the show_components option if needed
+        if self.add_to_variant:
+            # Enable the old behavior
+            if self._comps and self.show_components is None:
+                # A variant automatically adds their components
+                # So `none` becomes `all`
+                self.show_components = []
+        components = self.build_plot_components() if self.show_components is not None else None
+        image = self.plot(self.create_plotter(board, components))
+        # Save the result
+        self.convert_image(*self.save_image(image, name))
+
+    def can_compose_steps(self):
+        """ The populate steps can be composed from a base plot only if the image size doesn't depend on
+            the visible components """
+        return self.size_detection != 'svg_paths'
+
+    def create_base_plot(self, board):
+        """ Plots the board with all the components and their highlights """
+        components = self.build_plot_components()
+        components.filter = lambda ref: True
+        components.highlight = lambda ref: True
+        components.components_in_defs = True
+        return self.plot(self.create_plotter(board, components)), components
+
+    def compose_steps(self, steps, out_dir, workers=0):
+        """ The next run will create the images for the `populate` steps, see create_step_images """
+        self._steps = (steps, out_dir, workers)
+        self._step_names = None
+
+    def create_step_images(self, steps, out_dir, workers=0):
+        """ Creates the images for the `populate` steps.
+            `steps` is a list of (components, active_components, bottom, name).
+            The board and its components are plotted only once for each side, each step just hides
+            the components and highlights that aren't used. Returns the names of the images """
+        self.check_format_tools()
+        self.filter_pcb_components(do_3D=True)
+        bases = {}
+        names = []
+        conversions = []
+        for components, active_components, bottom, name in steps:
+            o_name = self.setup_renderer(components, active_components, bottom, name)
+            names.append(o_name)
+            if bottom not in bases:
+                bases[bottom] = self.create_base_plot(GS.board)
+            image, plotted = bases[bottom]
+            if self.show_components is not None:
+                step = self.build_plot_components()
+                show, highlight = step.filter, step.highlight
+            else:
+                show = highlight = lambda ref: False
+            hidden = []
+            for ref, elements in plotted.placed.items():
+                visible = show(ref)
+                if not visible:
+                    hidden.extend(elements)
+                if not visible or not highlight(ref):
+                    hidden.extend(plotted.highlights.get(ref, []))
+            for e in hidden:
+                e.set('display', 'none')
+            logger.debug('Composing {}, {} elements hidden'.format(o_name, len(hidden)))
+            conversions.append(self.save_image(image, os.path.join(out_dir, o_name)))
+            for e in hidden:
+                del e.attrib['display']
+        self.unfilter_pcb_components(do_3D=True)
+        # Convert the images, they are independent so we can do it in parallel
+        workers = min(GS.get_workers(workers), len(conversions))
+        if self.rsvg_command and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(lambda args: self.convert_image(*args), conversions))
+        else:
+            for args in conversions:
+                self.convert_image(*args)
+        return names
+
     def run(self, name):
         super().run(name)
+        if self._steps is not None:
+            # Used as a `populate` renderer, all the steps in one run
+            steps, self._steps = self._steps, None
+            self._step_names = self.create_step_images(*steps)
+            return
         # Apply any variant
         self.filter_pcb_components(do_3D=True)
         # Create the image
@@ -133,7 +133,7 @@ class PDFUniteOptions(BaseOptions):
         if self.use_external_command:
             self.run_external(files, output)
         else:
-            create_pdf_from_pages(files, output)
+            create_pdf_from_pages(files, output, streaming=GS.global_pdf_streaming_merge)
 
 
 @output_class
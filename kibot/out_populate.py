@@ -63,6 +63,14 @@ class PopulateOptions(VariantOptions):
             """ Pattern used for the image names. The `%d` is replaced by the image number.
                 The `%x` is replaced by the extension. Note that the format is selected by the
                 `renderer` """
+            self.reuse_plot = True
+            """ When using a `pcbdraw` renderer plot the board and its components only once for each side.
+                Each step is created hiding the components not yet soldered, which is much faster.
+                Not used when the renderer uses `size_detection: svg_paths`, because the size of the
+                image depends on the visible components """
+            self.workers = 0
+            """ [0,256] Number of images converted to PNG, JPG or BMP in parallel when using `reuse_plot`.
+                0 means to use the global `workers` value """
         super().__init__()
 
     def config(self, parent):
@@ -100,12 +108,19 @@ class PopulateOptions(VariantOptions):
         dir = os.path.dirname(os.path.join(dir_name, self.imgname))
         if not os.path.exists(dir):
             os.makedirs(dir)
-        counter = 0
-        for item in content:
-            if item["type"] != "steps":
-                continue
-            for x in item["steps"]:
-                counter += 1
+        steps = [x for item in content if item["type"] == "steps" for x in item["steps"]]
+        if self.reuse_plot and options.can_compose_steps():
+            logger.debug('Composing {} steps from a base plot'.format(len(steps)))
+            options.compose_steps([(x["components"], x["active_components"], x["side"].startswith("back"),
+                                    self.imgname.replace('%d', str(counter)))
+                                   for counter, x in enumerate(steps, start=1)], dir_name, self.workers)
+            self._renderer.dir = self._parent.dir
+            self._renderer._done = False
+            run_output(self._renderer)
+            for x, name in zip(steps, options._step_names):
+                x["img"] = name
+        else:
+            for counter, x in enumerate(steps, start=1):
                 filename = self.imgname.replace('%d', str(counter))
                 x["img"] = self.generate_image(x["side"], x["components"], x["active_components"], filename, options)
         # Restore the options
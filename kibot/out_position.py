@@ -6,8 +6,8 @@
 # Project: KiBot (formerly KiPlot)
 # Adapted from: https://github.com/johnbeard/kiplot/pull/10
 import os
-from re import compile
 from datetime import datetime
+from .board_scan import BoardScan
 from .gs import GS
 from .kiplot import run_command
 from .misc import UI_SMD, UI_VIRTUAL, MOD_THROUGH_HOLE, MOD_SMD, MOD_EXCLUDE_FROM_POS_FILES
@@ -18,20 +18,9 @@ from .macros import macros, document, output_class  # noqa: F401
 from . import log
 
 logger = log.get_logger()
-ref_re = compile(r'([^\d]+)([\?\d]+)')
 DEFAULT_COLUMNS = ['Ref', 'Val', 'Package', 'PosX', 'PosY', 'Rot', 'Side']
 
 
-def _ref_key(ref_str):
-    """ Splits a reference intro prefix and suffix.
-        Helps to sort references in a natural way. """
-    m = ref_re.match(ref_str)
-    if not m:
-        return [ref_str]
-    pre, suf = m.groups()
-    return [pre, 0 if suf == '?' else int(suf)]
-
-
 def check_names(top, bot):
     if top == bot:
         raise KiPlotConfigurationError("Asking for two separated files, but both with the same name.\n"
@@ -204,20 +193,20 @@ class PositionOptions(VariantOptions):
             bothf.close()
 
     @staticmethod
-    def is_pure_smd_5(m):
-        return m.GetAttributes() == UI_SMD
+    def is_pure_smd_5(attrs):
+        return attrs == UI_SMD
 
     @staticmethod
-    def is_pure_smd_6(m):
-        return m.GetAttributes() & (MOD_THROUGH_HOLE | MOD_SMD | MOD_EXCLUDE_FROM_POS_FILES) == MOD_SMD
+    def is_pure_smd_6(attrs):
+        return attrs & (MOD_THROUGH_HOLE | MOD_SMD | MOD_EXCLUDE_FROM_POS_FILES) == MOD_SMD
 
     @staticmethod
-    def is_not_virtual_5(m):
-        return m.GetAttributes() != UI_VIRTUAL
+    def is_not_virtual_5(attrs):
+        return attrs != UI_VIRTUAL
 
     @staticmethod
-    def is_not_virtual_6(m):
-        return not (m.GetAttributes() & MOD_EXCLUDE_FROM_POS_FILES)
+    def is_not_virtual_6(attrs):
+        return not (attrs & MOD_EXCLUDE_FROM_POS_FILES)
 
     @staticmethod
     def get_attr_tests():
@@ -250,14 +239,23 @@ class PositionOptions(VariantOptions):
         fname = self.expand_filename(output_dir, self.output, 'bottom_pos', self._expand_ext)
         run_command(cmd_base+['back', '-o', fname, pcb_name])
 
+    def needs_board_changes(self):
+        """ The position only depends on the board for the coordinates and attributes.
+            Only the sub-PCBs (move the objects) and footprint replacements change them """
+        if self._sub_pcb:
+            return True
+        return self._comps is not None and any(getattr(c, '_footprint_variant', False) for c in self._comps)
+
     def run(self, fname):
         super().run(fname)
         output_dir = os.path.dirname(fname)
         if self.format == 'GBR':
             self.run_gerber(output_dir)
             return
-        self.filter_pcb_components()
+        # Most of the time we can use the board as it is, so the placements are shared by all the outputs
+        changed = self.needs_board_changes() and self.filter_pcb_components()
         columns = tuple(o.name for o in self._columns)
+        col_ids = tuple(o.id for o in self._columns)
         conv = GS.unit_name_to_scale_factor(self.units)
         # Format all strings
         comps_hash = self.get_refs_hash_multi()
@@ -266,14 +264,15 @@ class PositionOptions(VariantOptions):
         is_pure_smd, is_not_virtual = self.get_attr_tests()
         quote_char = '"' if self.format == 'CSV' else ''
         quote_char_extra = quote_char if self.quote_all else ''
+        float_format = "{{:.{}f}}".format(self.right_digits) if self.right_digits != 0 else "{}"
         x_origin = 0.0
         y_origin = 0.0
         if self.use_aux_axis_as_origin:
             (x_origin, y_origin) = GS.get_aux_origin()
             logger.debug('Using auxiliary origin: x={} y={}'.format(x_origin, y_origin))
-        for m in sorted(GS.get_modules(), key=lambda c: _ref_key(c.GetReference())):
-            ref = m.GetReference()
-            logger.debug('P&P ref: {}'.format(ref))
+        for m in BoardScan.get_placements():
+            ref = m.ref
+            logger.debugl(2, 'P&P ref: {}'.format(ref))
             value = None
             # Apply any filter or variant data
             if comps_hash:
@@ -281,7 +280,7 @@ class PositionOptions(VariantOptions):
                 if c:
                     # Multiple components with the same reference is "normal" for a panel
                     c = c.pop()
-                    logger.debug('- fit: {} include: {}'.format(c.fitted, c.included))
+                    logger.debugl(2, '- fit: {} include: {}'.format(c.fitted, c.included))
                     if not c.fitted or not c.included:
                         continue
                     value = c.value
@@ -289,32 +288,26 @@ class PositionOptions(VariantOptions):
                     is_bottom = c.bottom
                     rotation = c.footprint_rot
                     # Here we can't use c.footprint_x/y because this doesn't work for panels
-                    center = GS.get_center(m)
-                    center_x = center.x
-                    center_y = center.y
+                    center_x = m.x
+                    center_y = m.y
                     if c.pos_offset_x is not None:
                         # Offset from the rotation filter
                         # logger.error(f"{center_x},{center_y} -> {center_x+c.pos_offset_x},{center_y+c.pos_offset_y}")
                         center_x += c.pos_offset_x
                         center_y += c.pos_offset_y
             if value is None:
-                value = m.GetValue()
-                footprint = str(m.GetFPID().GetLibItemName())  # pcbnew.UTF8 type
-                is_bottom = m.IsFlipped()
-                rotation = m.GetOrientationDegrees()
-                center = GS.get_center(m)
-                center_x = center.x
-                center_y = center.y
+                value = m.value
+                footprint = m.package
+                is_bottom = m.bottom
+                rotation = m.rotation
+                center_x = m.x
+                center_y = m.y
             # If passed check the position options
-            if (self.only_smd and is_pure_smd(m)) or (not self.only_smd and (is_not_virtual(m) or self.include_virtual)):
+            if ((self.only_smd and is_pure_smd(m.attrs)) or
+               (not self.only_smd and (is_not_virtual(m.attrs) or self.include_virtual))):
                 # KiCad: PLACE_FILE_EXPORTER::GenPositionData() in export_footprints_placefile.cpp
                 row = []
-                if self.right_digits != 0:
-                    float_format = "{{:.{}f}}".format(self.right_digits)
-                else:
-                    float_format = "{}"
-                for col in self._columns:
-                    k = col.id
+                for k in col_ids:
                     if k == 'Ref':
                         row.append(quote_char+ref+quote_char)
                     elif k == 'Val':
@@ -325,18 +318,17 @@ class PositionOptions(VariantOptions):
                         pos_x = (center_x - x_origin) * conv
                         if self.bottom_negative_x and is_bottom:
                             pos_x = -pos_x
-                        row.append(quote_char_extra+float_format.format(pos_x, rd=self.right_digits)+quote_char_extra)
+                        row.append(quote_char_extra+float_format.format(pos_x)+quote_char_extra)
                     elif k == 'PosY':
-                        row.append(quote_char_extra+float_format.format(-(center_y - y_origin) * conv, rd=self.right_digits) +
-                                   quote_char_extra)
+                        row.append(quote_char_extra+float_format.format(-(center_y - y_origin) * conv)+quote_char_extra)
                     elif k == 'Rot':
-                        row.append(quote_char_extra+float_format.format(rotation, rd=self.right_digits)+quote_char_extra)
+                        row.append(quote_char_extra+float_format.format(rotation)+quote_char_extra)
                     elif k == 'Side':
                         row.append(quote_char_extra+("bottom" if is_bottom else "top")+quote_char_extra)
                 modules.append(row)
                 modules_side.append(is_bottom)
             else:
-                logger.debug('- pure_smd: {} not_virtual {}'.format(is_pure_smd(m), is_not_virtual(m)))
+                logger.debugl(2, '- pure_smd: {} not_virtual {}'.format(is_pure_smd(m.attrs), is_not_virtual(m.attrs)))
         # Find max width for all columns
         maxlengths = []
         for col, name in enumerate(columns):
@@ -349,7 +341,8 @@ class PositionOptions(VariantOptions):
             self._do_position_plot_ascii(output_dir, columns, modules, maxlengths, modules_side)
         else:  # if self.format == 'CSV':
             self._do_position_plot_csv(output_dir, columns, modules, modules_side)
-        self.unfilter_pcb_components()
+        if changed:
+            self.unfilter_pcb_components()
 
 
 @output_class
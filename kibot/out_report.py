@@ -15,14 +15,15 @@ Dependencies:
     extra_arch: ['texlive-core']
     comments: 'In CI/CD environments: the `kicad_auto_test` docker image contains it.'
 """
-import math
+from functools import lru_cache
+from io import StringIO
 import os
 import re
 import pcbnew
 
 from .gs import GS
-from .misc import (UI_SMD, UI_VIRTUAL, MOD_THROUGH_HOLE, MOD_SMD, MOD_EXCLUDE_FROM_POS_FILES, W_WRONGEXT, W_UNKPADSH,
-                   W_WRONGOAR, W_ECCLASST, VIATYPE_THROUGH, VIATYPE_BLIND_BURIED, VIATYPE_MICROVIA, W_BLINDVIAS, W_MICROVIAS)
+from .misc import W_WRONGEXT, W_UNKPADSH, W_WRONGOAR, W_ECCLASST, W_BLINDVIAS, W_MICROVIAS
+from .board_scan import BoardScan
 from .registrable import RegOutput
 from .out_base import VariantOptions
 from .error import KiPlotConfigurationError
@@ -39,6 +40,11 @@ EC_SMALL_OAR = GS.from_mm(0.125)
 # The minimum drill tool
 EC_MIN_DRILL = GS.from_mm(0.1)
 YES_NO = ['no', 'yes']
+VAR_RE = re.compile(r'\$\{([^\s\}]+)\}')
+FORMAT_RE = re.compile(r'^(%[^,]+),(.*)$')
+OP_TEXT, OP_CONDITIONAL, OP_CONTEXT = range(3)
+# How many compiled templates we keep
+TEMPLATE_PLANS_SIZE = 16
 
 
 def do_round(v, dig):
@@ -137,6 +143,9 @@ def to_top_bottom_color(front, bottom):
     return "Top: "+front.capitalize()+" / Bottom: "+bottom.capitalize()
 
 
+UNITS = (('_mm', to_mm, '_mm_digits'), ('_in', to_inches, '_in_digits'), ('_mils', to_mils, '_mils_digits'))
+
+
 def solve_edge_connector(val):
     if val == 'no':
         return ''
@@ -176,8 +185,66 @@ def list_nice(names):
     return res[2:]
 
 
-class PadProperty(object):
-    pass
+class TemplateVar(object):
+    """ A `${VAR}` reference, already parsed """
+    def __init__(self, ori):
+        self.ori = ori
+        self.pattern = self.units = self.digits = None
+        var = ori
+        m = FORMAT_RE.match(var)
+        if m:
+            self.pattern = m.group(1)
+            var = m.group(2)
+        for suffix, units, digits in UNITS:
+            if var.endswith(suffix):
+                self.units = units
+                self.digits = digits
+                var = var[:-len(suffix)]
+                break
+        self.name = var
+
+
+def compile_line(line):
+    """ Split a line in literal chunks (str) and variables (TemplateVar) """
+    parts = []
+    for c, chunk in enumerate(VAR_RE.split(line)):
+        if not c % 2:
+            if chunk:
+                parts.append(chunk)
+        elif chunk[0] == '_':
+            # Prevent access to internal data
+            parts.append('${'+chunk+'}')
+        else:
+            parts.append(TemplateVar(chunk))
+    return parts
+
+
+@lru_cache(maxsize=TEMPLATE_PLANS_SIZE)
+def compile_template(text):
+    """ Convert the template in a list of operations.
+        Also returns the lines used by the contexts, already compiled.
+        Only the last templates are cached """
+    plan = []
+    lines = {}
+    for line in StringIO(text):
+        if line[0] == '#':
+            if line.startswith('#?'):
+                cond = line[2:].strip()
+                try:
+                    code = compile(cond, '<conditional>', 'eval')
+                except SyntaxError:
+                    # Reported if we really need to evaluate it
+                    code = cond
+                plan.append((OP_CONDITIONAL, cond, code))
+                continue
+            if ':' in line:
+                context = line[1:].split(':')[0]
+                context_line = line[len(context)+2:]
+                lines[context_line] = compile_line(context_line)
+                plan.append((OP_CONTEXT, context, context_line))
+                continue
+        plan.append((OP_TEXT, compile_line(line), None))
+    return plan, lines
 
 
 class ReportOptions(VariantOptions):
@@ -227,6 +294,7 @@ class ReportOptions(VariantOptions):
         deb_text = 'In Debian/Ubuntu environments: install '+list_nice([dep.deb_package]+dep.extra_deb)
         self._help_do_convert += ".\n"+'\n'.join(dep.comments)+'\n'+deb_text
         self._shown_defined = False
+        self._line_plans = {}
 
     def config(self, parent):
         super().config(parent)
@@ -249,59 +317,43 @@ class ReportOptions(VariantOptions):
             raise KiPlotConfigurationError("Eurocircuits Pattern class out of range [3,10]")
         self._ec_drl = ord(m.group(2))-ord('A')
 
+    def expand_var(self, var, defined):
+        """ Value for a `${VAR}` reference """
+        if var.name not in defined:
+            logger.non_critical_error('Unable to expand `{}`'.format(var.name))
+            if not self._shown_defined:
+                self._shown_defined = True
+                logger.non_critical_error('Defined values: {}'.format([v for v in defined.keys() if v[0] != '_']))
+            return '${'+var.ori+'}'
+        val = defined[var.name]
+        if val == INF:
+            val = 'N/A'
+        elif var.units is not None and isinstance(val, (int, float)):
+            val = var.units(val, getattr(self, var.digits))
+        if var.pattern is None:
+            return str(val)
+        clear = False
+        if 's' in var.pattern:
+            val = str(val)
+        else:
+            try:
+                val = float(val)
+            except ValueError:
+                val = 0
+                clear = True
+        rep = var.pattern % val
+        return ' '*len(rep) if clear else rep
+
+    def render_line(self, parts, defined):
+        return ''.join(p if isinstance(p, str) else self.expand_var(p, defined) for p in parts)
+
     def do_replacements(self, line, defined):
         """ Replace `${VAR}` patterns """
-        for var in re.findall(r'\$\{([^\s\}]+)\}', line):
-            if var[0] == '_':
-                # Prevent access to internal data
-                continue
-            units = None
-            var_ori = var
-            m = re.match(r'^(%[^,]+),(.*)$', var)
-            pattern = None
-            if m:
-                pattern = m.group(1)
-                var = m.group(2)
-            if var.endswith('_mm'):
-                units = to_mm
-                digits = self._mm_digits
-                var = var[:-3]
-            elif var.endswith('_in'):
-                units = to_inches
-                digits = self._in_digits
-                var = var[:-3]
-            elif var.endswith('_mils'):
-                units = to_mils
-                digits = self._mils_digits
-                var = var[:-5]
-            if var in defined:
-                val = defined[var]
-                if val == INF:
-                    val = 'N/A'
-                elif units is not None and isinstance(val, (int, float)):
-                    val = units(val, digits)
-                if pattern is not None:
-                    clear = False
-                    if 's' in pattern:
-                        val = str(val)
-                    else:
-                        try:
-                            val = float(val)
-                        except ValueError:
-                            val = 0
-                            clear = True
-                    rep = pattern % val
-                    if clear:
-                        rep = ' '*len(rep)
-                else:
-                    rep = str(val)
-                line = line.replace('${'+var_ori+'}', rep)
-            else:
-                logger.non_critical_error('Unable to expand `{}`'.format(var))
-                if not self._shown_defined:
-                    self._shown_defined = True
-                    logger.non_critical_error('Defined values: {}'.format([v for v in defined.keys() if v[0] != '_']))
-        return line
+        parts = self._line_plans.get(line)
+        if parts is None:
+            # Not from the template, don't keep it
+            parts = compile_line(line)
+        return self.render_line(parts, defined)
 
     def context_defined_tracks(self, line):
         """ Replace iterator for the `defined_tracks` context """
@@ -462,27 +514,6 @@ class ReportOptions(VariantOptions):
         """ Replace iterator for the `schematic_svg` context """
         return self._context_individual_images(line, self._schematic_svgs)
 
-    @staticmethod
-    def is_pure_smd_5(m):
-        return m.GetAttributes() == UI_SMD
-
-    @staticmethod
-    def is_pure_smd_6(m):
-        return m.GetAttributes() & (MOD_THROUGH_HOLE | MOD_SMD) == MOD_SMD
-
-    @staticmethod
-    def is_not_virtual_5(m):
-        return m.GetAttributes() != UI_VIRTUAL
-
-    @staticmethod
-    def is_not_virtual_6(m):
-        return not (m.GetAttributes() & MOD_EXCLUDE_FROM_POS_FILES)
-
-    def get_attr_tests(self):
-        if GS.ki5:
-            return self.is_pure_smd_5, self.is_not_virtual_5
-        return self.is_pure_smd_6, self.is_not_virtual_6
-
     def measure_pcb(self, board):
         x1, y1, x2, y2 = GS.compute_pcb_boundary(board)
         if x1 is None:
@@ -572,47 +603,33 @@ class ReportOptions(VariantOptions):
         # Track width (min)
         ###########################################################
         self.track_d = ds.m_TrackMinWidth
-        tracks = board.GetTracks()
-        self.oar_vias = self.oar_vias_ec = self.track = INF
+        scan = BoardScan.get(board)
+        self.oar_vias = self.oar_vias_ec = INF
         self._vias = {}
         self._vias_ec = {}
         self._tracks_m = {}
         self._drills_real = {}
         self._drills_ec = {}
-        track_type = 'TRACK' if GS.ki5 else 'PCB_TRACK'
-        via_type = 'VIA' if GS.ki5 else 'PCB_VIA'
-        self.thru_vias_count = self.blind_vias_count = self.micro_vias_count = self.vias_count = 0
-        for t in tracks:
-            tclass = t.GetClass()
-            if tclass == track_type:
-                w = t.GetWidth()
-                self.track = min(w, self.track)
-                self._tracks_m[w] = self._tracks_m.get(w, 0) + 1
-            elif tclass == via_type:
-                via = t.Cast()
-                via_id = (via.GetDrill(), via.GetWidth())
-                self._vias[via_id] = self._vias.get(via_id, 0) + 1
-                d = adjust_drill(via_id[0])
-                oar, oar_ec, d_ec = self.compute_oar(via_id[1], d)
-                via_id_ec = (d_ec, via_id[1])
-                self._vias_ec[via_id_ec] = self._vias.get(via_id_ec, 0) + 1
-                self.oar_vias = min(self.oar_vias, oar)
-                self.oar_vias_ec = min(self.oar_vias_ec, oar_ec)
-                self._drills_real[d] = self._drills_real.get(d, 0) + 1
-                self._drills_ec[d_ec] = self._drills_ec.get(d_ec, 0) + 1
-                self.vias_count += 1
-                via_t = via.GetViaType()
-                if via_t == VIATYPE_THROUGH:
-                    self.thru_vias_count += 1
-                elif via_t == VIATYPE_BLIND_BURIED:
-                    self.blind_vias_count += 1
-                elif via_t == VIATYPE_MICROVIA:
-                    self.micro_vias_count += 1
+        for w in scan.track_widths:
+            self._tracks_m[w] = self._tracks_m.get(w, 0) + 1
+        self.track = min(self._tracks_m) if self._tracks_m else INF
+        for via in scan.vias:
+            via_id = (via.drill, via.width)
+            self._vias[via_id] = self._vias.get(via_id, 0) + 1
+            d = adjust_drill(via_id[0])
+            oar, oar_ec, d_ec = self.compute_oar(via_id[1], d)
+            via_id_ec = (d_ec, via_id[1])
+            self._vias_ec[via_id_ec] = self._vias.get(via_id_ec, 0) + 1
+            self.oar_vias = min(self.oar_vias, oar)
+            self.oar_vias_ec = min(self.oar_vias_ec, oar_ec)
+            self._drills_real[d] = self._drills_real.get(d, 0) + 1
+            self._drills_ec[d_ec] = self._drills_ec.get(d_ec, 0) + 1
+        self.vias_count = len(scan.vias)
+        self.thru_vias_count, self.blind_vias_count, self.micro_vias_count = scan.via_counts()
         self.track_min = min(self.track_d, self.track)
         ###########################################################
         # Drill (min)
         ###########################################################
-        modules = board.GetModules() if GS.ki5 else board.GetFootprints()
         self._drills = {}
         self._drills_oval = {}
         self.oar_pads = self.oar_pads_ec = self.pad_drill = self.pad_drill_real = self.pad_drill_real_ec = INF
@@ -620,68 +637,51 @@ class ReportOptions(VariantOptions):
         self.top_smd = self.top_tht = self.bot_smd = self.bot_tht = 0
         top_layer = board.GetLayerID('F.Cu')
         bottom_layer = board.GetLayerID('B.Cu')
-        is_pure_smd, is_not_virtual = self.get_attr_tests()
-        npth_attrib = 3 if GS.ki5 else pcbnew.PAD_ATTRIB_NPTH
         min_oar = GS.from_mm(0.1)
-        pad_properties = []
-        for m in modules:
-            ref = m.GetReference()
-            layer = m.GetLayer()
-            if layer == top_layer:
-                if is_pure_smd(m):
+        for m in scan.footprints:
+            if m.layer == top_layer:
+                if m.pure_smd:
                     self.top_smd += 1
-                elif is_not_virtual(m):
+                elif m.not_virtual:
                     self.top_tht += 1
-            elif layer == bottom_layer:
-                if is_pure_smd(m):
+            elif m.layer == bottom_layer:
+                if m.pure_smd:
                     self.bot_smd += 1
-                elif is_not_virtual(m):
+                elif m.not_virtual:
                     self.bot_tht += 1
-            pads = m.Pads()
-            for pad in pads:
-                # Pad properties
-                if not GS.ki5:
-                    p = PadProperty()
-                    p.fab_property = pad.GetProperty()
-                    p.net = pad.GetNetname()
-                    p.name = ref+'.'+pad.GetNumber()
-                    pad_properties.append(p)
-                dr = pad.GetDrillSize()
-                if not dr.x:
-                    continue
-                self.pad_drill = min(dr.x, self.pad_drill)
-                self.pad_drill = min(dr.y, self.pad_drill)
-                # Compute the drill size to get it after plating
-                is_pth = pad.GetAttribute() != npth_attrib
-                dr_x_real = adjust_drill(dr.x, is_pth, pad)
-                dr_y_real = adjust_drill(dr.y, is_pth, pad)
-                self.pad_drill_real = min(dr_x_real, self.pad_drill_real)
-                self.pad_drill_real = min(dr_y_real, self.pad_drill_real)
-                if dr.x == dr.y:
-                    self._drills[dr.x] = self._drills.get(dr.x, 0) + 1
-                    self._drills_real[dr_x_real] = self._drills_real.get(dr_x_real, 0) + 1
+        for pad in scan.pads:
+            dr = pad.drill
+            dr_x, dr_y = dr
+            if not dr_x:
+                continue
+            self.pad_drill = min(dr_x, dr_y, self.pad_drill)
+            # Compute the drill size to get it after plating
+            is_pth = pad.is_pth
+            dr_x_real = adjust_drill(dr_x, is_pth, pad.pad)
+            dr_y_real = adjust_drill(dr_y, is_pth, pad.pad)
+            self.pad_drill_real = min(dr_x_real, dr_y_real, self.pad_drill_real)
+            if dr_x == dr_y:
+                self._drills[dr_x] = self._drills.get(dr_x, 0) + 1
+                self._drills_real[dr_x_real] = self._drills_real.get(dr_x_real, 0) + 1
+            else:
+                if dr_x < dr_y:
+                    m = (dr_x, dr_y)
+                    d_r = dr_x_real
                 else:
-                    if dr.x < dr.y:
-                        m = (dr.x, dr.y)
-                        d = dr.x
-                        d_r = dr_x_real
-                    else:
-                        m = (dr.y, dr.x)
-                        d = dr.y
-                        d_r = dr_y_real
-                    self._drills_oval[m] = self._drills_oval.get(m, 0) + 1
-                    self.slot = min(self.slot, m[0])
-                    # print('{} @ {}'.format(dr, pad.GetPosition()))
-                    self._drills_real[d_r] = self._drills_real.get(d_r, 0) + 1
-                pad_sz = pad.GetSize()
-                oar_x, oar_ec_x, dr_x_ec = self.compute_oar(pad_sz.x, dr_x_real)
-                oar_y, oar_ec_y, dr_y_ec = self.compute_oar(pad_sz.y, dr_y_real)
-                dr_ec = min(dr_x_ec, dr_y_ec)
-                self._drills_ec[dr_ec] = self._drills_ec.get(dr_ec, 0) + 1
-                self.pad_drill_real_ec = min(dr_ec, self.pad_drill_real_ec)
-                oar_t = min(oar_x, oar_y)
-                oar_ec_t = min(oar_ec_x, oar_ec_y)
-                self.analyze_oar(oar_t, oar_ec_t, is_pth, min_oar, pad, dr_x_real, dr_y_real, pad_sz, dr)
+                    m = (dr_y, dr_x)
+                    d_r = dr_y_real
+                self._drills_oval[m] = self._drills_oval.get(m, 0) + 1
+                self.slot = min(self.slot, m[0])
+                self._drills_real[d_r] = self._drills_real.get(d_r, 0) + 1
+            pad_sz = pad.size
+            oar_x, oar_ec_x, dr_x_ec = self.compute_oar(pad_sz[0], dr_x_real)
+            oar_y, oar_ec_y, dr_y_ec = self.compute_oar(pad_sz[1], dr_y_real)
+            dr_ec = min(dr_x_ec, dr_y_ec)
+            self._drills_ec[dr_ec] = self._drills_ec.get(dr_ec, 0) + 1
+            self.pad_drill_real_ec = min(dr_ec, self.pad_drill_real_ec)
+            oar_t = min(oar_x, oar_y)
+            oar_ec_t = min(oar_ec_x, oar_ec_y)
+            self.analyze_oar(oar_t, oar_ec_t, is_pth, min_oar, pad.pad, dr_x_real, dr_y_real, pad_sz, dr)
         self._vias_m = sorted(self._vias.keys())
         self._vias_ec_m = sorted(self._vias_ec.keys())
         # Via Pad size
@@ -785,72 +785,19 @@ class ReportOptions(VariantOptions):
         ###########################################################
         self.paste_pads_front = self.paste_pads_bottom = 0
         self.paste_pads_front_area = self.paste_pads_bottom_area = 0
-        for m in modules:
-            for pad in m.Pads():
-                on_top = pad.IsOnLayer(pcbnew.F_Paste)
-                on_bottom = pad.IsOnLayer(pcbnew.B_Paste)
-                if not on_top and not on_bottom:
-                    continue
-                shape = pad.GetShape()
-                size = pad.GetSize()
-                if GS.ki6:
-                    area = GS.to_mm(GS.to_mm(pad.GetEffectivePolygon().Area()))
-                elif shape == pcbnew.PAD_SHAPE_CIRCLE:
-                    radius = GS.to_mm(size.x/2)
-                    area = math.pi*radius*radius
-                elif shape == pcbnew.PAD_SHAPE_RECT:
-                    area = GS.to_mm(size.x)*GS.to_mm(size.y)
-                elif shape == pcbnew.PAD_SHAPE_OVAL:
-                    if size.x > size.y:
-                        dia_major = GS.to_mm(size.x)
-                        dia_minor = GS.to_mm(size.y)
-                    else:
-                        dia_major = GS.to_mm(size.y)
-                        dia_minor = GS.to_mm(size.x)
-                    area = dia_major*dia_minor
-                    # Adjust the area, here the dia_minor is the diameter for a circle
-                    area -= (1-math.pi/4)*dia_minor*dia_minor
-                elif shape == pcbnew.PAD_SHAPE_TRAPEZOID:
-                    delta = pad.GetDelta()
-                    if delta.x:
-                        a = GS.to_mm(size.y-delta.y)
-                        b = GS.to_mm(size.y+delta.y)
-                        h = GS.to_mm(size.x)
-                    else:
-                        a = GS.to_mm(size.x-delta.x)
-                        b = GS.to_mm(size.x+delta.x)
-                        h = GS.to_mm(size.y)
-                    area = a*b/2*h
-                elif shape == pcbnew.PAD_SHAPE_ROUNDRECT:
-                    area = GS.to_mm(size.x)*GS.to_mm(size.y)
-                    # Adjust the corners area
-                    radius = GS.to_mm(pad.GetRoundRectCornerRadius())
-                    # Taking the 4 corners:
-                    # - We computed a square: 2*radius*2*radius = 4*radius
-                    # - But we should compute a circle: PI*radius*radius
-                    area -= (4-math.pi)*radius*radius
-                # Introduced in KiCad 6, so we can use GetEffectivePolygon
-                # elif shape == pcbnew.PAD_SHAPE_CHAMFERED_RECT:
-                #     area = GS.to_mm(size.x)*GS.to_mm(size.y)
-                #     sz = pad.GetChamferRectRatio()*GS.to_mm(min(size.x, size.y))
-                #     corners = pad.GetChamferPositions()
-                #     n_corners = 1 if corners & 1 else 0
-                #     n_corners += 1 if corners & 2 else 0
-                #     n_corners += 1 if corners & 4 else 0
-                #     n_corners += 1 if corners & 8 else 0
-                #     area -= n_corners*sz*sz/2
-                elif shape == pcbnew.PAD_SHAPE_CUSTOM:
-                    poly = pad.GetCustomShapeAsPolygon()
-                    area = GS.to_mm(GS.to_mm(poly.Area()))
-                else:
-                    logger.warning(f"{W_UNKPADSH}Unknown shape for pad `{pad.GetNumber()}` of `{m.GetReference()}` " +
-                                   get_pad_info(pad))
-                if on_top:
-                    self.paste_pads_front += 1
-                    self.paste_pads_front_area += area
-                else:
-                    self.paste_pads_bottom += 1
-                    self.paste_pads_bottom_area += area
+        for pad in scan.pads:
+            if not pad.paste_top and not pad.paste_bottom:
+                continue
+            area = pad.paste_area
+            if area is None:
+                logger.warning(f"{W_UNKPADSH}Unknown shape for pad `{pad.number}` of `{pad.ref}` "+get_pad_info(pad.pad))
+                area = 0
+            if pad.paste_top:
+                self.paste_pads_front += 1
+                self.paste_pads_front_area += area
+            else:
+                self.paste_pads_bottom += 1
+                self.paste_pads_bottom_area += area
         self._paste_pads_front_vol = self.paste_pads_front_area * self.stencil_thickness
         self._paste_pads_bottom_vol = self.paste_pads_bottom_area * self.stencil_thickness
         amount_of_metal = self.solder_paste_metal_amount/100.0
@@ -868,12 +815,14 @@ class ReportOptions(VariantOptions):
         ###########################################################
         nets = GS.board.GetNetsByName()
         self.testpoint_pads = 0
-        self.total_pads = len(pad_properties)
+        # KiCad 5 doesn't have pad properties
+        self.total_pads = 0 if GS.ki5 else len(scan.pads)
         nets_with_tp = {}
-        for p in pad_properties:
-            if p.fab_property == pcbnew.PAD_PROP_TESTPOINT:
-                self.testpoint_pads += 1
-                nets_with_tp[p.net] = nets_with_tp.get(p.net, [])+[p.name]
+        if not GS.ki5:
+            for p in scan.pads:
+                if p.fab_property == pcbnew.PAD_PROP_TESTPOINT:
+                    self.testpoint_pads += 1
+                    nets_with_tp.setdefault(p.net, []).append(p.ref+'.'+p.number)
         cnd = GS.board.GetConnectivity()
         self.total_nets = cnd.GetNetCount()
         self.nets_with_testpoint = len(nets_with_tp)
@@ -881,13 +830,11 @@ class ReportOptions(VariantOptions):
         self._nets_without_testpoint = [str(n) for n in nets.keys() if str(n) and str(n) not in nets_with_tp]
         self._nets_with_tp = nets_with_tp
 
-    def eval_conditional(self, line):
-        context = {k: getattr(self, k) for k in dir(self) if k[0] != '_' and not callable(getattr(self, k))}
+    def eval_conditional(self, text, code, context):
         res = None
-        text = line[2:].strip()
         logger.debug('- Evaluating `{}`'.format(text))
         try:
-            res = eval(text, {}, context)
+            res = eval(code, {}, context)
         except Exception as e:
             raise KiPlotConfigurationError('wrong conditional: `{}`\nPython says: `{}`'.format(text, str(e)))
         logger.debug('- Result `{}`'.format(res))
@@ -907,7 +854,6 @@ class ReportOptions(VariantOptions):
         return vars
 
     def do_template(self, template_file, output_file):
-        text = ''
         logger.debug("Report template: `{}`".format(template_file))
         # Collect the thing we could expand
         defined = {}
@@ -916,31 +862,29 @@ class ReportOptions(VariantOptions):
         defined.update(GS.load_pro_variables())
         defined.update(self.__dict__)
         with open(template_file, "rt") as f:
-            skip_next = False
-            for line in f:
-                if skip_next:
-                    skip_next = False
-                    continue
-                done = False
-                if line[0] == '#':
-                    if line.startswith('#?'):
-                        skip_next = not self.eval_conditional(line)
-                        done = True
-                        line = ''
-                    elif ':' in line:
-                        context = line[1:].split(':')[0]
-                        logger.debug("- Report context: `{}`".format(context))
-                        name = 'context_'+context
-                        if hasattr(self, name):
-                            # Contexts are members called context_*
-                            line = getattr(self, name)(line[len(context)+2:])
-                            done = True
-                        else:
-                            raise KiPlotConfigurationError("Unknown context: `{}`".format(context))
-                if not done:
-                    # Just replace using any data member (_* excluded)
-                    line = self.do_replacements(line, defined)
-                text += line
+            plan, self._line_plans = compile_template(f.read())
+        chunks = []
+        context = None
+        skip_next = False
+        for op, data, extra in plan:
+            if skip_next:
+                skip_next = False
+                continue
+            if op == OP_TEXT:
+                # Just replace using any data member (_* excluded)
+                chunks.append(self.render_line(data, defined))
+            elif op == OP_CONDITIONAL:
+                if context is None:
+                    context = {k: getattr(self, k) for k in dir(self) if k[0] != '_' and not callable(getattr(self, k))}
+                skip_next = not self.eval_conditional(data, extra, context)
+            else:
+                logger.debug("- Report context: `{}`".format(data))
+                # Contexts are members called context_*
+                method = getattr(self, 'context_'+data, None)
+                if method is None:
+                    raise KiPlotConfigurationError("Unknown context: `{}`".format(data))
+                chunks.append(method(extra))
+        text = ''.join(chunks)
         logger.debug("Report output: `{}`".format(output_file))
         if self.to_ascii:
             # PanDoc has problems with this Unicode
@@ -3,13 +3,16 @@
 # Copyright (c) 2020-2024 Instituto Nacional de Tecnología Industrial
 # License: AGPL-3.0
 # Project: KiBot (formerly KiPlot)
+from contextlib import contextmanager
+from hashlib import sha1
 import json
 import os
+from threading import Lock
 from . import __version__
 from .bom.kibot_logo import KIBOT_LOGO, KIBOT_LOGO_W, KIBOT_LOGO_H
 from .error import KiPlotConfigurationError
 from .gs import GS
-from .kicad.config import KiConf
+from .kicad.config import KiConf, FP_LIB_TABLE, SYM_LIB_TABLE
 from .kiplot import load_board, load_sch, run_command
 from .misc import (ERC_ERROR, DRC_ERROR, W_ERCJSON, W_DRCJSON, STYLE_COMMON, TABLE_MODERN, HEAD_COLOR_B, HEAD_COLOR_B_L,
                    TD_ERC_CLASSES, GENERATOR_CSS)
@@ -20,6 +23,30 @@ from .macros import macros, document  # noqa: F401
 from . import log
 logger = log.get_logger(__name__)
 UNITS_2_KICAD = {'millimeters': 'mm', 'inches': 'in', 'mils': 'mils'}
+report_lock = Lock()
+lang_lock = Lock()
+lang_users = 0
+lang_old = None
+
+
+@contextmanager
+def english_messages():
+    """ Force english messages for the KiCad CLI.
+        The DRC and ERC can run in parallel, so we restore LANG when the last one finishes """
+    global lang_users, lang_old
+    with lang_lock:
+        if not lang_users:
+            lang_old = os.environ.get('LANG')
+            if lang_old:
+                os.environ['LANG'] = 'en'
+        lang_users += 1
+    try:
+        yield
+    finally:
+        with lang_lock:
+            lang_users -= 1
+            if not lang_users and lang_old:
+                os.environ['LANG'] = lang_old
 
 
 class FilterOptionsXRC(FilterOptions):
@@ -65,6 +92,11 @@ class ERCOptions(FiltersOptions):
                 category is used.
                 Categories looks like file system paths, i.e. **PCB/fabrication/gerber**.
                 The categories are currently used for `navigate_results` """
+            self.cache_results = False
+            """ Reuse the results of a previous run when the design didn't change.
+                We check the design files, the project, the design rules, the library tables, the KiCad version
+                and the options. The filters are applied to the cached results.
+                Note that the content of the libraries isn't checked """
         super().__init__()
         self.filters = FilterOptionsXRC
         self.set_doc('filters', " [list(dict)=[]] Used to manipulate the violations. Avoid using the *filters* preflight")
@@ -271,13 +303,84 @@ class XRC(BasePreFlight):
         html += '</table>\n'
         return html
 
-    def run(self):
-        # Differences between ERC and DRC
+    def get_cache_files(self):
+        """ Files that can change the result of the check """
+        files = []
+        if GS.pro_file:
+            files.append(GS.pro_file)
+        if self._sch_related or getattr(self, '_schematic_parity', False):
+            load_sch()
+            files.extend(GS.sch.get_files())
+            tables = [SYM_LIB_TABLE]
+        else:
+            tables = []
+        if not self._sch_related:
+            files.append(GS.pcb_file)
+            files.append(os.path.splitext(GS.pro_file or GS.pcb_file)[0]+'.kicad_dru')
+            tables.append(FP_LIB_TABLE)
+        base_dir = os.path.dirname(files[0])
+        for table in tables:
+            files.append(os.path.join(base_dir, table))
+            if KiConf.config_dir:
+                files.append(os.path.join(KiConf.config_dir, table))
+        return files
+
+    def get_cache_key(self):
+        """ Hash of all the things that can change the result of the check """
+        h = sha1()
+        lang = 'en' if self._force_english else os.environ.get('LANG', '')
+        for arg in [GS.kicad_version, lang]+self.get_command(''):
+            h.update(arg.encode()+b'\0')
+        for fname in self.get_cache_files():
+            h.update(fname.encode()+b'\0')
+            if os.path.isfile(fname):
+                with open(fname, 'rb') as f:
+                    h.update(sha1(f.read()).digest())
+        return h.hexdigest()
+
+    def get_cached_results(self, key):
+        """ Returns the raw JSON report from a previous run, None if not available """
+        cache_dir = GS.get_cache_dir('xrc')
+        GS.prune_cache_dir(cache_dir)
+        fname = os.path.join(cache_dir, key+'.json')
+        if not os.path.isfile(fname):
+            return None
+        # Mark it as used
+        os.utime(fname)
+        with open(fname, 'rt') as f:
+            return f.read()
+
+    def save_cached_results(self, key, raw):
+        fname = os.path.join(GS.get_cache_dir('xrc'), key+'.json')
+        with open(fname+'.tmp', 'wt') as f:
+            f.write(raw)
+        os.replace(fname+'.tmp', fname)
+
+    def run_check(self, nm, output):
+        """ Runs the check and returns the raw JSON report """
+        # Run the xRC from the CLI
+        cmd = self.get_command(output)
+        logger.info(f'- Running the {nm}')
+        # Introduced in 8.0.4: translated messages
+        if self._force_english:
+            with english_messages():
+                run_command(cmd)
+        else:
+            run_command(cmd)
+        # Read the result
+        with open(output, 'rt') as f:
+            return f.read()
+
+    def apply(self):
+        # Done here, before running the preflights, because it can modify the KiCad configuration
         if GS.sch_file:
             # May be needed by DRC when checking parity?
             KiConf.check_sym_lib_table()
         if GS.pcb_file:
             KiConf.check_fp_lib_table()
+
+    def run(self):
+        # Differences between ERC and DRC
         if self._sch_related:
             nm = 'ERC'
             err = ERC_ERROR
@@ -296,24 +399,21 @@ class XRC(BasePreFlight):
         outputs = self.get_targets()
         output = outputs[0]
         os.makedirs(os.path.dirname(output), exist_ok=True)
-        # Run the xRC from the CLI
-        cmd = self.get_command(output)
-        logger.info(f'- Running the {nm}')
-        # Introduced in 8.0.4: translated messages
-        if self._force_english:
-            old_lang = os.environ.get('LANG')
-            if old_lang:
-                os.environ['LANG'] = 'en'
-        run_command(cmd)
-        if self._force_english and old_lang:
-            os.environ['LANG'] = old_lang
-        # Read the result
-        with open(output, 'rt') as f:
-            raw = f.read()
-            try:
-                data = json.loads(raw)
-            except json.decoder.JSONDecodeError:
-                raise KiPlotConfigurationError(f"Corrupted {nm} report `{output}`:\n{raw}")
+        raw = None
+        if self._cache_results:
+            key = self.get_cache_key()
+            raw = self.get_cached_results(key)
+            if raw is not None:
+                logger.info(f'- Using the cached {nm} results')
+        cached = raw is not None
+        if not cached:
+            raw = self.run_check(nm, output)
+        try:
+            data = json.loads(raw)
+        except json.decoder.JSONDecodeError:
+            raise KiPlotConfigurationError(f"Corrupted {nm} report `{output}`:\n{raw}")
+        if self._cache_results and not cached:
+            self.save_cached_results(key, raw)
         if data.get('$schema', '') != f'https://schemas.kicad.org/{nml}.v1.json':
             logger.warning(f'{wjson}Unknown JSON schema, {nm} might fail')
         self.units = data.get('coordinate_units', 'mm')
@@ -336,15 +436,17 @@ class XRC(BasePreFlight):
         if self._dont_stop and self.c_warn and log.stop_on_warnings:
             logger.error("Inconsistent options, asked to don't stop, but also to stop on warnings")
         # Report the result
-        revert_stop_on_warnings = False
-        if self.c_warn and log.stop_on_warnings:
-            revert_stop_on_warnings = True
-            log.stop_on_warnings = False
-        self.report('warning', self.c_warn, data)
-        if revert_stop_on_warnings:
-            log.stop_on_warnings = True
-            logger.check_warn_stop()
-        self.report('error', self.c_err, data)
+        # The DRC and ERC can run in parallel, so we must serialize the stop_on_warnings changes
+        with report_lock:
+            revert_stop_on_warnings = False
+            if self.c_warn and log.stop_on_warnings:
+                revert_stop_on_warnings = True
+                log.stop_on_warnings = False
+            self.report('warning', self.c_warn, data)
+            if revert_stop_on_warnings:
+                log.stop_on_warnings = True
+                logger.check_warn_stop()
+            self.report('error', self.c_err, data)
         # Check the final status
         error_level = -1 if self._dont_stop else err
         if self.c_err:
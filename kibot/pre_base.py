@@ -3,6 +3,7 @@
 # Copyright (c) 2020-2024 Instituto Nacional de Tecnología Industrial
 # License: AGPL-3.0
 # Project: KiBot (formerly KiPlot)
+from concurrent.futures import ThreadPoolExecutor
 import os
 from shutil import rmtree
 from .gs import GS
@@ -15,6 +16,14 @@ from .log import get_logger
 logger = get_logger(__name__)
 
 
+class PreFlightError(Exception):
+    """ Exception raised by a preflight running in parallel """
+    def __init__(self, name, error):
+        super().__init__(str(error))
+        self.name = name
+        self.error = error
+
+
 class BasePreFlight(Optionable, Registrable):
     _registered = {}
     _in_use = {}
@@ -32,6 +41,10 @@ class BasePreFlight(Optionable, Registrable):
         self._expand_ext = ''
         self._files_to_remove = []
         self._category = None
+        # What the preflight uses: sch, pcb, zones (zone fills) and files (other files in the project)
+        # Preflights that only read can run in parallel, None means it could modify anything
+        self._reads = set()
+        self._writes = None
         self.type = self.__class__.__name__.lower()
 
     # Compatibility with outputs for navigate_results
@@ -139,6 +152,54 @@ class BasePreFlight(Optionable, Registrable):
             GS.exit_with_error("In preflight `"+str(k)+"`: "+str(e), EXIT_BAD_CONFIG)
         BasePreFlight._configured = True
 
+    @staticmethod
+    def schedule(preflights):
+        """ Split the preflights in groups that can run in parallel, keeping the order.
+            Preflights that can modify anything (`_writes` is None) are alone in its group """
+        groups = []
+        cur = []
+        for k, v in preflights:
+            if v._writes is None or not GS.global_parallel_preflights:
+                if cur:
+                    groups.append(cur)
+                    cur = []
+                groups.append([(k, v)])
+            else:
+                if any(v.conflicts_with(o) for _, o in cur):
+                    groups.append(cur)
+                    cur = []
+                cur.append((k, v))
+        if cur:
+            groups.append(cur)
+        return groups
+
+    @staticmethod
+    def run_group(group):
+        """ Run a group of preflights that doesn't interfere """
+        workers = min(GS.get_workers(), len(group))
+        if workers < 2:
+            for k, v in group:
+                logger.debug('Preflight run '+k)
+                try:
+                    v.run()
+                except (PlotError, KiPlotConfigurationError) as e:
+                    raise PreFlightError(k, e)
+            return
+        # The checks are done by child processes (KiCad, KiAuto), so threads are enough
+        logger.debug('Preflights run in parallel: '+', '.join(k for k, _ in group))
+        # The project must be loaded before starting
+        if any(v.is_sch() for _, v in group):
+            GS.load_sch()
+        if any(v.is_pcb() for _, v in group):
+            GS.load_board()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            jobs = [(k, pool.submit(v.run)) for k, v in group]
+        # Report the errors in the same order used for the serial run
+        for k, job in jobs:
+            e = job.exception()
+            if e is not None:
+                raise PreFlightError(k, e)
+
     @staticmethod
     def run_enabled(targets):
         BasePreFlight._targets = targets
@@ -151,15 +212,23 @@ class BasePreFlight(Optionable, Registrable):
                         GS.check_pcb()
                     logger.debug('Preflight apply '+k)
                     v.apply()
-            for k, v in BasePreFlight._in_use.items():
-                if v._enabled:
-                    logger.debug('Preflight run '+k)
-                    v.run()
+            enabled = [(k, v) for k, v in BasePreFlight._in_use.items() if v._enabled]
+            for group in BasePreFlight.schedule(enabled):
+                k = group[0][0]
+                try:
+                    BasePreFlight.run_group(group)
+                except PreFlightError as e:
+                    k = e.name
+                    raise e.error
         except PlotError as e:
             GS.exit_with_error("In preflight `"+str(k)+"`: "+str(e), PLOT_ERROR)
         except KiPlotConfigurationError as e:
             GS.exit_with_error("In preflight `"+str(k)+"`: "+str(e), EXIT_BAD_CONFIG)
 
+    def conflicts_with(self, other):
+        """ True if this preflight and `other` can't run at the same time """
+        return bool(self._writes & (other._reads | other._writes) or other._writes & (self._reads | self._writes))
+
     def disable(self):
         self._enabled = False
 
@@ -28,6 +28,9 @@ class DRC(XRC):  # noqa: F821
     def __init__(self):
         super().__init__(DRCOptions)
         self._pcb_related = True
+        # Only reads the project, can run in parallel with other checks
+        self._reads = {'pcb', 'zones', 'sch', 'files'}
+        self._writes = set()
         self._expand_id = 'drc'
         self._category = 'PCB/docs'
         with document:
@@ -23,6 +23,9 @@ class ERC(XRC):  # noqa: F821
     def __init__(self):
         super().__init__(ERCOptions)
         self._sch_related = True
+        # Only reads the project, can run in parallel with other checks
+        self._reads = {'sch', 'files'}
+        self._writes = set()
         self._expand_id = 'erc'
         self._category = 'Schematic/docs'
         with document:
@@ -50,6 +50,8 @@ class Run_DRC(BasePreFlight):  # noqa: F821
     def __init__(self):
         super().__init__()
         self._pcb_related = True
+        # KiAuto runs the KiCad GUI, two instances would share the KiCad configuration
+        self._writes = None
         self._expand_id = 'drc'
         self._expand_ext = 'txt'
         with document:
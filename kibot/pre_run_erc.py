@@ -46,6 +46,8 @@ class Run_ERC(BasePreFlight):  # noqa: F821
     def __init__(self):
         super().__init__()
         self._sch_related = True
+        # KiAuto runs the KiCad GUI, two instances would share the KiCad configuration
+        self._writes = None
         self._expand_id = 'erc'
         self._expand_ext = 'txt'
         with document:
@@ -107,6 +107,7 @@ class Set_Text_Variables(BasePreFlight):  # noqa: F821
         data = json.loads(pro_text)
         text_variables = data.get('text_variables', {})
         GS.pro_variables = text_variables
+        GS.text_variables_changed()
         logger.debug("- Current variables: {}".format(text_variables))
         # Define the requested variables
         if GS.pcb_file:
@@ -139,6 +140,7 @@ class Set_Text_Variables(BasePreFlight):  # noqa: F821
             text = r.before + text + r.after
             logger.debug('  - ' + r.name + ' -> ' + text)
             text_variables[r.name] = text
+            GS.text_variables_changed()
         logger.debug("- Expanding %X patterns in variables")
         # Now that we have the variables defined expand the %X patterns (they could use variables)
         for r in o:
@@ -148,6 +150,7 @@ class Set_Text_Variables(BasePreFlight):  # noqa: F821
                 if text != new_text:
                     logger.debug('  - ' + r.name + ' -> ' + new_text)
                     text_variables[r.name] = new_text
+                    GS.text_variables_changed()
         logger.debug("- New list of variables: {}".format(text_variables))
         # Store the modified project
         data['text_variables'] = text_variables
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024 Salvador E. Tropea
+# Copyright (c) 2024 Instituto Nacional de Tecnología Industrial
+# License: AGPL-3.0
+# Project: KiBot (formerly KiPlot)
+"""
+Persistent cache for the loaded schematics.
+Enabled using the `cache_schematics` global option.
+
+Each entry is a pickle containing a header, used to validate the entry, and the loaded schematic.
+The header contains the hash of every file used to load the schematic (sheets, lib tables, project and, for KiCad 5,
+the libraries) and the things that can change the result (KiBot, KiCad and Python versions, date formats).
+For KiCad 5 the header also contains where the libraries were found, the lib tables use environment variables.
+If anything changed, or the entry can't be read, we just load the schematic again.
+The title blocks are expanded again after loading an entry, the text variables and empty dates depend on the
+environment, the project and the time of the files, not only on their content.
+Schematics that generated warnings are not cached, so the warnings are always reported.
+"""
+from hashlib import sha1
+import os
+import pickle
+import platform
+import sys
+from . import __version__
+from .gs import GS
+from .kicad.config import KiConf
+from .kicad import v6_sch
+from . import log
+
+logger = log.get_logger()
+# Increment it when the format of the entries changes
+CACHE_VERSION = 2
+LIB_TABLE = 'sym-lib-table'
+
+
+def file_hash(fname):
+    try:
+        with open(fname, 'rb') as f:
+            return sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def environment():
+    """ Things that can change the loaded schematic, other than the files """
+    return (CACHE_VERSION, __version__, GS.kicad_version, platform.python_version(), GS.global_date_format,
+            GS.global_date_time_format, GS.global_time_reformat)
+
+
+def lib_uris(file, sch):
+    """ KiCad 5: the file used for each library, according to the current lib tables and environment """
+    if file.endswith('.kicad_sch'):
+        return None
+    aliases = KiConf.get_sym_lib_aliases(file)
+    return sorted((k, aliases[k].uri if k and k in aliases else None) for k in sch.libs.keys())
+
+
+def entry_name(file, project):
+    key = sha1((os.path.abspath(file)+'\0'+str(project)).encode()).hexdigest()
+    return os.path.join(GS.get_cache_dir('schematics'), key+'.pickle')
+
+
+def related_files(file, sch):
+    """ All the files used to load the schematic, including the ones that doesn't exist, but could change the result """
+    files = set(os.path.abspath(f) for f in sch.get_files())
+    base = os.path.splitext(file)[0]
+    files.update(os.path.abspath(base+ext) for ext in ('.kicad_pro', '.pro'))
+    files.add(os.path.join(os.path.dirname(os.path.abspath(file)), LIB_TABLE))
+    if KiConf.config_dir:
+        files.add(os.path.join(KiConf.config_dir, LIB_TABLE))
+    if not file.endswith('.kicad_sch'):
+        # KiCad 5: the libraries and descriptions are part of the loaded schematic
+        for lib in sch.libs.values():
+            if lib:
+                files.add(os.path.abspath(lib))
+                files.add(os.path.abspath(os.path.splitext(lib)[0]+'.dcm'))
+        files.add(os.path.abspath(file.replace('.sch', '-cache.lib')))
+    return sorted(files)
+
+
+def load_cached(file, project):
+    """ The schematic loaded by a previous run, None if not available or if something changed """
+    name = entry_name(file, project)
+    if not os.path.isfile(name):
+        return None
+    try:
+        with open(name, 'rb') as f:
+            header = pickle.load(f)
+            if header['env'] != environment():
+                logger.debug('Schematic cache: different environment for `{}`'.format(file))
+                return None
+            for fname, hash in header['files']:
+                if file_hash(fname) != hash:
+                    logger.debug('Schematic cache: `{}` changed'.format(fname))
+                    return None
+            sch = pickle.load(f)
+        if header['libs'] != lib_uris(file, sch):
+            logger.debug('Schematic cache: different libraries for `{}`'.format(file))
+            return None
+    except Exception as e:
+        # Corrupted, incomplete or from an incompatible version
+        logger.debug('Schematic cache: discarding `{}` ({})'.format(name, e))
+        return None
+    # Restore the global state changed by the parser
+    if header['v6_version'] is not None:
+        v6_sch.version = header['v6_version']
+        v6_sch.UUID_Validator.known_UUIDs = header['uuids']
+    sch.expand_title_blocks()
+    # Mark it as used
+    os.utime(name)
+    logger.debug('Schematic cache: using the loaded `{}`'.format(file))
+    return sch
+
+
+def save_cached(file, project, sch):
+    cache_dir = GS.get_cache_dir('schematics')
+    GS.prune_cache_dir(cache_dir)
+    name = entry_name(file, project)
+    is_v6 = file.endswith('.kicad_sch')
+    header = {'env': environment(),
+              'files': [(f, file_hash(f)) for f in related_files(file, sch)],
+              'libs': lib_uris(file, sch),
+              'v6_version': v6_sch.version if is_v6 else None,
+              'uuids': v6_sch.UUID_Validator.known_UUIDs if is_v6 else None}
+    old_limit = sys.getrecursionlimit()
+    try:
+        # The object graph is deep
+        sys.setrecursionlimit(max(old_limit, 20000))
+        with open(name+'.tmp', 'wb') as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(sch, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(name+'.tmp', name)
+        logger.debug('Schematic cache: stored `{}`'.format(file))
+    except (OSError, pickle.PicklingError, TypeError, AttributeError, RecursionError) as e:
+        logger.debug('Schematic cache: failed to store `{}` ({})'.format(file, e))
+        if os.path.isfile(name+'.tmp'):
+            os.remove(name+'.tmp')
+    finally:
+        sys.setrecursionlimit(old_limit)
@@ -4,9 +4,13 @@
 # License: AGPL-3.0
 # Project: KiBot (formerly KiPlot)
 # Note: the algorithm used to detect the PCB outline is adapted from KiKit project.
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
 from itertools import chain
 import os
-from tempfile import TemporaryDirectory
+from shutil import copy2, rmtree
+from tempfile import mkdtemp, TemporaryDirectory
 from .registrable import RegVariant
 from .optionable import Optionable, PanelOptions
 from .fil_base import apply_exclude_filter, apply_fitted_filter, apply_fixed_filter, apply_pre_transform
@@ -14,11 +18,36 @@ from .error import KiPlotConfigurationError
 from .misc import KIKIT_UNIT_ALIASES
 from .gs import GS
 from .kiplot import run_command
+from .dep_downloader import binary_tools_cache
 from .kicad.pcb import PCB
 from .macros import macros, document  # noqa: F401
 from . import log
 
 logger = log.get_logger()
+# Sub-PCBs separated by KiKit during this run: cache key -> separated PCB file
+separated_boards = {}
+# Hash for the PCB files: (name, mtime, size) -> sha1
+boards_hash = {}
+separate_cache = None
+
+
+def remove_separate_cache():
+    if separate_cache is not None:
+        rmtree(separate_cache, ignore_errors=True)
+
+
+def get_separate_cache():
+    """ Directory where we store the separated PCBs, old entries are removed the first time.
+        When `cache_sub_pcbs` is disabled we use a temporal directory, only for this run """
+    global separate_cache
+    if separate_cache is None:
+        if GS.global_cache_sub_pcbs:
+            separate_cache = GS.get_cache_dir('sub_pcbs')
+            GS.prune_cache_dir(separate_cache)
+        else:
+            separate_cache = GS.mkdtemp('sub_pcbs')
+            atexit.register(remove_separate_cache)
+    return separate_cache
 
 
 def round_point(point, precision=-4):
@@ -139,39 +168,104 @@ class SubPCBOptions(PanelOptions):
             src += "; tolerance: {}".format(self.tolerance)
         return src
 
+    def get_separate_cmd(self, command, dest):
+        cmd = [command, 'separate', '--preserveArcs', '-s', self.get_separate_source()]
+        if self.strip_annotation:
+            cmd.append('--stripAnnotations')
+        cmd.extend([GS.pcb_file, dest])
+        return cmd
+
+    def get_cache_key(self, command):
+        """ Key used to cache the separated board.
+            Computed from the PCB content, the KiKit options and the tools """
+        st = os.stat(GS.pcb_file)
+        pcb_id = (GS.pcb_file, st.st_mtime_ns, st.st_size)
+        pcb_hash = boards_hash.get(pcb_id)
+        if pcb_hash is None:
+            with open(GS.pcb_file, 'rb') as f:
+                pcb_hash = sha1(f.read()).hexdigest()
+            boards_hash[pcb_id] = pcb_hash
+        # The version of the tool we found, so upgrading KiKit discards the old results
+        data = [pcb_hash, self.get_separate_source(), str(self.strip_annotation), GS.kicad_version, command,
+                str(binary_tools_cache.get(command))]
+        return sha1('\n'.join(data).encode()).hexdigest()
+
+    def do_separate(self, command, key):
+        """ Separate the sub-PCB using KiKit, the result is stored in the disk cache.
+            Returns the name of the separated PCB. Can be called from various threads """
+        cache = get_separate_cache()
+        dest_dir = os.path.join(cache, key)
+        dest = os.path.join(dest_dir, os.path.basename(GS.pcb_file))
+        if os.path.isfile(dest):
+            logger.debug('Using cached separation for the `{}` sub-PCB ({})'.format(self.name, key))
+            # Mark it as used
+            os.utime(dest_dir)
+            return dest
+        tmp_dir = mkdtemp(prefix='tmp-', dir=cache)
+        try:
+            run_command(self.get_separate_cmd(command, os.path.join(tmp_dir, os.path.basename(GS.pcb_file))))
+            try:
+                os.rename(tmp_dir, dest_dir)
+            except OSError:
+                # Another KiBot instance stored it first
+                pass
+        finally:
+            rmtree(tmp_dir, ignore_errors=True)
+        return dest
+
+    def separate_all(self, command):
+        """ Separate all the sub-PCBs of the variant that use KiKit, in parallel.
+            The results are cached, so they are available when the other sub-PCBs are applied """
+        sub_pcbs = getattr(self._parent, 'sub_pcbs', None) or [self]
+        jobs = {}
+        for sp in chain([self], sub_pcbs):
+            if sp.tool == 'kikit':
+                key = sp.get_cache_key(command)
+                if key not in separated_boards:
+                    jobs[key] = sp
+        # Make sure the cache is ready before starting the threads
+        get_separate_cache()
+        workers = min(GS.get_workers(), len(jobs))
+        logger.debug('Separating {} sub-PCBs using {} workers'.format(len(jobs), workers))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                res = list(pool.map(lambda job: job[1].do_separate(command, job[0]), jobs.items()))
+        else:
+            res = [sp.do_separate(command, key) for key, sp in jobs.items()]
+        separated_boards.update(zip(jobs.keys(), res))
+
     def separate_board(self, comps_hash):
         """ Apply the sub-PCB using an external tool and load it into memory """
         # Make sure kikit is available
         command = GS.ensure_tool('global', 'KiKit')
+        key = self.get_cache_key(command)
+        dest = separated_boards.get(key)
+        if dest is None or not os.path.isfile(dest):
+            self.separate_all(command)
+            dest = separated_boards[key]
+        if comps_hash:
+            # Memorize the used modules
+            old_modules = {m.GetReference() for m in GS.get_modules()}
+        # Load this board, from a copy: loading can modify the file and other KiBot instances can be using the cache
         with TemporaryDirectory(prefix='kibot-separate') as d:
-            dest = os.path.join(d, os.path.basename(GS.pcb_file))
-            if comps_hash:
-                # Memorize the used modules
-                old_modules = {m.GetReference() for m in GS.get_modules()}
-            # Now do the separation
-            cmd = [command, 'separate', '--preserveArcs', '-s', self.get_separate_source()]
-            if self.strip_annotation:
-                cmd.append('--stripAnnotations')
-            cmd.extend([GS.pcb_file, dest])
-            # Execute the separate
-            run_command(cmd)
-            # Load this board
-            GS.load_board(dest, forced=True)
-            # Now reflect the changes in the list of components
-            if comps_hash:
-                logger.debug('Removing components outside the sub-PCB')
-                # Memorize the used modules
-                new_modules = {m.GetReference() for m in GS.get_modules()}
-                # Compute the modules we removed
-                diff = old_modules - new_modules
-                logger.debugl(3, diff)
-                # Exclude them from _comps
-                for c in diff:
-                    cmp = comps_hash[c]
-                    if cmp.included:
-                        cmp.included = False
-                        self._excl_by_sub_pcb.add(c)
-                        logger.debugl(2, '- Removing '+c)
+            board = os.path.join(d, os.path.basename(dest))
+            copy2(dest, board)
+            GS.load_board(board, forced=True)
+        # Now reflect the changes in the list of components
+        if comps_hash:
+            logger.debug('Removing components outside the sub-PCB')
+            # Memorize the used modules
+            new_modules = {m.GetReference() for m in GS.get_modules()}
+            # Compute the modules we removed
+            diff = old_modules - new_modules
+            logger.debugl(3, diff)
+            # Exclude them from _comps
+            for c in diff:
+                cmp = comps_hash[c]
+                if cmp.included:
+                    cmp.included = False
+                    self._excl_by_sub_pcb.add(c)
+                    logger.debugl(2, '- Removing '+c)
 
     def _remove_items(self, iter):
         """ Remove items outside the rectangle.
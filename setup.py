@@ -19,7 +19,8 @@ setup(name='kibot',
       # Packages are marked using __init__.py
       packages=find_packages(),
       scripts=['src/kibot-check'],
-      entry_points={'console_scripts': ['kibot=kibot.__main__:main', 'kiplot=kibot.__main__:main']},
+      entry_points={'console_scripts': ['kibot=kibot.__main__:main', 'kiplot=kibot.__main__:main',
+                                        'kibot-client=kibot.daemon:client_main']},
       install_requires=__pypi_deps__,
       include_package_data=True,
       classifiers=['Development Status :: 5 - Production/Stable',
@@ -171,6 +171,19 @@ def test_gerber_protel_1(test_dir):
     ctx.clean_up()
 
 
+def test_gerber_workers_1(test_dir):
+    """ Layers plotted using 4 processes """
+    prj = 'good-project'
+    ctx = context.TestContext(test_dir, prj, 'gerber_workers_1', GERBER_DIR)
+    ctx.run(extra_debug=True)
+    exts = ALL_EXTS+INNER_EXTS
+    for n, suf in enumerate(ALL_LAYERS+INNER_LAYERS):
+        ctx.expect_out_file_d(prj+'_'+suf+'.'+exts[n])
+    ctx.expect_out_file_d('test-'+prj+'.gbrjob')
+    ctx.search_err('using 4 processes')
+    ctx.clean_up()
+
+
 def test_gerber_protel_2(test_dir):
     prj = 'good-project'
     ctx = context.TestContext(test_dir, prj, 'gerber_inner_protel_2', GERBER_DIR)
@@ -111,3 +111,16 @@ def test_ibom_variant_1(test_dir):
     logging.debug("* `bla bla` variant")
     check_modules(ctx, prj+'-ibom_bla_bla.html', ['R4'])
     ctx.clean_up()
+
+
+@pytest.mark.slow
+def test_ibom_variant_shared_netlist(test_dir):
+    """ Two outputs using the same variant share the netlist """
+    prj = 'kibom-variante'
+    ctx = context.TestContext(test_dir, prj, 'ibom_variant_shared', BOM_DIR)
+    ctx.run(extra_debug=True)
+    check_modules(ctx, prj+'-ibom_(V1).html', ['R1', 'R2'])
+    check_modules(ctx, os.path.join('dark', prj+'-ibom_(V1).html'), ['R1', 'R2'])
+    ctx.search_err(r'Creating variant netlist')
+    ctx.search_err(r'Using the already created variant netlist')
+    ctx.clean_up()
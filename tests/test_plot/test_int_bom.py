@@ -288,6 +288,59 @@ def test_int_bom_simple_csv(test_dir):
     ctx.clean_up()
 
 
+@pytest.mark.skipif(not context.ki5(), reason="KiCad 5 libraries")
+def test_int_bom_lib_index(test_dir, monkeypatch):
+    """ The second run loads the libraries using the index created by the first run """
+    prj = 'test_v5'
+    ctx = context.TestContextSCH(test_dir, prj, 'int_bom_simple_csv', BOM_DIR)
+    out = ctx.get_out_path(os.path.join(BOM_DIR, prj+'-bom.csv'))
+    monkeypatch.setenv('KIBOT_CACHE_DIR', ctx.get_out_path('cache'))
+    ctx.run()
+    ctx.search_err(r'Loading library `.*l1.lib`$')
+    ctx.search_err(r'Loading doc-lib `.*l1.dcm`$')
+    with open(out, 'rt') as f:
+        first = f.read()
+    ctx.run()
+    ctx.search_err(r'Loading library `.*l1.lib` using its index')
+    ctx.search_err(r'Loading doc-lib `.*l1.dcm` using its index')
+    with open(out, 'rt') as f:
+        assert f.read() == first
+    ctx.clean_up()
+
+
+def test_int_bom_sch_cache(test_dir, monkeypatch):
+    """ The second run uses the schematic cached by the first run """
+    prj = 'kibom-test'
+    ctx = context.TestContextSCH(test_dir, prj, 'int_bom_sch_cache', BOM_DIR)
+    out = prj+'-bom.csv'
+    monkeypatch.setenv('KIBOT_CACHE_DIR', ctx.get_out_path('cache'))
+    ctx.run()
+    ctx.search_err(r'Schematic cache: stored')
+    rows, header, info = ctx.load_csv(out)
+    ctx.run()
+    ctx.search_err(r'Schematic cache: using the loaded')
+    assert ctx.load_csv(out) == (rows, header, info)
+    kibom_verif(rows, header)
+    ctx.clean_up()
+
+
+@pytest.mark.skipif(context.ki5(), reason="KiCad 6 text vars")
+def test_int_bom_sch_cache_var(test_dir, monkeypatch):
+    """ The title block of a cached schematic is expanded again, the text variables come from the environment """
+    prj = 'test_vars'
+    ctx = context.TestContextSCH(test_dir, prj, 'int_bom_sch_cache_var', '')
+    monkeypatch.setenv('KIBOT_CACHE_DIR', ctx.get_out_path('cache'))
+    monkeypatch.setenv('git_hash', 'first')
+    ctx.run()
+    ctx.search_err(r'Schematic cache: stored')
+    ctx.expect_out_file(prj+'-bom_first.csv')
+    monkeypatch.setenv('git_hash', 'second')
+    ctx.run()
+    ctx.search_err(r'Schematic cache: using the loaded')
+    ctx.expect_out_file(prj+'-bom_second.csv')
+    ctx.clean_up(keep_project=True)
+
+
 def test_int_bom_simple_hrtxt(test_dir):
     ctx, out = kibom_setup(test_dir, 'int_bom_simple_hrtxt', ext='txt')
     ctx.expect_out_file(out, sub=True)
@@ -1184,6 +1237,13 @@ def test_int_bom_simple_xlsx_a(test_dir):
     simple_xlsx_verify(ctx, prj, False)
 
 
+def test_int_bom_simple_xlsx_stream(test_dir):
+    """ Constant memory mode """
+    prj = 'kibom-test'
+    ctx = context.TestContextSCH(test_dir, prj, 'int_bom_simple_xlsx_stream', BOM_DIR)
+    simple_xlsx_verify(ctx, prj, extra_info=['Extra 1: '+prj, 'Extra 2: 2020-03-12'])
+
+
 def test_int_bom_simple_xlsx_colored_rows(test_dir):
     """ Colored rows """
     prj = 'kibom-test'
@@ -169,3 +169,27 @@ def test_config_redirect(monkeypatch):
         res = check_load_conf(dir='config_redirect')
     assert 'Reading KiCad config from `tests/data/config_redirect/' in res, res
     assert 'Redirecting symbols lib table to /usr/share/kicad/template' in res, res
+
+
+def test_kicad_conf_lib_table_cache(tmp_path, monkeypatch):
+    """ The parsed lib tables are kept in memory and on disk, changes are detected using the hash """
+    table = str(tmp_path / 'sym-lib-table')
+    with open('tests/data/kicad_err_2/sym-lib-table', 'rt') as f:
+        content = f.read()
+    with open(table, 'wt') as f:
+        f.write(content)
+    with monkeypatch.context() as m:
+        m.setenv('KIBOT_CACHE_DIR', str(tmp_path / 'cache'))
+        with context.cover_it(cov):
+            first = KiConf.load_lib_table(table)
+            assert os.listdir(str(tmp_path / 'cache' / 'lib_tables'))
+            # From disk
+            KiConf.lib_tables = {}
+            assert KiConf.load_lib_table(table) == first
+            assert any('Unknown lib table entry' in w for w in first['warnings'])
+            # Changed
+            with open(table, 'wt') as f:
+                f.write(content.replace('(name l2)', '(name l2_new)'))
+            changed = KiConf.load_lib_table(table)
+            assert changed['hash'] != first['hash']
+            assert any(e['name'] == 'l2_new' for e in changed['entries'])
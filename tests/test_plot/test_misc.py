@@ -31,13 +31,15 @@ from glob import glob
 import os
 import re
 import shutil
+import signal
 import logging
 import pytest
 import subprocess
 import json
+import time
 from . import context
 from kibot.misc import (EXIT_BAD_ARGS, EXIT_BAD_CONFIG, NO_PCB_FILE, NO_SCH_FILE, EXAMPLE_CFG, WONT_OVERWRITE, CORRUPTED_PCB,
-                        PCBDRAW_ERR, NO_PCBNEW_MODULE, NO_YAML_MODULE, INTERNAL_ERROR, MISSING_FILES)
+                        PCBDRAW_ERR, NO_PCBNEW_MODULE, NO_YAML_MODULE, INTERNAL_ERROR, MISSING_FILES, WRONG_ARGUMENTS)
 
 
 POS_DIR = 'positiondir'
@@ -1164,6 +1166,8 @@ def test_report_simple_1(test_dir):
     ctx.expect_out_file(prj+'-report_simple.txt')
     ctx.compare_txt(prj+'-report.txt')
     ctx.compare_txt(prj+'-report_simple.txt')
+    # Both reports use the same board scan
+    assert ctx.err.count('Scanning the board primitives') == 1
     ctx.clean_up(keep_project=True)
 
 
@@ -1496,6 +1500,27 @@ def test_diff_git_1(test_dir):
     ctx.clean_up(keep_project=True)
 
 
+def test_diff_git_cache_1(test_dir, monkeypatch):
+    """ Difference between the current PCB and the git HEAD, the second run uses the render cache """
+    prj = 'light_control'
+    yaml = 'diff_git_cache_1'
+    ctx = context.TestContext(test_dir, prj, yaml)
+    git_init(ctx)
+    pcb = prj+'.kicad_pcb'
+    file = ctx.get_out_path(pcb)
+    shutil.copy2(ctx.board_file, file)
+    ctx.run_command(['git', 'add', pcb], chdir_out=True)
+    ctx.run_command(['git', 'commit', '-m', 'Reference'], chdir_out=True)
+    shutil.copy2(ctx.board_file.replace(prj, prj+'_diff'), file)
+    monkeypatch.setenv('KIBOT_CACHE_DIR', ctx.get_out_path('cache'))
+    ctx.run(extra=['-b', file], no_board_file=True)
+    ctx.search_err(r'Render cache: 0 hit/s, 2 miss/es')
+    ctx.run(extra=['-b', file], no_board_file=True)
+    ctx.search_err(r'Render cache: 2 hit/s, 0 miss/es')
+    ctx.compare_pdf(prj+'-diff_pcb.pdf', off_y=OFFSET_Y, tol=DIFF_TOL)
+    ctx.clean_up(keep_project=True)
+
+
 def test_diff_kiri_1(test_dir):
     """ Difference between the current PCB and the git HEAD """
     prj = 'light_control'
@@ -1585,10 +1610,9 @@ def test_diff_git_2(test_dir):
     ctx.clean_up(keep_project=True)
 
 
-def test_diff_git_3(test_dir):
+def test_diff_git_3(test_dir, yaml='diff_git_3'):
     """ Difference between the two repo points, no changes to stash """
     prj = 'light_control'
-    yaml = 'diff_git_3'
     ctx = context.TestContext(test_dir, prj, yaml)
     # Create a git repo
     git_init(ctx)
@@ -1618,6 +1642,11 @@ def test_diff_git_3(test_dir):
     ctx.clean_up(keep_project=True)
 
 
+def test_diff_git_worktree_1(test_dir):
+    """ Difference between the two repo points, using a worktree instead of the git objects """
+    test_diff_git_3(test_dir, 'diff_git_worktree_1')
+
+
 @pytest.mark.slow
 @pytest.mark.eeschema
 def test_diff_git_4(test_dir):
@@ -1943,6 +1972,24 @@ def test_populate_1(test_dir):
     ctx.clean_up()
 
 
+@pytest.mark.slow
+@pytest.mark.skipif(not context.ki7(), reason="Just testing with 7")
+def test_populate_reuse_plot(test_dir):
+    """ The steps composed from one plot (converted in parallel) are the same we get plotting each step """
+    prj = 'simple_2layer'  # Fake
+    ctx = context.TestContext(test_dir, prj, 'populate_reuse', '')
+    ctx.run(no_board_file=True, extra=['-b', 'tests/data/ArduinoLearningKitStarter.kicad_pcb'])
+    ctx.search_err('Composing 5 steps from a base plot')
+    for n in range(1, 6):
+        img = 'img/populating_{}.png'.format(n)
+        ctx.compare_image(os.path.join('Populate', img), os.path.join('PopulateNoReuse', img), ref_out_dir=True, tol=100)
+    with open(ctx.get_out_path(os.path.join('Populate', 'index.html')), 'rt') as f:
+        reuse = f.read()
+    with open(ctx.get_out_path(os.path.join('PopulateNoReuse', 'index.html')), 'rt') as f:
+        assert f.read() == reuse
+    ctx.clean_up()
+
+
 @pytest.mark.slow
 @pytest.mark.skipif(not context.ki7(), reason="Just testing with 7")
 def test_populate_2(test_dir):
@@ -1955,6 +2002,24 @@ def test_populate_2(test_dir):
     ctx.clean_up()
 
 
+def test_navigate_results_cache(test_dir):
+    """ The images created by a previous run are reused, only the changed one is created again """
+    prj = 'bom'
+    ctx = context.TestContext(test_dir, prj, 'navigate_results_cache', '')
+    ctx.run()
+    ctx.search_err('Creating 2 images using 2 workers')
+    ctx.search_err(r'Using cached .*_Cu\.png', invert=True)
+    # Change the bottom output
+    bottom = ctx.get_out_path(os.path.join('Bottom', prj+'-B_Cu.svg'))
+    with open(bottom, 'at') as f:
+        f.write('<!-- Changed -->\n')
+    ctx.run(extra=['navigate'])
+    ctx.search_err(r'Using cached .*F_Cu\.png')
+    ctx.search_err(r'Using cached .*B_Cu\.png', invert=True)
+    ctx.search_err('Creating 1 images using 1 workers')
+    ctx.clean_up()
+
+
 @pytest.mark.slow
 @pytest.mark.skipif(not context.ki7(), reason="Just testing with 7")
 def test_present_1(test_dir):
@@ -2060,3 +2125,119 @@ def test_report_variant_t1(test_dir):
     ctx.search_in_file(prj+'-report.txt', [r'|\s+Total\s+|\s+40\s+|\s+52'])
     ctx.search_in_file(prj+'-report_(V1).txt', [r'|\s+Total\s+|\s+4\s+|\s+5\.'])
     ctx.clean_up()
+
+
+def start_daemon(ctx, extra=[]):
+    """ Start a daemon using a socket in the output dir, returns the daemon, the client command and the daemon log """
+    src = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+    sock = ctx.get_out_path('kibot.sock')
+    err = ctx.get_out_path('daemon.txt')
+    with open(err, 'wt') as f:
+        daemon = subprocess.Popen([os.path.join(src, 'kibot'), '-v']+extra+['--daemon', '--socket', sock], stderr=f)
+    for _ in range(100):
+        if os.path.exists(sock):
+            break
+        time.sleep(0.1)
+    return daemon, [os.path.join(src, 'kibot-client'), '--socket', sock, '-v'], err
+
+
+def test_daemon_1(test_dir):
+    """ Two jobs sent to the daemon, the second uses the board loaded by the daemon """
+    prj = '3Rs'
+    ctx = context.TestContext(test_dir, prj, 'simple_position_csv', POS_DIR)
+    daemon, cmd, err = start_daemon(ctx)
+    sock = cmd[2]
+    try:
+        cmd += ['-b', ctx.board_file, '-c', ctx.yaml_file, '-d', ctx.output_dir]
+        pos_top = ctx.get_out_path(ctx.get_pos_top_csv_filename())
+        for _ in range(2):
+            if os.path.isfile(pos_top):
+                os.remove(pos_top)
+            res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            logging.debug(res.stdout.decode())
+            assert res.returncode == 0
+            ctx.expect_out_file(ctx.get_pos_top_csv_filename())
+        # The errors must be reported using the exit code
+        assert subprocess.run(cmd+['wrong_output']).returncode == WRONG_ARGUMENTS
+    finally:
+        daemon.send_signal(signal.SIGINT)
+        daemon.wait(10)
+    with open(err, 'rt') as f:
+        log = f.read()
+    assert 'Daemon: loading `{}`'.format(ctx.board_file) in log
+    assert not os.path.exists(sock)
+    ctx.clean_up()
+
+
+@pytest.mark.skipif(context.ki5(), reason="KiCad 6 text vars")
+def test_daemon_text_var(test_dir):
+    """ The text variables of the schematic are expanded using the environment of each job """
+    prj = 'test_vars'
+    ctx = context.TestContextSCH(test_dir, prj, 'daemon_text_var', '')
+    daemon, cmd, err = start_daemon(ctx)
+    try:
+        cmd += ['-e', ctx.sch_file, '-c', ctx.yaml_file, '-d', ctx.output_dir]
+        for hash in ('first', 'second'):
+            env = dict(os.environ)
+            env['git_hash'] = hash
+            res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+            out = res.stdout.decode()
+            logging.debug(out)
+            assert res.returncode == 0
+            assert 'Unknown text variable' not in out
+            ctx.expect_out_file(prj+'-bom_'+hash+'.csv')
+    finally:
+        daemon.send_signal(signal.SIGINT)
+        daemon.wait(10)
+    with open(err, 'rt') as f:
+        log = f.read()
+    # The daemon doesn't load schematics
+    assert 'Unknown text variable' not in log
+    ctx.clean_up(keep_project=True)
+
+
+def wait_for_file(fname, text=None, timeout=30):
+    for _ in range(timeout*10):
+        if os.path.isfile(fname):
+            if text is None:
+                return True
+            with open(fname, 'rt') as f:
+                if text in f.read():
+                    return True
+        time.sleep(0.1)
+    return False
+
+
+@pytest.mark.skipif(context.ki5(), reason="KiCad 6 text vars")
+def test_daemon_interrupt(test_dir):
+    """ Interrupting the client interrupts the job.
+        The daemon's log file only has the messages from the daemon """
+    prj = 'test_vars'
+    ctx = context.TestContextSCH(test_dir, prj, 'daemon_interrupt', '')
+    # The preflight modifies the project, use a copy
+    for ext in ('.kicad_sch', '.kicad_pro'):
+        shutil.copy2(ctx.get_board_dir(prj+ext), ctx.get_out_path(prj+ext))
+    log_file = ctx.get_out_path('daemon.log')
+    daemon, cmd, err = start_daemon(ctx, ['-L', log_file])
+    try:
+        cmd += ['-e', ctx.get_out_path(prj+'.kicad_sch'), '-c', ctx.yaml_file, '-d', ctx.output_dir]
+        env = dict(os.environ)
+        flag = env['DAEMON_FLAG'] = ctx.get_out_path('started')
+        client = subprocess.Popen(cmd, env=env)
+        assert wait_for_file(flag)
+        start = time.time()
+        client.send_signal(signal.SIGINT)
+        assert client.wait(10) == 130
+        # The job must finish without waiting for the `sleep`
+        assert wait_for_file(err, 'disconnected, interrupting it')
+        assert wait_for_file(err, 'finished (')
+        assert time.time()-start < 30
+    finally:
+        daemon.send_signal(signal.SIGINT)
+        daemon.wait(10)
+    with open(log_file, 'rt') as f:
+        log = f.read()
+    assert 'KiBot daemon waiting for jobs' in log
+    # Messages from the job
+    assert 'Executing: ' not in log
+    ctx.clean_up(keep_project=True)
@@ -1,20 +1,27 @@
 from decimal import Decimal as D
+from glob import glob
 import os
 import re
+from shutil import rmtree
 import pytest
 import coverage
 import logging
 import requests
 import subprocess
 import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
 from . import context
 from kibot.layer import Layer
-from kibot.pre_base import BasePreFlight
+from kibot.pre_base import BasePreFlight, PreFlightError
 from kibot.out_base import BaseOutput
 from kibot.gs import GS
 from kibot.kiplot import load_actions, _import, load_board, generate_makefile
 from kibot.dep_downloader import search_as_plugin
 from kibot.registrable import RegOutput, RegFilter
+from kibot.error import PlotError
 from kibot.misc import (WRONG_INSTALL, BOM_ERROR, DRC_ERROR, ERC_ERROR, PDF_PCB_PRINT, KICAD2STEP_ERR)
 from kibot.bom.columnlist import ColumnList
 from kibot.bom.units import get_prefix, comp_match
@@ -22,9 +29,18 @@ import kibot.bom.units as units
 from kibot.bom.electro_grammar import parse
 from kibot.__main__ import detect_kicad
 from kibot.kicad.config import KiConf
+from kibot.kicad.v5_sch import SymLib
+from kibot import log
 from kibot.globals import Globals
 from kibot.PcbDraw.unit import read_resistance
 from kibot.out_download_datasheets import Download_Datasheets_Options
+from kibot.out_blender_export import Blender_ExportOptions
+from kibot.out_any_layer import AnyLayerOptions
+from kibot.out_report import ReportOptions, compile_template
+from kibot.out_diff import DiffOptions
+from kibot.board_scan import BoardScan
+from kibot.create_pdf import create_pdf_from_pages
+from kibot import PyPDF2
 
 cov = coverage.Coverage()
 mocked_check_output_FNF = True
@@ -360,6 +376,31 @@ def test_layer_no_id():
         assert str(la) == "F.Cu ('Top' F_Cu)"
 
 
+def mocked_plot_one_layer(self, plot_ctrl, po, la, output_dir, debug=None):
+    if la == 'warn':
+        logging.getLogger('kibot').warning('(W1) Warning from a child')
+    elif la == 'fail':
+        GS.exit_with_error('Failed to plot', PDF_PCB_PRINT)
+    return la+'.gbr'
+
+
+@pytest.mark.indep
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="Needs fork")
+def test_plot_layers_parallel_fail(monkeypatch):
+    """ A layer failing in a child process must stop the run, not hang it.
+        The warnings from the children must be counted """
+    monkeypatch.setattr(AnyLayerOptions, 'plot_one_layer', mocked_plot_one_layer)
+    with context.cover_it(cov):
+        o = AnyLayerOptions()
+        warns = log.MyLogger.warn_tcnt
+        assert o.plot_layers_parallel(None, None, ['a', 'warn', 'b'], '', 2) == ['a.gbr', 'warn.gbr', 'b.gbr']
+        assert log.MyLogger.warn_tcnt == warns+1
+        with pytest.raises(SystemExit) as e:
+            o.plot_layers_parallel(None, None, ['a', 'fail', 'warn', 'b'], '', 3)
+        assert e.value.code == PDF_PCB_PRINT
+        assert log.MyLogger.warn_tcnt == warns+2
+
+
 @pytest.mark.indep
 def test_makefile_kibot_sys(test_dir):
     ctx = context.TestContext(test_dir, 'test_v5', 'empty_zip', '')
@@ -570,7 +611,7 @@ class Comp:
         self.ref = 'R1'
 
 
-def mocked_requests_get(url, allow_redirects=True, headers=None, timeout=20):
+def mocked_requests_get(self, url, allow_redirects=True, headers=None, timeout=20):
     res = requests.Response()
     if url == '1':
         res.status_code = 666
@@ -614,7 +655,7 @@ def test_ds_net_error(test_dir, caplog, monkeypatch):
             o.download(c, 'ok', '', dummy, None)
             o._dry = False
             assert dummy in o._created
-            m.setattr('requests.get', mocked_requests_get)
+            m.setattr('requests.Session.get', mocked_requests_get)
             caplog.clear()
             o.download(c, '1', 'pp', '1N1234', None)
             assert 'Failed with status 666' in caplog.text
@@ -633,3 +674,431 @@ def test_ds_net_error(test_dir, caplog, monkeypatch):
             caplog.clear()
             o.download(c, '6', 'pp', '1N1234', None)
             assert 'Hello!' in caplog.text
+
+
+@pytest.mark.indep
+def test_ds_conditional(test_dir, monkeypatch):
+    """ Repeated URLs are fetched once and the second run uses a conditional request """
+    ctx = context.TestContext(test_dir, 'test_v5', 'empty_zip', '')
+    srv_dir = ctx.get_out_path('server')
+    out_dir = ctx.get_out_path('DS')
+    os.makedirs(srv_dir, exist_ok=True)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(srv_dir, 'ds.pdf'), 'wb') as f:
+        f.write(b'Datasheet')
+
+    codes = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=srv_dir, **kwargs)
+
+        def log_request(self, code='-', size='-'):
+            codes.append(int(code))
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/ds.pdf'.format(server.server_port)
+    monkeypatch.setenv('KIBOT_CACHE_DIR', ctx.get_out_path('cache'))
+    try:
+        with context.cover_it(cov):
+            o = Download_Datasheets_Options()
+            c = Comp()
+            for _ in range(2):
+                o.load_meta()
+                o._downloaded = set()
+                o._created = []
+                o._pool = ThreadPoolExecutor(max_workers=2)
+                name = o.download(c, url, out_dir, 'ds.pdf', None)
+                o.download(c, url, out_dir, 'ds_copy.pdf', name)
+                o._pool.shutdown(wait=True)
+                o._pool = None
+                o.finish_downloads()
+                o.save_meta()
+    finally:
+        server.shutdown()
+    assert codes == [200, 304]
+    with open(os.path.join(out_dir, 'ds_copy.pdf'), 'rb') as f:
+        assert f.read() == b'Datasheet'
+
+
+class FakePreFlight(object):
+    """ Just what schedule() and run_group() need """
+    conflicts_with = BasePreFlight.conflicts_with
+
+    def __init__(self, reads=(), writes=(), error=None, delay=0):
+        self._reads = set(reads)
+        self._writes = None if writes is None else set(writes)
+        self.error = error
+        self.delay = delay
+
+    def run(self):
+        time.sleep(self.delay)
+        if self.error:
+            raise PlotError(self.error)
+
+    def is_sch(self):
+        return False
+
+    def is_pcb(self):
+        return False
+
+
+@pytest.mark.indep
+def test_pre_schedule(monkeypatch):
+    pres = [('a', FakePreFlight(reads={'pcb'})),
+            ('b', FakePreFlight(reads={'sch'})),
+            ('c', FakePreFlight(writes=None)),
+            ('d', FakePreFlight(reads={'pcb'})),
+            ('e', FakePreFlight(writes={'pcb'})),
+            ('f', FakePreFlight(reads={'pcb'})),
+            ('g', FakePreFlight(reads={'files'}))]
+    p = dict(pres)
+    assert not p['a'].conflicts_with(p['b'])
+    assert not p['a'].conflicts_with(p['d'])
+    assert p['d'].conflicts_with(p['e']) and p['e'].conflicts_with(p['d'])
+    assert not p['e'].conflicts_with(p['g'])
+    with context.cover_it(cov):
+        monkeypatch.setattr(GS, 'global_parallel_preflights', True)
+        groups = BasePreFlight.schedule(pres)
+        assert [[k for k, _ in g] for g in groups] == [['a', 'b'], ['c'], ['d'], ['e'], ['f', 'g']]
+        # Disabled: one after the other, in the same order
+        monkeypatch.setattr(GS, 'global_parallel_preflights', False)
+        groups = BasePreFlight.schedule(pres)
+        assert [[k for k, _ in g] for g in groups] == [[k] for k, _ in pres]
+
+
+@pytest.mark.indep
+@pytest.mark.parametrize('workers', [1, 4])
+def test_pre_run_group_errors(monkeypatch, workers):
+    """ The error reported is the one from the first failing preflight, as in the serial run """
+    monkeypatch.setattr(GS, 'global_workers', workers)
+    with context.cover_it(cov):
+        # The first fails after the second
+        group = [('ok', FakePreFlight()),
+                 ('first', FakePreFlight(error='first error', delay=0.2)),
+                 ('second', FakePreFlight(error='second error'))]
+        with pytest.raises(PreFlightError) as e:
+            BasePreFlight.run_group(group)
+        assert e.value.name == 'first'
+        assert str(e.value.error) == 'first error'
+        # Only the last fails
+        with pytest.raises(PreFlightError) as e:
+            BasePreFlight.run_group(group[:1]+group[2:])
+        assert e.value.name == 'second'
+        BasePreFlight.run_group(group[:1])
+
+
+LIB_WITH_WARNINGS = """EESchema-LIBRARY Version 2.4
+#encoding utf-8
+DEF R R 0 0 N Y 1 F N
+F0 "R" 80 0 50 V V C CNN
+F1 "R" 0 0 50 V V C CNN
+DRAW
+S -40 -100 40 100 0 1 10 N
+ENDDRAW
+ENDDEF
+DEF BAD BAD 0 0 N Y 1 F N
+F0 "BAD" 80 0 50 V V C CNN
+F1 "BAD" 0 0 50 V V C CNN
+DRAW
+P 2 0 1 10 0 0 Z
+ENDDRAW
+ENDDEF
+#End Library
+"""
+
+
+def mocked_utime(*args, **kwargs):
+    raise PermissionError('Read-only')
+
+
+@pytest.mark.indep
+def test_lib_index_warnings(test_dir, monkeypatch):
+    """ The warnings from symbols we don't use are the same when using the index """
+    ctx = context.TestContext(test_dir, 'bom', 'bom')
+    lib = ctx.get_out_path('warn.lib')
+    with open(lib, 'wt') as f:
+        f.write(LIB_WITH_WARNINGS)
+    monkeypatch.setenv('KIBOT_CACHE_DIR', ctx.get_out_path('cache'))
+    warnings = []
+    with context.cover_it(cov):
+        for _ in range(2):
+            needed = {'warn:R': None}
+            n = log.MyLogger.warn_tcnt
+            SymLib().load(lib, 'warn', needed)
+            warnings.append(log.MyLogger.warn_tcnt-n)
+            assert needed['warn:R'] is not None
+    assert warnings == [1, 1]
+    assert len(glob(os.path.join(ctx.get_out_path('cache'), 'lib_index', '*.json'))) == 1
+    # A read-only cache is just ignored
+    monkeypatch.setattr(os, 'utime', mocked_utime)
+    with context.cover_it(cov):
+        SymLib().load(lib, 'warn', {'warn:R': None})
+    ctx.clean_up()
+
+
+@pytest.mark.indep
+def test_blender_shards(monkeypatch):
+    """ The points of view are split in contiguous groups, keeping the order """
+    monkeypatch.setattr(GS, 'global_workers', 3)
+    povs = list(range(7))
+    outputs = [[('png', 'pov{}.png'.format(n))] for n in povs]
+    with context.cover_it(cov):
+        o = Blender_ExportOptions()
+        # Default: only one Blender instance
+        assert o.get_shards(povs, outputs) == [(povs, outputs)]
+        o.workers = 3
+        shards = o.get_shards(povs, outputs)
+        assert [s[0] for s in shards] == [[0, 1], [2, 3], [4, 5, 6]]
+        # The outputs follow their points of view
+        assert all(out == [[('png', 'pov{}.png'.format(n))] for n in pov] for pov, out in shards)
+        # Joining the groups gives the original order
+        assert [p for s in shards for p in s[0]] == povs
+        # Never more instances than points of view
+        o.workers = 10
+        assert len(o.get_shards(povs[:2], outputs[:2])) == 2
+        # 0 is the global value
+        o.workers = 0
+        assert len(o.get_shards(povs, outputs)) == 3
+
+
+@pytest.mark.indep
+@pytest.mark.parametrize('streaming', [True, False])
+@pytest.mark.parametrize('forced_width', [None, 297])
+def test_create_pdf_from_pages(test_dir, streaming, forced_width):
+    """ Join the first page of the small reference PDFs and read them back """
+    ctx = context.TestContext(test_dir, 'bom', 'bom', '')
+    ref = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reference')
+    files = sorted(f for f in glob(os.path.join(ref, '*', '*.pdf')) if os.path.getsize(f) < 20000)
+    assert len(files) > 10
+    output = ctx.get_out_path('joined.pdf')
+    os.makedirs(ctx.output_dir, exist_ok=True)
+    with context.cover_it(cov):
+        create_pdf_from_pages(files, output, forced_width=forced_width, streaming=streaming)
+    with open(output, 'rb') as f:
+        joined = PyPDF2.PdfFileReader(f)
+        assert joined.getNumPages() == len(files)
+        for n, fname in enumerate(files):
+            page = joined.getPage(n)
+            with open(fname, 'rb') as f_ori:
+                ori = PyPDF2.PdfFileReader(f_ori).getPage(0)
+                width = float(ori.mediaBox.getWidth())
+                text = ori.extractText()
+            if forced_width is None:
+                assert float(page.mediaBox.getWidth()) == pytest.approx(width)
+            else:
+                assert float(page.mediaBox.getWidth())*25.4/72 == pytest.approx(forced_width, abs=0.1)
+            assert page.extractText() == text, fname
+    ctx.clean_up()
+
+
+@pytest.mark.indep
+def test_expand_text_variables_memo(test_dir, monkeypatch):
+    """ A value already expanded changes after set_text_variables modifies it """
+    ctx = context.TestContext(test_dir, 'bom', 'bom', '')
+    pro = ctx.get_out_path('memo.kicad_pro')
+    os.makedirs(ctx.output_dir, exist_ok=True)
+    with open(pro, 'wt') as f:
+        f.write('{"text_variables": {"REV": "1"}}')
+    monkeypatch.setattr(GS, 'pro_file', pro)
+    monkeypatch.setattr(GS, 'pro_variables', None)
+    monkeypatch.setattr(GS, 'board', None)
+    monkeypatch.setattr(GS, 'ki5', False)
+    monkeypatch.setattr(GS, 'expanded_texts', {})
+    with context.cover_it(cov):
+        assert GS.expand_text_variables('Rev: ${REV}') == 'Rev: 1'
+        assert GS.expanded_texts['Rev: ${REV}'] == 'Rev: 1'
+        load_actions()
+        init_globals()
+        pre = BasePreFlight.get_object_for('set_text_variables', [{'name': 'REV', 'text': '2'}])
+        pre.config(None)
+        pre.apply()
+        assert GS.expand_text_variables('Rev: ${REV}') == 'Rev: 2'
+        # A direct change needs an explicit invalidation
+        GS.pro_variables['REV'] = '3'
+        GS.text_variables_changed()
+        assert GS.expand_text_variables('Rev: ${REV}') == 'Rev: 3'
+    ctx.clean_up()
+
+
+@pytest.mark.indep
+def test_expand_text_variables_no_memo(monkeypatch):
+    """ Values that don't come from the project aren't reused """
+    monkeypatch.setattr(GS, 'pro_variables', {'REV': '1'})
+    monkeypatch.setattr(GS, 'expanded_texts', {})
+    monkeypatch.setattr(GS, 'global_use_os_env_for_expand', True)
+    monkeypatch.setenv('KIBOT_TEST_VAR', 'env1')
+    with context.cover_it(cov):
+        assert GS.expand_text_variables('${REV} ${EXTRA}', {'EXTRA': 'a'}) == '1 a'
+        assert GS.expand_text_variables('${REV} ${EXTRA}', {'EXTRA': 'b'}) == '1 b'
+        # The project variables take precedence over the extra ones
+        assert GS.expand_text_variables('${REV}', {'REV': 'x'}) == '1'
+        assert GS.expand_text_variables('${KIBOT_TEST_VAR}') == 'env1'
+        monkeypatch.setenv('KIBOT_TEST_VAR', 'env2')
+        assert GS.expand_text_variables('${KIBOT_TEST_VAR}') == 'env2'
+        assert GS.expanded_texts == {}
+        assert GS.expand_text_variables('Rev ${REV}') == 'Rev 1'
+        assert GS.expanded_texts == {'Rev ${REV}': 'Rev 1'}
+
+
+@pytest.mark.indep
+def test_expand_text_variables_unknown(monkeypatch, caplog):
+    """ Each unknown variable is reported only once """
+    monkeypatch.setattr(GS, 'pro_variables', {})
+    monkeypatch.setattr(GS, 'expanded_texts', {})
+    monkeypatch.setattr(GS, 'unknown_text_vars', set())
+    monkeypatch.setattr(GS, 'global_use_os_env_for_expand', False)
+    n = log.MyLogger.warn_tcnt
+    with context.cover_it(cov):
+        for _ in range(3):
+            assert GS.expand_text_variables('${UNKNOWN_1} ${UNKNOWN_1}') == '${UNKNOWN_1} ${UNKNOWN_1}'
+            assert GS.expand_text_variables('${UNKNOWN_2}', {'OTHER': '1'}) == '${UNKNOWN_2}'
+    assert log.MyLogger.warn_tcnt-n == 2
+    assert caplog.text.count('Unknown text variable `UNKNOWN_1`') == 1
+    assert caplog.text.count('Unknown text variable `UNKNOWN_2`') == 1
+
+
+REPORT_TEMPLATE = """# Report for ${name}
+Width: ${width_mm} mm, ${width_in} in, ${width_mils} mils
+Formatted: ${%6.3f,width_mm} [${%-8s,name}] [${%5.1f,name}]
+Unbounded: ${big_mm}
+Private: ${_secret} ${%s,_secret}
+Project: ${REV} ${TITLE} ${FILENAME}
+#?width > 1000000
+Wide board
+#?width < 1000000
+Narrow board
+#defined_tracks:- ${track_mm} mm (${%d,track_mils} mils) ${_secret}
+End
+"""
+# Generated using the old line by line expansion
+REPORT_OUTPUT = """# Report for test
+Width: 1.5 mm, 0.06 in, 59 mils
+Formatted:  1.500 [test    ] [     ]
+Unbounded: N/A
+Private: ${_secret} hidden
+Project: 3 Title board.kicad_pcb
+Wide board
+- 0.2 mm (8 mils) ${_secret}
+- 0.25 mm (10 mils) ${_secret}
+End
+"""
+
+
+@pytest.mark.indep
+def test_report_template(test_dir, monkeypatch):
+    """ The compiled templates give the same output as the old line by line expansion """
+    ctx = context.TestContext(test_dir, 'bom', 'bom', '')
+    os.makedirs(ctx.output_dir, exist_ok=True)
+    template = ctx.get_out_path('report.txt')
+    with open(template, 'wt') as f:
+        f.write(REPORT_TEMPLATE)
+    monkeypatch.setattr(GS, 'pcb_title', 'Title')
+    monkeypatch.setattr(GS, 'pcb_comp', 'Company')
+    monkeypatch.setattr(GS, 'pcb_date', '2024-01-01')
+    monkeypatch.setattr(GS, 'pcb_rev', 'A')
+    monkeypatch.setattr(GS, 'pcb_com', ['']*9)
+    monkeypatch.setattr(GS, 'pcb_basename', 'board')
+    monkeypatch.setattr(GS, 'kicad_version', '8.0.0')
+    monkeypatch.setattr(GS, 'pro_variables', {'REV': '3'})
+    with context.cover_it(cov):
+        load_actions()
+        o = ReportOptions()
+        o.to_ascii = False
+        o.name = 'test'
+        o.width = GS.from_mm(1.5)
+        o.big = float('inf')
+        o._secret = 'hidden'
+        o._track_sizes = [0, GS.from_mm(0.25), GS.from_mm(0.2)]
+        # The second time the compiled template is reused
+        hits = compile_template.cache_info().hits
+        for n in range(2):
+            output = ctx.get_out_path('report{}.txt'.format(n))
+            o.do_template(template, output)
+            with open(output, 'rt') as f:
+                assert f.read() == REPORT_OUTPUT
+        assert compile_template.cache_info().hits == hits+1
+    ctx.clean_up()
+
+
+def git_commit(repo, msg):
+    subprocess.run(['git', 'add', '.'], cwd=repo, check=True)
+    subprocess.run(['git', '-c', 'user.email=pytest@nowherem.com', '-c', 'user.name=KiBot test', 'commit', '-q', '-m', msg],
+                   cwd=repo, check=True)
+
+
+@pytest.mark.indep
+def test_diff_blob_wks(test_dir):
+    """ The blob strategy extracts the drawing sheet used by the project, or falls back to a worktree """
+    ctx = context.TestContext(test_dir, 'bom', 'bom', '')
+    repo = ctx.get_out_path('repo')
+    os.makedirs(os.path.join(repo, 'wks'))
+    pcb = os.path.join(repo, 'board.kicad_pcb')
+    with open(pcb, 'wt') as f:
+        f.write('(kicad_pcb)\n')
+    pro = os.path.join(repo, 'board.kicad_pro')
+    with open(pro, 'wt') as f:
+        f.write('{"pcbnew": {"page_layout_descr_file": "${KIPRJMOD}/wks/frame.kicad_wks"}}')
+    wks = os.path.join(repo, 'wks', 'frame.kicad_wks')
+    with open(wks, 'wt') as f:
+        f.write('(kicad_wks old)\n')
+    subprocess.run(['git', 'init', '-q', '.'], cwd=repo, check=True)
+    git_commit(repo, 'Reference')
+    with open(wks, 'wt') as f:
+        f.write('(kicad_wks new)\n')
+    with context.cover_it(cov):
+        o = DiffOptions()
+        o.file = pcb
+        o.repo_dir = repo
+        o.git_command = 'git'
+        o.git_reader = None
+        o.dirs_to_remove = []
+        try:
+            name = o.materialize_git('HEAD')
+            assert name is not None
+            with open(os.path.join(os.path.dirname(name), 'wks', 'frame.kicad_wks'), 'rt') as f:
+                assert f.read() == '(kicad_wks old)\n'
+            # A drawing sheet outside the repo needs a real checkout
+            with open(pro, 'wt') as f:
+                f.write('{"pcbnew": {"page_layout_descr_file": "../frame.kicad_wks"}}')
+            git_commit(repo, 'Outside')
+            assert o.materialize_git('HEAD') is None
+        finally:
+            o.git_reader.close()
+            for d in o.dirs_to_remove:
+                rmtree(d, ignore_errors=True)
+    ctx.clean_up()
+
+
+class FakeBoard(object):
+    """ An empty board, just what BoardScan needs """
+    def GetTracks(self):
+        return []
+
+    def GetFootprints(self):
+        return []
+
+    def GetModules(self):
+        return []
+
+
+@pytest.mark.indep
+def test_board_scan_cache(monkeypatch):
+    """ The scan is reused until GS.board changes or is modified """
+    monkeypatch.setattr(GS, 'board', FakeBoard())
+    with context.cover_it(cov):
+        scan = BoardScan.get()
+        placements = BoardScan.get_placements()
+        assert BoardScan.get() is scan
+        assert BoardScan.get(GS.board) is scan
+        assert BoardScan.get_placements() is placements
+        # Modified
+        GS.board_changed()
+        assert BoardScan.get() is not scan
+        scan = BoardScan.get()
+        assert BoardScan.get_placements() is not placements
+        # Loaded again
+        GS.board = FakeBoard()
+        assert BoardScan.get() is not scan
+    BoardScan.invalidate()
@@ -225,7 +225,9 @@ def check_comps(rows, comps):
 def test_position_variant_t2i(test_dir):
     prj = 'kibom-variant_3'
     ctx = context.TestContext(test_dir, prj, 'simple_position_t2i', POS_DIR)
-    ctx.run()
+    ctx.run(extra_debug=True)
+    # The footprints are scanned once, all the variants use the same data
+    assert ctx.err.count('Scanning the footprints placement') == 1
     files = ['-both_pos.csv', '-both_pos_[2].csv', '-both_pos_(production).csv', '-both_pos_(test).csv']
     files = [prj+f for f in files]
     rows, header, info = ctx.load_csv(files[0])
@@ -422,3 +424,27 @@ def test_position_sub_pcb_bp_2(test_dir):
     expect_position(ctx, os.path.join(POS_DIR, prj+'-both_pos_charger.pos'), ['J13'], ['J2', 'J3'],
                     a_pos={'J13': (126.5+1.5, 95-5, 'top', 90)})
     ctx.clean_up(keep_project=True)
+
+
+@pytest.mark.skipif(context.ki5(), reason="KiKit currently supports KiCad 6 only")
+def test_position_sub_pcb_bp_kikit_cache(test_dir, monkeypatch):
+    """ The second run uses the sub-PCBs separated by the first run, unless we disable the cache """
+    prj = 'batteryPack'
+    ctx = context.TestContext(test_dir, prj, 'position_sub_pcb_bp_kikit', POS_DIR)
+    out = os.path.join(POS_DIR, prj+'-both_pos_charger.pos')
+    monkeypatch.setenv('KIBOT_CACHE_DIR', ctx.get_out_path('cache'))
+    ctx.run(extra=['-g', 'variant=default[charger]'])
+    ctx.search_err('Using cached separation', invert=True)
+    with open(ctx.get_out_path(out), 'rt') as f:
+        first = f.read()
+    ctx.run(extra=['-g', 'variant=default[charger]'])
+    ctx.search_err('Using cached separation for the `charger` sub-PCB')
+    with open(ctx.get_out_path(out), 'rt') as f:
+        assert f.read() == first
+    # Without the cache we separate it again
+    no_cache = ctx.yaml_file.replace('kikit.kibot', 'kikit_no_cache.kibot')
+    ctx.run(extra=['-c', no_cache, '-g', 'variant=default[charger]'], no_yaml_file=True)
+    ctx.search_err('Using cached separation', invert=True)
+    with open(ctx.get_out_path(out), 'rt') as f:
+        assert f.read() == first
+    ctx.clean_up(keep_project=True)
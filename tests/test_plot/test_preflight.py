@@ -49,6 +49,48 @@ def test_erc_k8_1(test_dir):
     ctx.clean_up()
 
 
+def check_xrc_cache(ctx, monkeypatch, nm, files, design, change, reports):
+    """ Runs the xRC twice, the second one must use the cached results.
+        Then changes the design and checks the cache isn't used """
+    # Work with a copy of the project, so we can modify it
+    for f in files:
+        shutil.copy2(ctx.get_board_dir(f), ctx.get_out_path(f))
+    board = ctx.get_out_path(files[0])
+    monkeypatch.setenv('KIBOT_CACHE_DIR', ctx.get_out_path('cache'))
+    cached = 'Using the cached {} results'.format(nm)
+    ctx.run(filename=board)
+    ctx.search_err(cached, invert=True)
+    first = {}
+    for r in reports:
+        with open(ctx.get_out_path(r), 'rt') as f:
+            first[r] = f.read()
+    # Nothing changed, must be a cache hit with the same reports
+    ctx.run(filename=board)
+    ctx.search_err(cached)
+    for r in reports:
+        with open(ctx.get_out_path(r), 'rt') as f:
+            assert f.read() == first[r], r
+    # Change the design, the cache must be invalidated
+    design = ctx.get_out_path(design)
+    with open(design, 'rt') as f:
+        content = f.read()
+    assert change[0] in content
+    with open(design, 'wt') as f:
+        f.write(content.replace(change[0], change[1]))
+    ctx.run(filename=board)
+    ctx.search_err(cached, invert=True)
+
+
+@pytest.mark.skipif(not context.ki8(), reason="Needs ERC CLI")
+def test_erc_cache_k8(test_dir, monkeypatch):
+    """ Reuse the ERC results when the schematic didn't change """
+    prj = 'bom'
+    ctx = context.TestContext(test_dir, prj, 'erc_cache_k8', '')
+    check_xrc_cache(ctx, monkeypatch, 'ERC', [prj+'.kicad_pcb', prj+'.kicad_sch'], prj+'.kicad_sch',
+                    ('(rev "r1")', '(rev "r2")'), [prj+'-erc.'+ext for ext in ('html', 'rpt', 'csv', 'json')])
+    ctx.clean_up()
+
+
 @pytest.mark.slow
 @pytest.mark.eeschema
 def test_erc_fail_1(test_dir):
@@ -227,6 +269,16 @@ def test_drc_k8_1(test_dir):
     ctx.clean_up(keep_project=True)
 
 
+@pytest.mark.skipif(not context.ki8(), reason="Needs DRC CLI")
+def test_drc_cache_k8(test_dir, monkeypatch):
+    """ Reuse the DRC results when the PCB didn't change """
+    prj = 'bom_ok_drc'
+    ctx = context.TestContext(test_dir, prj, 'drc_cache_k8', '')
+    check_xrc_cache(ctx, monkeypatch, 'DRC', [prj+'.kicad_pcb', prj+'.kicad_pro'], prj+'.kicad_pcb',
+                    ('(paper "A4")', '(paper "A3")'), [prj+'-drc.'+ext for ext in ('html', 'rpt', 'csv', 'json')])
+    ctx.clean_up()
+
+
 @pytest.mark.slow
 @pytest.mark.pcbnew
 def test_drc_filter_1(test_dir):
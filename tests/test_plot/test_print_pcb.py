@@ -129,6 +129,8 @@ def test_pcb_print_simple_1(test_dir):
     prj = 'light_control'
     ctx = context.TestContext(test_dir, prj, 'pcb_print_2')
     ctx.run(extra_debug=True)
+    # The second page with F.Mask uses the solder mask rendered for the first page
+    ctx.search_err(r'Using the already rendered solder mask')
     ctx.expect_out_file(prj+'-F_Cu_mono.png')
     ctx.expect_out_file(prj+'-F_Cu_color.png')
     if is_debian:
@@ -195,3 +197,25 @@ def test_var_rename_kicost_footprint_1(test_dir):
     ctx.run(extra=['-g', 'variant=development'])
     ctx.compare_image(prj+'-assembly_page_01_(DEV).png', tol=DIFF_TOL, sub=True)
     ctx.clean_up()
+
+
+@pytest.mark.slow
+@pytest.mark.pcbnew
+@pytest.mark.skipif(context.ki5(), reason="KiCad 5 uses KiAuto to plot the frame")
+def test_pcb_print_static_frame(test_dir, monkeypatch):
+    """ The frame plotted in two parts (the static one only once) is the same we get plotting it for each page """
+    prj = 'bom'
+    ctx = context.TestContext(test_dir, prj, 'pcb_print_frame')
+    ctx.run()
+    ctx.search_err(r'Plotting the static part of the frame')
+    pages = [prj+'-assembly_page_0{}.svg'.format(n) for n in range(1, 4)]
+    # Keep the pages, the second run will overwrite them
+    os.makedirs(ctx.get_out_path('static'))
+    for page in pages:
+        os.rename(ctx.get_out_path(page), ctx.get_out_path(os.path.join('static', page)))
+    monkeypatch.setenv('KIBOT_NO_STATIC_FRAME', '1')
+    ctx.run()
+    ctx.search_err(r'Plotting the static part of the frame', invert=True)
+    for page in pages:
+        ctx.compare_image(page, os.path.join('static', page), ref_out_dir=True, height='100%')
+    ctx.clean_up()
@@ -147,6 +147,11 @@ def cover_it(cov):
     cov.save()
 
 
+class InlineStr(str):
+    """ A string stored in the XLSX cell, not an index to the shared strings """
+    pass
+
+
 class TestContext(object):
 
     def __init__(self, test_dir, board_name, yaml_name, sub_dir='', yaml_compressed=False, add_cfg_kmajor=False,
@@ -859,6 +864,10 @@ class TestContext(object):
                     type = cell.attrib['t']
                 else:
                     type = 'n'   # default: number
+                if type == 'inlineStr':
+                    # Used in constant memory mode
+                    this_row.append(InlineStr(''.join(t.text for t in cell.iter(ns+'t'))))
+                    continue
                 value = cell.find(ns+'v')
                 if value is not None:
                     if type == 'n':
@@ -878,15 +887,19 @@ class TestContext(object):
                 links[r.attrib['ref']] = r.attrib[nr+'id']
         # Read the strings
         strings = self.get_out_path(os.path.join('desc', 'xl', 'sharedStrings.xml'))
-        strs = [t.text for t in ET.parse(strings).getroot().iter(ns+'t')]
+        strs = [t.text for t in ET.parse(strings).getroot().iter(ns+'t')] if os.path.isfile(strings) else []
         # Replace the indexes by the strings
         for r in rows:
             for i, val in enumerate(r):
-                if isinstance(val, str):
+                if isinstance(val, InlineStr):
+                    r[i] = str(val)
+                elif isinstance(val, str):
                     r[i] = strs[int(val)]
         for r in sh_head:
             for i, val in enumerate(r):
-                if isinstance(val, str):
+                if isinstance(val, InlineStr):
+                    r[i] = str(val)
+                elif isinstance(val, str):
                     r[i] = strs[int(val)]
         # Translate the links
         if links: